@@ -0,0 +1,26 @@
+"""Compare two benchmark result files: python -m benchmarks.compare old.json new.json"""
+import sys
+import json
+
+
+def load_results(path):
+    with open(path) as f:
+        report = json.load(f)
+    return report["meta"], {(r["case"], r["size"]): r for r in report["results"]}
+
+
+def compare(old_path, new_path):
+    old_meta, old = load_results(old_path)
+    new_meta, new = load_results(new_path)
+    print("old: {}  new: {}".format(old_meta.get("commit"), new_meta.get("commit")))
+    print("{:45s} {:>9s} {:>10s} {:>10s}".format("case", "size", "speedup", "rss ratio"))
+
+    for key in sorted(set(old) & set(new)):
+        o, n = old[key], new[key]
+        speedup = n["items_per_sec"] / o["items_per_sec"] if o["items_per_sec"] and n["items_per_sec"] else float("nan")
+        rss_ratio = n["peak_rss_mb"] / o["peak_rss_mb"] if o["peak_rss_mb"] else float("nan")
+        print("{:45s} {:>9d} {:>9.2f}x {:>9.2f}x".format(key[0], key[1], speedup, rss_ratio))
+
+
+if __name__ == "__main__":
+    compare(*sys.argv[1:3])
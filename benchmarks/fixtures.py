@@ -0,0 +1,101 @@
+import os
+import random
+from xml.sax.saxutils import escape
+from text_augmentation.utils.file_io import txt_io, TmxWriter
+from text_augmentation.utils.writers import XlsxPairWriter
+
+VOCAB_PATH = os.path.join(os.path.dirname(__file__), "..", "text_augmentation", "vocab", "vocab.eng")
+
+XLIFF_NS = "urn:oasis:names:tc:xliff:document:1.2"
+
+
+def synthetic_pairs(size, seed=0, min_words=2, max_words=20):
+    """Deterministic (source, target) pairs of random vocabulary words."""
+    vocab = txt_io(VOCAB_PATH, action='r')
+    rand = random.Random(seed)
+    pairs = []
+    for _ in range(size):
+        src = " ".join(rand.choice(vocab) for _ in range(rand.randint(min_words, max_words)))
+        tgt = " ".join(rand.choice(vocab) for _ in range(rand.randint(min_words, max_words)))
+        pairs.append((src, tgt))
+    return pairs
+
+
+def write_2txt(pairs, path_prefix):
+    files = [path_prefix + ".eng", path_prefix + ".fra"]
+    txt_io(files[0], action='w', write_lines=[p[0] for p in pairs])
+    txt_io(files[1], action='w', write_lines=[p[1] for p in pairs])
+    return files
+
+
+def write_tmx(pairs, path):
+    with TmxWriter(path, "en", "fr", pretty=True) as writer:
+        writer.write_pairs(pairs)
+    return path
+
+
+def write_mxliff(pairs, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<xliff xmlns="{}" xmlns:m="http://www.memsource.com/mxlf/2.0" version="1.2">\n'
+                '<file original="sample.docx" source-language="en" target-language="fr" datatype="x-undefined">\n'
+                '<body>\n'.format(XLIFF_NS))
+        for i, (src, tgt) in enumerate(pairs):
+            f.write('<group id="{0}"><trans-unit id="{0}" m:trans-origin="tm">'
+                    '<source>{1}</source><target>{2}</target></trans-unit></group>\n'
+                    .format(i, escape(src), escape(tgt)))
+        f.write('</body>\n</file>\n</xliff>\n')
+    return path
+
+
+def write_sdlxliff(pairs, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n'
+                '<xliff xmlns:sdl="http://sdl.com/FileTypes/SdlXliff/1.0" xmlns="{}" version="1.2">\n'
+                '<file original="sample.docx" source-language="en-US" target-language="fr-CA" datatype="x-sdlfilterframework2">\n'
+                '<body>\n'.format(XLIFF_NS))
+        for i, (src, tgt) in enumerate(pairs):
+            f.write('<trans-unit id="{0}"><source>{1}</source>'
+                    '<seg-source><mrk mtype="seg" mid="{0}">{1}</mrk></seg-source>'
+                    '<target><mrk mtype="seg" mid="{0}">{2}</mrk></target></trans-unit>\n'
+                    .format(i, escape(src), escape(tgt)))
+        f.write('</body>\n</file>\n</xliff>\n')
+    return path
+
+
+def write_xml(pairs, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<segments>\n')
+        for src, tgt in pairs:
+            f.write('<seg><src>{}</src><tgt>{}</tgt></seg>\n'.format(escape(src), escape(tgt)))
+        f.write('</segments>\n')
+    return path
+
+
+def write_xlsx(pairs, path):
+    with XlsxPairWriter(path, columns=("Source", "Target")) as writer:
+        writer.write_pairs(pairs)
+    return path
+
+
+def make_fixtures(workdir, size, seed=0):
+    """Write every fixture of a given size once, return their paths by format."""
+    os.makedirs(workdir, exist_ok=True)
+    prefix = os.path.join(workdir, "corpus_{}_{}".format(size, seed))
+    pairs = synthetic_pairs(size, seed)
+
+    fixtures = {"2txt": [prefix + ".eng", prefix + ".fra"],
+                "tmx": prefix + ".tmx",
+                "mxliff": prefix + ".mxliff",
+                "sdlxliff": prefix + ".sdlxliff",
+                "xml": prefix + ".xml",
+                "excel": prefix + ".xlsx"}
+    if not all(os.path.isfile(f) for f in fixtures["2txt"] + list(fixtures.values())[1:]):
+        write_2txt(pairs, prefix)
+        write_tmx(pairs, fixtures["tmx"])
+        write_mxliff(pairs, fixtures["mxliff"])
+        write_sdlxliff(pairs, fixtures["sdlxliff"])
+        write_xml(pairs, fixtures["xml"])
+        write_xlsx(pairs, fixtures["excel"])
+
+    return fixtures
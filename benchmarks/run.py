@@ -0,0 +1,168 @@
+"""Throughput and peak memory benchmarks of augmentation ops, the bad-instance pipeline and TM parsers.
+
+    python -m benchmarks.run --sizes 1000 10000 --output bench_results.json
+    python -m benchmarks.compare old.json new.json
+
+Every case runs in a fresh process so its peak RSS is not inflated by the cases before it.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import resource
+import contextlib
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.fixtures import VOCAB_PATH, make_fixtures
+
+AUGMENT_METHODS = ["swapping", "deletion", "insertion", "replacement"]
+PARSE_FORMATS = ["tmx", "mxliff", "sdlxliff", "xml", "excel", "2txt"]
+
+
+def _augmenter():
+    from text_augmentation.augment import EasyAugmentation
+    ea = EasyAugmentation(VOCAB_PATH)
+    ea.load_vocab()
+    return ea
+
+
+def case_augment(fixtures, method):
+    from text_augmentation.utils.file_io import txt_io
+    ea = _augmenter()
+    texts = txt_io(fixtures["2txt"][0], action='r')
+
+    def run():
+        for text in texts:
+            ea.__getattribute__(method)(text, 2)
+        return len(texts)
+    return run
+
+
+def case_augment_batch(fixtures, method):
+    from text_augmentation.utils.file_io import txt_io
+    ea = _augmenter()
+    texts = txt_io(fixtures["2txt"][0], action='r')
+
+    def run():
+        return len(ea.augment_batch(texts, method, 2))
+    return run
+
+
+def case_augment_corpus(fixtures, method):
+    from text_augmentation.utils.file_io import txt_io
+    ea = _augmenter()
+    corpus = ea.tokenize_corpus(txt_io(fixtures["2txt"][0], action='r'))
+
+    def run():
+        return len(ea.augment_corpus(corpus, method, 2).to_texts())
+    return run
+
+
+def case_pipeline(fixtures):
+    from text_augmentation.augment import EasyAugmentationPipeline
+    num_instances = sum(1 for _ in open(fixtures["2txt"][0]))
+
+    def run():
+        pipe = EasyAugmentationPipeline()
+        pipe.create_bad_instance_from_good(fixtures["2txt"], VOCAB_PATH, num_instances=num_instances)
+        return len(pipe.new_data)
+    return run
+
+
+def case_parse(fixtures, fileType):
+    from text_augmentation.utils.tm_fileparser import TmFileParser
+
+    def run():
+        tfp = TmFileParser(fileType=fileType)
+        tfp.parse(fixtures[fileType])
+        return len(tfp.srcTexts)
+    return run
+
+
+CASES = {"augment.{}".format(m): (case_augment, (m,)) for m in AUGMENT_METHODS}
+CASES.update({"augment_batch.{}".format(m): (case_augment_batch, (m,)) for m in AUGMENT_METHODS})
+CASES.update({"augment_corpus.{}".format(m): (case_augment_corpus, (m,)) for m in AUGMENT_METHODS})
+CASES["pipeline.create_bad_instance_from_good"] = (case_pipeline, ())
+CASES.update({"parse.{}".format(f): (case_parse, (f,)) for f in PARSE_FORMATS})
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (2 ** 20 if sys.platform == "darwin" else 2 ** 10)
+
+
+def run_case(name, fixtures):
+    """Set a case up and time it, in the current process."""
+    case, args = CASES[name]
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        run = case(fixtures, *args)
+        rss_before = _peak_rss_mb()
+        start = time.perf_counter()
+        items = run()
+        seconds = time.perf_counter() - start
+
+    return {"case": name,
+            "items": items,
+            "seconds": seconds,
+            "items_per_sec": items / seconds if seconds > 0 else None,
+            "peak_rss_mb": _peak_rss_mb(),
+            "peak_rss_delta_mb": _peak_rss_mb() - rss_before}
+
+
+def run_isolated(name, fixtures):
+    """Run a case in a fresh spawned process."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(run_case, name, fixtures).result()
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(__file__),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(sizes, workdir, cases=None, seed=0):
+    names = [name for name in CASES if not cases or any(c in name for c in cases)]
+    results = []
+    for size in sizes:
+        fixtures = make_fixtures(workdir, size, seed)
+        for name in names:
+            result = run_isolated(name, fixtures)
+            result["size"] = size
+            results.append(result)
+            print("{:45s} {:>9d} {:>12.1f} items/s {:>9.1f} MB".format(
+                name, size, result["items_per_sec"] or 0.0, result["peak_rss_mb"]))
+
+    return {"meta": {"commit": _git_commit(),
+                     "python": platform.python_version(),
+                     "platform": platform.platform(),
+                     "seed": seed,
+                     "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+            "results": results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--cases", nargs="*", help="only run cases whose name contains one of these")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "text_augmentation_bench"))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.sizes, args.workdir, args.cases, args.seed)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print("Results saved to {}".format(args.output))
+
+
+if __name__ == "__main__":
+    main()
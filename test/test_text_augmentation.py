@@ -1,2 +1,802 @@
-from text_augmentation.augment import EasyAugmentation, EasyAugmentationFrench
+from text_augmentation.augment import EasyAugmentation, EasyAugmentationFrench, EasyAugmentationPipeline
+from text_augmentation.backends import AugmentationBackend, MicroBatcher, StubBackend
+from text_augmentation.edit_plan import EditPlan
+from text_augmentation.embedding import convert_word_vectors, WordVectors
+from text_augmentation.language_packs import LanguagePack, get_language_pack, register_language_pack
+from text_augmentation.utils.alias_table import AliasTable
+from text_augmentation.utils.audit import AuditLog
+from text_augmentation.utils.file_io import txt_io, txt_iter, writeToTmxFile
+from text_augmentation.utils.ingest import TmCorpusIngestor, detect_file_type
+from text_augmentation.utils.metrics import PipelineMetrics
+from text_augmentation.utils.parse_cache import CachedPairs, ParseCache
+from text_augmentation.utils.rng import CounterRNG
+from text_augmentation.utils.sample import LineOffsetIndex, reservoir_sample
+from text_augmentation.utils.tm_fileparser import TmFileParser, parse_mqxliff
+from text_augmentation.utils.token_corpus import TokenizedCorpus, distinct_positions
+from text_augmentation.utils.writers import PairWriter, XlsxPairWriter, get_pair_writer
+import asyncio
+import json
+import locale
+import os
+import random
+import subprocess
+import sys
+import tempfile
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+import numpy as np
+
+# seconds allowed for a cold import of the plain-text augmentation path in a fresh interpreter
+IMPORT_TIME_BUDGET = 1.0
+VOCAB_PATH = os.path.join(os.path.dirname(__file__), "..", "text_augmentation", "vocab", "vocab.eng")
+
+
+def write_input_files(tmpdir, num_pairs=50):
+    """Write parallel good.eng and good.fra files of num_pairs numbered sentences, return their paths."""
+    input_files = [os.path.join(tmpdir, "good.eng"), os.path.join(tmpdir, "good.fra")]
+    with open(input_files[0], "w") as f:
+        f.write("\n".join("source sentence number {}".format(i) for i in range(num_pairs)) + "\n")
+    with open(input_files[1], "w") as f:
+        f.write("\n".join("phrase source numéro {}".format(i) for i in range(num_pairs)) + "\n")
+    return input_files
+
+
+class TestColdImport(unittest.TestCase):
+
+    def test_heavy_dependencies_load_lazily(self):
+        code = ("import sys, time, json\n"
+                "start = time.perf_counter()\n"
+                "import text_augmentation.augment, text_augmentation.utils\n"
+                "elapsed = time.perf_counter() - start\n"
+                "heavy = ['pandas', 'lxml', 'bs4', 'openpyxl', 'regex', 'html_text']\n"
+                "print(json.dumps([elapsed, [m for m in heavy if m in sys.modules]]))")
+        root = os.path.join(os.path.dirname(__file__), "..")
+        output = subprocess.run([sys.executable, "-c", code], cwd=root, check=True, capture_output=True, text=True)
+        elapsed, loaded = json.loads(output.stdout)
+        self.assertEqual(loaded, [])
+        self.assertLess(elapsed, IMPORT_TIME_BUDGET)
+
+    def test_sample_function_after_submodule_import(self):
+        code = ("import text_augmentation.utils.sample\n"
+                "from text_augmentation.utils import sample\n"
+                "import text_augmentation.utils as utils\n"
+                "print(callable(sample), utils.sample is sample, sample.__module__)")
+        root = os.path.join(os.path.dirname(__file__), "..")
+        output = subprocess.run([sys.executable, "-c", code], cwd=root, check=True, capture_output=True, text=True)
+        self.assertEqual(output.stdout.split(), ["True", "True", "text_augmentation.utils.sample"])
+
+
+class TestAugmentBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.ea = EasyAugmentation()
+        self.ea.vocab = ["alpha", "beta", "gamma"]
+        self.texts = ["Financial assets are crucial to our success.", "two words", "single"]
+
+    def test_deletion(self):
+        new_texts = self.ea.augment_batch(self.texts, "deletion", n_words=2, rng=np.random.default_rng(0))
+        self.assertEqual(len(new_texts[0].split()), 5)
+        self.assertTrue(set(new_texts[0].split()) <= set(self.texts[0].split()))
+        self.assertEqual(new_texts[1:], self.texts[1:])
+
+    def test_swapping(self):
+        new_texts = self.ea.augment_batch(self.texts, "swapping", n_words=3, rng=np.random.default_rng(0))
+        self.assertEqual(sorted(new_texts[0].split()), sorted(self.texts[0].split()))
+        self.assertEqual(new_texts[1], "words two")
+        self.assertEqual(new_texts[2], "single")
+
+    def test_insertion_and_replacement(self):
+        inserted = self.ea.augment_batch(self.texts, "insertion", n_words=2, rng=np.random.default_rng(0))
+        self.assertEqual([len(t.split()) for t in inserted], [9, 4, 3])
+        replaced = self.ea.augment_batch(self.texts, "replacement", n_words=1, rng=np.random.default_rng(0))
+        self.assertEqual(sum(w in self.ea.vocab for w in replaced[0].split()), 1)
+        self.assertEqual(replaced[2], "single")
+
+
+class TestEditPlan(unittest.TestCase):
+
+    def setUp(self):
+        self.ea = EasyAugmentation(VOCAB_PATH, seed=0)
+        self.ea.verbose = False
+        self.ea.load_vocab()
+        self.texts = [" ".join("w{}".format(i) for i in range(n)) for n in range(8)]
+
+    def test_plan_is_immutable(self):
+        plan = EditPlan().swap()
+        longer = plan.delete(2).replace()
+        self.assertEqual(plan, EditPlan([("swap", 1)]))
+        self.assertEqual(repr(longer), "EditPlan(swap(1).delete(2).replace(1))")
+        with self.assertRaises(Exception):
+            EditPlan([("shuffle", 1)])
+        with self.assertRaises(Exception):
+            EasyAugmentation().apply_plan("a b c", EditPlan().insert())
+
+    def test_apply_plan(self):
+        rng = np.random.default_rng(1)
+        plan = EditPlan().swap(2).delete(2).replace().insert(2)
+        for apply in (lambda texts: [self.ea.apply_plan(text, plan, rng) for text in texts],
+                      lambda texts: self.ea.apply_plan_batch(texts, plan, rng)):
+            for text, new_text in zip(self.texts, apply(self.texts)):
+                words, new_words = text.split(), new_text.split()
+                # deletion needs more than 2 words, insertion at least one
+                length = len(words) - 2 if len(words) > 2 else len(words)
+                length = length + 2 if length >= 1 else length
+                self.assertEqual(len(new_words), length)
+                kept = [w for w in new_words if w in words]
+                self.assertEqual(len(kept), len(set(kept)))
+
+        deleted = self.ea.apply_plan_batch(["a b c d e"] * 50, EditPlan().delete(2), rng)
+        self.assertTrue(all(len(text.split()) == 3 and "".join(sorted(text.split())) == text.replace(" ", "")
+                            for text in deleted))
+
+
+class TestLanguagePacks(unittest.TestCase):
+
+    def test_match_longest_determiner(self):
+        fra = get_language_pack("fra")
+        self.assertEqual(fra.match("De la maison"), ("de la", 5))
+        self.assertEqual(fra.match("de l'eau"), ("de l'", 5))
+        self.assertEqual(fra.match("L’arbre"), ("l'", 2))
+        self.assertEqual(fra.match("cette table"), ("cette", 5))
+        self.assertIsNone(fra.match("lecture rapide"))
+        self.assertNotIn("la", fra.alternatives("la"))
+
+    def test_add_article_does_not_mutate(self):
+        eaf = EasyAugmentationFrench(seed=0)
+        for _ in range(200):
+            new_text = eaf.add_article("de la maison")
+            self.assertTrue(new_text.endswith(" maison") and not new_text.startswith("de la "))
+        self.assertEqual(len(eaf.articles), 10)
+        self.assertEqual(eaf.add_article("  l'homme   fort", article="le"), "le l'homme fort")
+
+    def test_pluggable_language(self):
+        register_language_pack(LanguagePack("deu", articles=["der", "die", "das"], determiners=["ein", "eine"]))
+        ea = EasyAugmentation(language="deu", seed=0)
+        self.assertIn(ea.add_article("Eine Katze"), ("der Katze", "die Katze", "das Katze"))
+        self.assertIn(EasyAugmentation(language="eng").add_article("The cat"), ("a cat", "an cat"))
+        with self.assertRaises(Exception):
+            EasyAugmentation().add_article("le chat")
+
+
+class TestEmbeddings(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.words = ["cat", "dog", "car", "truck", "apple", "pear", "Cat"]
+        self.matrix = np.array([[1, 0.1, 0], [0.9, 0.2, 0], [0, 1, 0.1], [0.1, 0.9, 0],
+                                [0, 0, 1], [0, 0.2, 0.9], [1, 0.12, 0]], dtype=np.float32)
+        self.vec_path = os.path.join(self.tmpdir.name, "vectors.vec")
+        with open(self.vec_path, "w") as f:
+            f.write("{} 3\n".format(len(self.words)))
+            for word, vector in zip(self.words, self.matrix):
+                f.write(word + " " + " ".join(str(v) for v in vector) + "\n")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_blocked_neighbours_match_brute_force(self):
+        vectors = convert_word_vectors(self.vec_path, os.path.join(self.tmpdir.name, "vec"), chunk_size=3)
+        vectors.build_neighbours(k=3, block_size=2)
+
+        normalized = self.matrix / np.linalg.norm(self.matrix, axis=1, keepdims=True)
+        sims = normalized @ normalized.T
+        np.fill_diagonal(sims, -np.inf)
+        # same similarities as a brute-force top 3 (ids may differ on ties), most similar first
+        expected = -np.sort(-sims, axis=1)[:, :3]
+        np.testing.assert_allclose(np.take_along_axis(sims, vectors.neighbours.astype(np.int64), axis=1), expected,
+                                   rtol=1e-6)
+        np.testing.assert_allclose(vectors.similarities.astype(np.float32), expected, atol=1e-3)
+        self.assertEqual(vectors.neighbours.dtype, np.int32)
+
+        # .npy matrix with a words file, float16 store
+        np.save(os.path.join(self.tmpdir.name, "matrix.npy"), self.matrix)
+        with open(os.path.join(self.tmpdir.name, "words.txt"), "w") as f:
+            f.write("\n".join(self.words))
+        small = convert_word_vectors(os.path.join(self.tmpdir.name, "matrix.npy"),
+                                     os.path.join(self.tmpdir.name, "small"), max_words=6, dtype=np.float16,
+                                     words_path=os.path.join(self.tmpdir.name, "words.txt"))
+        self.assertEqual((len(small), small.vectors.dtype), (6, np.float16))
+        small.build_neighbours(k=1)
+        self.assertEqual([small.words[i] for i in small.neighbours[:, 0]], ["dog", "cat", "truck", "car", "pear",
+                                                                            "apple"])
+
+    def test_embedding_replacement(self):
+        convert_word_vectors(self.vec_path, os.path.join(self.tmpdir.name, "vec"))
+        ea = EasyAugmentation(seed=0)
+        with self.assertRaises(Exception):
+            ea.embedding_replacement("the cat")
+        ea.load_embeddings(os.path.join(self.tmpdir.name, "vec"), k=2)
+
+        # case variants are not neighbours, capitalization is kept
+        self.assertEqual(ea.embeddings.most_similar("cat"), [("dog", ea.embeddings.most_similar("cat")[0][1])])
+        self.assertEqual(ea.embedding_replacement("Cat on the truck", n_words=1, position=(0,)), "Dog on the truck")
+        self.assertEqual(ea.embedding_replacement("on the mat"), "on the mat")
+        for _ in range(20):
+            self.assertEqual(ea.embedding_replacement("the car is red", n_words=2, min_similarity=0.5),
+                             "the truck is red")
+        self.assertEqual(ea.embedding_replacement("cat", min_similarity=0.999), "cat")
+
+
+class TestTokenizedCorpus(unittest.TestCase):
+
+    def setUp(self):
+        self.ea = EasyAugmentation()
+        self.ea.vocab = ["alpha", "beta", "gamma", "assets"]
+        self.texts = ["Financial assets are crucial to our success.", "two words", "single", ""]
+        self.corpus = self.ea.tokenize_corpus(self.texts)
+
+    def test_round_trip(self):
+        self.assertEqual(self.corpus.to_texts(), self.texts)
+        self.assertEqual(self.corpus.ids[1], 3)
+        self.assertEqual(self.corpus.detokenize(1), "two words")
+
+    def test_duplicate_vocab_words(self):
+        corpus = TokenizedCorpus.from_texts(["a zz b"], ["a", "b", "a"])
+        self.assertEqual(corpus.to_texts(), ["a zz b"])
+        self.assertEqual(corpus.ids.tolist(), [2, 3, 1])
+
+    def test_array_edits(self):
+        rng = np.random.default_rng(0)
+        deleted = self.ea.augment_corpus(self.corpus, "deletion", n_words=2, rng=rng).to_texts()
+        self.assertEqual([len(t.split()) for t in deleted], [5, 2, 1, 0])
+        inserted = self.ea.augment_corpus(self.corpus, "insertion", n_words=2, rng=rng).to_texts()
+        self.assertEqual([len(t.split()) for t in inserted], [9, 4, 3, 0])
+        self.assertEqual([w for w in inserted[0].split() if w not in self.ea.vocab],
+                         [w for w in self.texts[0].split() if w not in self.ea.vocab])
+        swapped = self.ea.augment_corpus(self.corpus, "swapping", n_words=1, rng=rng).to_texts()
+        self.assertEqual(swapped[1:], ["words two", "single", ""])
+        replaced = self.ea.augment_corpus(self.corpus, "replacement", n_words=1, rng=rng).to_texts()
+        self.assertEqual(replaced[2:], ["single", ""])
+
+
+class TestVocabStore(unittest.TestCase):
+
+    def test_binary_vocab_round_trip(self):
+        ea = EasyAugmentation(VOCAB_PATH)
+        ea.load_vocab()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            binary_path = os.path.join(tmpdir, "vocab.bin")
+            ea.save_vacab(binary_path, binary=True)
+            eb = EasyAugmentation(binary_path)
+            eb.load_vocab()
+            self.assertEqual(len(eb.vocab), len(ea.vocab))
+            self.assertEqual(list(eb.vocab), ea.vocab)
+            self.assertEqual(eb.vocab[-1], ea.vocab[-1])
+            self.assertEqual(len(eb.insertion("financial statements", n_words=2).split()), 4)
+
+    def test_frequency_sampling(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            corpus = os.path.join(tmpdir, "corpus.txt")
+            with open(corpus, "w") as f:
+                f.write("the cat\nthe dog\nthe end the\n")
+            ea = EasyAugmentation(sampling="frequency")
+            ea.create_vocab_from_file(corpus)
+            self.assertEqual(ea.vocab[0], "the")
+            self.assertEqual(list(ea.vocab_counts), [4, 1, 1, 1])
+
+            for binary in (False, True):
+                vocab_path = os.path.join(tmpdir, "vocab.{}".format(binary))
+                ea.save_vacab(vocab_path, binary=binary)
+                eb = EasyAugmentation(vocab_path, sampling="frequency", temperature=2.0)
+                eb.load_vocab()
+                self.assertEqual(list(eb.vocab_counts), [4, 1, 1, 1])
+                self.assertIsNotNone(eb._alias)
+
+    def test_build_vocab_parallel(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            files = []
+            for k in range(2):
+                files.append(os.path.join(tmpdir, "mono.{}".format(k)))
+                with open(files[-1], "w") as f:
+                    f.write("états financiers consolidés\n" * 300 + "rare\n")
+            ea = EasyAugmentation()
+            ea.build_vocab(files, n_jobs=2, min_count=3, output_path=os.path.join(tmpdir, "vocab.txt"))
+            self.assertEqual(sorted(ea.vocab), ["consolidés", "financiers", "états"])
+            self.assertEqual(list(ea.vocab_counts), [600, 600, 600])
+
+    def test_alias_table(self):
+        table = AliasTable([1, 0, 3, 6])
+        counts = np.bincount(table.sample(np.random.default_rng(0), 100000), minlength=4) / 100000
+        np.testing.assert_allclose(counts, [0.1, 0.0, 0.3, 0.6], atol=0.01)
+        self.assertIn(table.draw(np.random.default_rng(0)), (0, 2, 3))
+
+
+class TestPipelineStream(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.input_files = write_input_files(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_stream_writes_all_instances(self):
+        output_files = [os.path.join(self.tmpdir.name, "bad.eng"), os.path.join(self.tmpdir.name, "bad.fra")]
+        pipe = EasyAugmentationPipeline()
+        num_written = pipe.create_bad_instance_from_good_stream(self.input_files, VOCAB_PATH, output_files,
+                                                                num_instances=120)
+        self.assertEqual(num_written, 120)
+        with open(output_files[0]) as f:
+            src_lines = f.read().splitlines()
+        with open(output_files[1]) as f:
+            tgt_lines = f.read().splitlines()
+        self.assertEqual(len(src_lines), 120)
+        self.assertTrue(all(tgt.startswith("phrase source") for tgt in tgt_lines))
+        self.assertEqual(pipe.new_data, [])
+
+    def test_dedup(self):
+        for dedup in ("exact", "bloom"):
+            pipe = EasyAugmentationPipeline()
+            pipe.methods = ["swapping"]
+            pipe.create_bad_instance_from_good(self.input_files[:1] * 2, VOCAB_PATH, num_instances=150, dedup=dedup)
+            self.assertEqual(len(set(pipe.new_data)), 150)
+            with open(self.input_files[0]) as f:
+                originals = set(f.read().splitlines())
+            self.assertFalse(any(src in originals for src, _ in pipe.new_data))
+
+    def test_parallel_dedup_exhaustion(self):
+        input_files = [os.path.join(self.tmpdir.name, "one.eng"), os.path.join(self.tmpdir.name, "one.fra")]
+        for path in input_files:
+            with open(path, "w") as f:
+                f.write("alpha beta\n")
+        pipe = EasyAugmentationPipeline(verbose=False)
+        pipe.methods = ["swapping"]
+        with self.assertRaisesRegex(Exception, "No bad instance can be created"):
+            pipe.create_bad_instance_from_good(input_files, VOCAB_PATH, num_instances=2, n_jobs=2, dedup="exact")
+
+    def test_metrics(self):
+        for n_jobs in (1, 2):
+            pipe = EasyAugmentationPipeline()
+            pipe.metrics = PipelineMetrics()
+            pipe.create_bad_instance_from_good(self.input_files, VOCAB_PATH, num_instances=40, n_jobs=n_jobs, seed=3)
+            report = pipe.metrics.to_dict()
+            self.assertEqual(sum(m["accepted"] for m in report["methods"].values()), 40)
+            for m in report["methods"].values():
+                self.assertEqual(m["attempts"], m["accepted"] + sum(m["rejections"].values()))
+                self.assertEqual(sum(m["latency_counts"]), m["attempts"])
+            self.assertGreater(report["pairs_per_sec"], 0)
+            self.assertIn('text_augmentation_accepted_total{method="swapping"}', pipe.metrics.to_prometheus())
+
+    def test_audit_log(self):
+        audit_path = os.path.join(self.tmpdir.name, "audit.jsonl")
+        with AuditLog(audit_path, batch_size=7) as audit_log:
+            pipe = EasyAugmentationPipeline(verbose=False)
+            pipe.audit_log = audit_log
+            pipe.create_bad_instance_from_good(self.input_files, VOCAB_PATH, alter_source=False, num_instances=30)
+        with open(audit_path, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+        accepted = [r for r in records if r["accepted"]]
+        self.assertEqual([r["augmented"] for r in accepted], [tgt for _, tgt in pipe.new_data])
+        self.assertTrue(all(r["original"].startswith("phrase source") for r in records))
+        self.assertTrue(all(r["method"] in pipe.methods + pipe.fra_methods for r in records))
+
+    def test_parallel_is_deterministic(self):
+        runs = []
+        for _ in range(2):
+            pipe = EasyAugmentationPipeline()
+            pipe.create_bad_instance_from_good(self.input_files, VOCAB_PATH, num_instances=30, n_jobs=2, seed=7)
+            runs.append(pipe.new_data)
+        self.assertEqual(len(runs[0]), 30)
+        self.assertEqual(runs[0], runs[1])
+
+    def test_parallel_keeps_pipeline_settings(self):
+        vocab_path = os.path.join(self.tmpdir.name, "vocab.txt")
+        with open(vocab_path, "w") as f:
+            f.write("the\t1000\nodd\t1\nrare\t1\n")
+        runs = []
+        for n_jobs in (1, 2):
+            pipe = EasyAugmentationPipeline(verbose=False, seed=5)
+            pipe.set_sampling("frequency", temperature=0.5)
+            pipe.language_pack = get_language_pack("eng")
+            pipe.methods = ["insertion"]
+            pipe.create_bad_instance_from_good(self.input_files, vocab_path, alter_source=False, num_instances=60,
+                                               n_jobs=n_jobs)
+            runs.append(pipe.new_data)
+        self.assertEqual(runs[1], runs[0])
+        inserted = [word for _, tgt in runs[0] for word in tgt.split() if word in ("the", "odd", "rare")]
+        self.assertGreater(inserted.count("the"), 0.9 * len(inserted))
+        self.assertTrue(any(tgt.split()[0] in ("a", "an") for _, tgt in runs[0]))
+
+    def test_parallel_shares_parsed_input(self):
+        worker_initargs = []
+
+        class RecordingExecutor(ThreadPoolExecutor):
+            def __init__(self, max_workers, initializer, initargs=()):
+                worker_initargs.append(initargs)
+                super().__init__(max_workers, initializer=initializer, initargs=initargs)
+
+        with mock.patch("text_augmentation.augment.ProcessPoolExecutor", RecordingExecutor):
+            pipe = EasyAugmentationPipeline(verbose=False)
+            pipe.create_bad_instance_from_good(self.input_files, VOCAB_PATH, num_instances=20, n_jobs=2, seed=3)
+        cached_pairs = worker_initargs[0][0]
+        self.assertIsInstance(cached_pairs, CachedPairs)
+        self.assertEqual(len(cached_pairs), 50)
+        self.assertFalse(os.path.exists(os.path.dirname(cached_pairs.srcTexts.path)))
+
+        single = EasyAugmentationPipeline(verbose=False)
+        single.create_bad_instance_from_good(self.input_files, VOCAB_PATH, num_instances=20, seed=3)
+        self.assertEqual(pipe.new_data, single.new_data)
+
+    def test_counter_rng_streams(self):
+        counter_rng = CounterRNG(2 ** 100 + 7)
+        first = counter_rng.at(5, attempt=2).random(6)
+        counter_rng.at(9).random(3)
+        np.testing.assert_array_equal(counter_rng.at(5, attempt=2).random(6), first)
+        fresh = np.random.Generator(np.random.Philox(key=2 ** 100 + 7, counter=[0, 0, 2, 5]))
+        np.testing.assert_array_equal(fresh.random(6), first)
+
+        positions = distinct_positions(counter_rng.at(0), 4, 4)
+        self.assertEqual(sorted(positions), [0, 1, 2, 3])
+
+    def test_shards_reproduce_single_run(self):
+        for alter_source in (True, False):
+            single = EasyAugmentationPipeline(verbose=False, seed=11)
+            single.create_bad_instance_from_good(self.input_files, VOCAB_PATH, alter_source, num_instances=30)
+
+            parallel = EasyAugmentationPipeline(verbose=False)
+            parallel.create_bad_instance_from_good(self.input_files, VOCAB_PATH, alter_source, num_instances=30,
+                                                   n_jobs=3, seed=11)
+            self.assertEqual(parallel.new_data, single.new_data)
+
+            shards = []
+            for start_index, num_instances in ((0, 12), (12, 18)):
+                shard = EasyAugmentationPipeline(verbose=False, seed=11)
+                shard.create_bad_instance_from_good(self.input_files, VOCAB_PATH, alter_source,
+                                                    num_instances=num_instances, start_index=start_index)
+                shards += shard.new_data
+            self.assertEqual(shards, single.new_data)
+            self.assertEqual(single.regenerate_instance(17, alter_source)[0], single.new_data[17])
+
+
+TMX_SAMPLE = """<?xml version="1.0" encoding="utf-8"?>
+<tmx version="1.4"><header srclang="en"/><body>
+<tu><tuv xml:lang="en"><seg>source.docx</seg></tuv><tuv xml:lang="fr"><seg>cible.docx</seg></tuv></tu>
+<tu><tuv xml:lang="en"><seg> Profit &amp; <bpt i="1">&lt;b&gt;</bpt>loss </seg></tuv><tuv xml:lang="fr"><seg>Profits et pertes</seg></tuv></tu>
+<tu><tuv xml:lang="en"><seg>incomplete</seg></tuv></tu>
+</body></tmx>
+"""
+
+
+XLIFF_SAMPLE = """<?xml version="1.0" encoding="utf-8"?>
+<xliff xmlns="urn:oasis:names:tc:xliff:document:1.2" xmlns:sdl="http://sdl.com/FileTypes/SdlXliff/1.0">
+<file><body>
+<trans-unit id="1"><source>Hello
+   world</source><target><mrk mtype="seg">Bonjour  le monde</mrk></target></trans-unit>
+<trans-unit id="2"><source>No target</source></trans-unit>
+</body></file></xliff>"""
+
+
+class TestMicroBatcher(unittest.TestCase):
+
+    def test_batches_keep_order_and_limits(self):
+        backend = StubBackend(latency=0.01)
+
+        async def run():
+            async with MicroBatcher(backend, max_batch_size=16, max_latency=0.05, max_concurrency=2,
+                                    max_queue_size=40) as batcher:
+                return await batcher.map(["w{} x{}".format(i, i) for i in range(100)])
+
+        self.assertEqual(asyncio.run(run()), ["x{} w{}".format(i, i) for i in range(100)])
+        self.assertEqual(sum(backend.batch_sizes), 100)
+        self.assertLessEqual(max(backend.batch_sizes), 16)
+        self.assertLess(len(backend.batch_sizes), 20)
+        self.assertLessEqual(backend.max_running, 2)
+
+    def test_max_latency_and_errors(self):
+        async def run(backend):
+            async with MicroBatcher(backend, max_batch_size=64, max_latency=0.01) as batcher:
+                return await batcher.submit("a b")
+
+        backend = StubBackend(latency=0)
+        self.assertEqual(asyncio.run(run(backend)), "b a")  # a lone text is sent without a full batch
+        self.assertEqual(backend.batch_sizes, [1])
+
+        def fail(text):
+            raise ValueError("model down")
+        with self.assertRaises(ValueError):
+            asyncio.run(run(StubBackend(latency=0, transform=fail)))
+        with self.assertRaises(TypeError):
+            AugmentationBackend()
+
+    def test_pipeline_backend(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        input_files = write_input_files(tmpdir.name)
+
+        runs = []
+        for max_batch_size, max_queue_size in ((1, 1), (8, 16), (32, 1024)):
+            backend = StubBackend(latency=0.002)
+            pipe = EasyAugmentationPipeline(verbose=False)
+            pipe.metrics = PipelineMetrics()
+            pipe.create_bad_instance_from_good(input_files, VOCAB_PATH, num_instances=60, seed=5, backend=backend,
+                                               max_batch_size=max_batch_size, max_queue_size=max_queue_size)
+            self.assertEqual(len(pipe.new_data), 60)
+            self.assertEqual(pipe.methods, ["swapping", "deletion", "replacement", "insertion"])
+            self.assertGreater(pipe.metrics.to_dict()["methods"]["stub"]["accepted"], 0)
+            self.assertLessEqual(max(backend.batch_sizes), max_batch_size)
+            runs.append(pipe.new_data)
+        self.assertEqual(runs[0], runs[1])
+        self.assertEqual(runs[0], runs[2])
+
+        pipe = EasyAugmentationPipeline(verbose=False)
+        pipe.methods = ["stub"]
+        pipe.create_bad_instance_from_good(input_files, VOCAB_PATH, num_instances=10, seed=5, backend=StubBackend(0))
+        self.assertTrue(all(src.split()[::-1] == ["source", "sentence", "number", tgt.split()[-1]]
+                            for src, tgt in pipe.new_data))
+        with self.assertRaises(TypeError):
+            pipe.create_bad_instance_from_good(input_files, VOCAB_PATH, num_instance=5)
+
+
+class TestTmFileParser(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.tmx = os.path.join(self.tmpdir.name, "sample.tmx")
+        with open(self.tmx, "w", encoding="utf-8") as f:
+            f.write(TMX_SAMPLE)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_iter_tmx(self):
+        pairs = list(TmFileParser().iter_tmx(self.tmx))
+        self.assertEqual(pairs, [("source.docx", "cible.docx"), ("Profit & <b>loss", "Profits et pertes")])
+
+    def test_parse_tmx_aligned_filenames(self):
+        tfp = TmFileParser(fileType="tmx")
+        tfp.parse(self.tmx, tmxHasAlignedFilenames=True)
+        self.assertEqual(tfp.srcTexts, ["Profit & <b>loss"])
+        self.assertEqual(tfp.tgtTexts, ["Profits et pertes"])
+
+    def test_tmx_writer_round_trip(self):
+        pairs = [("R&D <costs>", "Frais de R&D \x01"), ("état", "situation")]
+        for output, pretty in (("pretty.tmx", True), ("compact.tmx", False)):
+            output = os.path.join(self.tmpdir.name, output)
+            self.assertTrue(writeToTmxFile(output, iter(pairs), "en", "fr", pretty=pretty))
+            self.assertEqual(list(TmFileParser().iter_tmx(output)),
+                             [("R&D <costs>", "Frais de R&D"), ("état", "situation")])
+
+    def test_xliff_family(self):
+        mxliff = os.path.join(self.tmpdir.name, "sample.mxliff")
+        with open(mxliff, "w", encoding="utf-8") as f:
+            f.write(XLIFF_SAMPLE.replace("<mrk mtype=\"seg\">Bonjour  le monde</mrk>", "Bonjour\tle monde"))
+        self.assertEqual(list(TmFileParser("mxliff").iter_mxliff(mxliff)), [("Hello world", "Bonjour le monde")])
+
+        sdlxliff = os.path.join(self.tmpdir.name, "sample.sdlxliff")
+        with open(sdlxliff, "w", encoding="utf-8") as f:
+            f.write(XLIFF_SAMPLE)
+        pairs = TmFileParser("sdlxliff").iter_sdlxliff(sdlxliff)
+        self.assertEqual(next(pairs), ("Hello world", "Bonjour le monde"))
+        with self.assertRaisesRegex(Exception, "#1 trans-unit tag doesn't contain target tag."):
+            next(pairs)
+
+        mqxliff = os.path.join(self.tmpdir.name, "sample.mqxliff")
+        with open(mqxliff, "w", encoding="utf-8") as f:
+            f.write(XLIFF_SAMPLE.replace("No target", "R&amp;D <ph sdl:id=\"1\">&lt;b&gt;</ph> costs <x id=\"5\" "
+                                                      "ctype=\"Bold\"/><Bold>b</Bold><br/>"))
+        # serialized as the former BeautifulSoup extraction: prefixes kept, lowercase names, sorted attributes,
+        # empty elements expanded but HTML void ones
+        self.assertEqual(parse_mqxliff(mqxliff), ["Hello\n   world", 'R&amp;D <ph sdl:id="1">&lt;b&gt;</ph> costs '
+                                                                   '<x ctype="Bold" id="5"></x><bold>b</bold><br/>'])
+
+    def test_iter_excel(self):
+        xlsx = os.path.join(self.tmpdir.name, "sample.xlsx")
+        with XlsxPairWriter(xlsx, columns=("Source", "Target")) as writer:
+            writer.write_pairs([(" hello ", 1.0), ("", ""), ("world", "monde")])
+        tfp = TmFileParser(fileType="excel")
+        pairs = tfp.iter_excel(xlsx)
+        self.assertEqual(next(pairs), ("hello", "1"))
+        self.assertEqual(tfp.headers, ["Source", "Target"])
+        self.assertEqual(list(pairs), [("", ""), ("world", "monde")])
+
+        pipeline = EasyAugmentationPipeline(verbose=False)
+        pipeline.read_files(xlsx)
+        self.assertEqual(pipeline.input_data, [(" hello ", "1"), ("", ""), ("world", "monde")])
+
+    def test_parse_resets_parser(self):
+        tfp = TmFileParser(fileType="tmx")
+        tfp.parse(self.tmx)
+        tfp.parse(self.tmx)
+        self.assertEqual(len(tfp.srcTexts), 2)
+
+    def test_parse_cache(self):
+        cache_dir = os.path.join(self.tmpdir.name, "cache")
+        for key in ("stat", "content"):
+            cache = ParseCache(cache_dir, key=key)
+            cache.clear()
+            tfp = TmFileParser(fileType="tmx", verbose=False)
+            tfp.parse(self.tmx, cache=cache)
+            self.assertEqual(list(tfp.srcTexts), ["source.docx", "Profit & <b>loss"])
+            self.assertEqual(len(cache.entries()), 1)
+
+            tfp.parse(self.tmx, cache=cache)  # hit
+            self.assertEqual(list(tfp.tgtTexts), ["cible.docx", "Profits et pertes"])
+            tfp.parse(self.tmx, tmxHasAlignedFilenames=True, cache=cache_dir)  # other options, other entry
+            self.assertEqual(list(tfp.srcTexts), ["Profit & <b>loss"])
+            self.assertEqual(len(cache.entries()), 2)
+
+            os.utime(self.tmx, ns=(0, 0))  # same content, other mtime
+            self.assertEqual(cache.get(cache.key(self.tmx, fileType="tmx", textTag="seg",
+                                                 tmxHasAlignedFilenames=False, sdlTgtTagName="mrk")) is None,
+                             key == "stat")
+
+        # least recently used entries are evicted, the new one is kept
+        cache = ParseCache(cache_dir, max_size=1)
+        pairs = cache.put("new", ["a"], ["b"])
+        self.assertEqual([key for key, _, _ in cache.entries()], ["new"])
+        self.assertEqual((len(pairs), pairs[0], list(pairs)), (1, ("a", "b"), [("a", "b")]))
+
+        with mock.patch.dict(os.environ, {"HOME": self.tmpdir.name}):
+            self.assertEqual(ParseCache("~/cache").cache_dir, cache_dir)
+
+        input_files = [os.path.join(self.tmpdir.name, "good.eng"), os.path.join(self.tmpdir.name, "good.fra")]
+        for path, text in zip(input_files, ("hello\nworld\n", "bonjour\nmonde\n")):
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+        cache = ParseCache(cache_dir)
+        for _ in range(2):
+            pipe = EasyAugmentationPipeline(verbose=False)
+            pipe.read_files(input_files, cache=cache)
+            self.assertEqual(list(pipe.input_data), [("hello", "bonjour"), ("world", "monde")])
+        self.assertEqual(len(cache.entries()), 2)
+
+        # parallel workers get the cache entry of the parent
+        runs = []
+        for cache in (None, ParseCache(cache_dir, key="content")):
+            pipe = EasyAugmentationPipeline(verbose=False)
+            pipe.create_bad_instance_from_good(input_files, VOCAB_PATH, num_instances=6, n_jobs=2, seed=1, cache=cache)
+            runs.append(pipe.new_data)
+        self.assertEqual(runs[0], runs[1])
+
+    def test_corpus_ingestion(self):
+        corpus = os.path.join(self.tmpdir.name, "corpus")
+        os.makedirs(os.path.join(corpus, "sub"))
+        with open(os.path.join(corpus, "sub", "tmx_saved_as.xml"), "w", encoding="utf-8") as f:
+            f.write(TMX_SAMPLE)
+        for lang, lines in (("eng", "hello\nworld\n"), ("fra", "bonjour\nmonde\n")):
+            with open(os.path.join(corpus, "doc." + lang), "w", encoding="utf-8") as f:
+                f.write(lines)
+        with open(os.path.join(corpus, "orphan.eng"), "w", encoding="utf-8") as f:
+            f.write("alone\n")
+        with open(os.path.join(corpus, "broken.tmx"), "w", encoding="utf-8") as f:
+            f.write("<tmx><body></body></tmx>")
+        with open(os.path.join(corpus, "client_drop.pkl"), "wb") as f:
+            f.write(b"not to be unpickled")
+
+        self.assertEqual(detect_file_type(os.path.join(corpus, "sub", "tmx_saved_as.xml")), "tmx")
+        self.assertIsNone(detect_file_type(os.path.join(corpus, "client_drop.pkl")))
+        self.assertEqual(detect_file_type(os.path.join(corpus, "client_drop.pkl"), allow_pickle=True), "pickle")
+        results = []
+        for n_jobs in (1, 2):
+            ingestor = TmCorpusIngestor(n_jobs=n_jobs, verbose=False)
+            results.append(ingestor.ingest(corpus))
+        self.assertEqual(results[0], results[1])
+        self.assertEqual([(p.source, p.target, os.path.basename(p.file), p.index) for p in results[0]],
+                         [("hello", "bonjour", "doc.eng", 0), ("world", "monde", "doc.eng", 1),
+                          ("source.docx", "cible.docx", "tmx_saved_as.xml", 0),
+                          ("Profit & <b>loss", "Profits et pertes", "tmx_saved_as.xml", 1)])
+        self.assertEqual(sorted(os.path.basename(r.file) for r in ingestor.errors), ["broken.tmx", "orphan.eng"])
+
+    def test_ingestion_submits_files_in_bounded_batches(self):
+        for k in range(10):
+            with open(os.path.join(self.tmpdir.name, "tm{}.tmx".format(k)), "w", encoding="utf-8") as f:
+                f.write(TMX_SAMPLE)
+        submitted = []
+
+        class CountingExecutor(ThreadPoolExecutor):
+            def submit(self, fn, *args):
+                submitted.append(args[0])
+                return super().submit(fn, *args)
+
+        with mock.patch("text_augmentation.utils.ingest.ProcessPoolExecutor", CountingExecutor):
+            pairs = TmCorpusIngestor(n_jobs=2, verbose=False).iter_pairs(self.tmpdir.name)
+            self.assertEqual(next(pairs).file, os.path.join(self.tmpdir.name, "sample.tmx"))
+            self.assertEqual(len(submitted), 4)
+            self.assertEqual(len(list(pairs)), 21)
+        self.assertEqual(len(submitted), 11)
+
+
+class TestWriters(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.pairs = [("source {}".format(i), "cible\t{}".format(i)) for i in range(25)]
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_incomplete_writer(self):
+        class ChunkOnlyWriter(PairWriter):
+            def _write_chunk(self, pairs):
+                pass
+
+        with self.assertRaises(TypeError):
+            ChunkOnlyWriter()
+
+    def test_text_writers(self):
+        for output_file in ("pairs.jsonl", "pairs.tsv"):
+            output_file = os.path.join(self.tmpdir.name, output_file)
+            with get_pair_writer(output_file, chunk_size=10) as writer:
+                self.assertEqual(writer.write_pairs(iter(self.pairs)), 25)
+        with open(os.path.join(self.tmpdir.name, "pairs.jsonl"), encoding="utf-8") as f:
+            self.assertEqual(json.loads(f.read().splitlines()[-1]), {"source": "source 24", "target": "cible\t24"})
+        with open(os.path.join(self.tmpdir.name, "pairs.tsv"), encoding="utf-8") as f:
+            self.assertEqual(len(f.read().splitlines()), 26)
+
+    def test_xlsx_rollover(self):
+        import pandas as pd
+        output_file = os.path.join(self.tmpdir.name, "pairs.xlsx")
+        with XlsxPairWriter(output_file, chunk_size=7, max_rows=11) as writer:
+            writer.write_pairs(self.pairs)
+        self.assertEqual([os.path.basename(f) for f in writer.files], ["pairs.xlsx", "pairs.2.xlsx", "pairs.3.xlsx"])
+        frames = [pd.read_excel(f) for f in writer.files]
+        self.assertEqual([len(df) for df in frames], [10, 10, 5])
+        self.assertEqual(list(frames[2]["source"]), ["source {}".format(i) for i in range(20, 25)])
+
+        with XlsxPairWriter(output_file, max_rows=11, rollover="sheet") as writer:
+            writer.write_pairs(self.pairs)
+        self.assertEqual(len(pd.ExcelFile(output_file).sheet_names), 3)
+
+
+class TestSample(unittest.TestCase):
+
+    def test_reservoir_sample(self):
+        rand = random.Random(0)
+        counts = np.zeros(50)
+        for _ in range(4000):
+            sampled = reservoir_sample(iter(range(50)), 5, rand)
+            self.assertEqual(len(set(sampled)), 5)
+            counts[sampled] += 1
+        np.testing.assert_allclose(counts / 4000, 0.1, atol=0.03)
+        self.assertEqual(sorted(reservoir_sample(range(3), 5)), [0, 1, 2])
+
+    def test_stratified_line_numbers(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            files = [os.path.join(tmpdir, "train.eng"), os.path.join(tmpdir, "train.fra")]
+            for file in files:
+                with open(file, "w") as f:
+                    f.write("".join(" ".join(["mot"] * (1 + i % 12)) + " {}\n".format(i) for i in range(120)))
+            index = LineOffsetIndex(files)
+            self.assertTrue(os.path.isfile(files[0] + ".lineidx.npy"))
+            strata = index.stratified_line_numbers(12, (5, 10), np.random.default_rng(0))
+            self.assertEqual({b: len(lines) for b, lines in strata.items()}, {0: 3, 1: 5, 2: 4})
+            for b, lines in strata.items():
+                for src, tgt in LineOffsetIndex(files).read_lines(lines):
+                    self.assertEqual(src, tgt)
+                    self.assertEqual(b, (len(src.split()) >= 5) + (len(src.split()) >= 10))
+            self.assertEqual(index.bucket_column((5, 10)).dtype, np.uint8)
+
+    def test_line_index_dir_and_line_endings(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            files = [os.path.join(tmpdir, "train.eng"), os.path.join(tmpdir, "train.fra")]
+            for file, word in zip(files, ("mot", "word")):
+                with open(file, "w", encoding="utf-8", newline="") as f:
+                    f.write("".join("{} {}{}".format(" ".join([word] * (1 + i % 4)), i, "\n\x0c\r\n\u2028\x85\r"[i % 6])
+                                    for i in range(60)))
+            index_dir = os.path.join(tmpdir, "index")
+            index = LineOffsetIndex(files, index_dir=index_dir)
+            self.assertFalse(os.path.isfile(files[0] + ".lineidx.npy"))
+            self.assertEqual(len(os.listdir(index_dir)), 2)
+            self.assertEqual(len(index), len(list(txt_iter(files[0], encoding="utf-8"))))
+            pairs = list(zip(txt_iter(files[0], encoding="utf-8"), txt_iter(files[1], encoding="utf-8")))
+            self.assertEqual(index.read_lines(range(len(index))), pairs)
+            index.chunk_size = 7
+            strata = index.stratified_line_numbers(10, (3,), np.random.default_rng(1), allocation="equal")
+            self.assertEqual({b: len(lines) for b, lines in strata.items()}, {0: 5, 1: 5})
+            for b, lines in strata.items():
+                self.assertTrue(all((len(src.split()) >= 3) == b for src, _ in index.read_lines(lines)))
+
+    def test_txt_iter_matches_txt_io(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            file = os.path.join(tmpdir, "train.eng")
+            with open(file, "w", encoding="utf-8", newline="") as f:
+                f.write("a\x0bb\nc\x0c\r\nd\x1ce\x85f\n\u2028g\rh\x1e\n\ni")
+            self.assertEqual(list(txt_iter(file, encoding="utf-8")), ["a", "b", "c", "", "d", "e", "f", "", "g",
+                                                                      "h", "", "", "i"])
+            if locale.getpreferredencoding(False).lower().replace("-", "") == "utf8":
+                self.assertEqual(list(txt_iter(file)), txt_io(file))
+
+
+if __name__ == "__main__":
+    unittest.main()
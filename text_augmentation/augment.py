@@ -1,10 +1,28 @@
 import os
 import re
-import random
+import time
+import asyncio
+import tempfile
 import numpy as np
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 # import pandas as pd
 # import spacy
-from text_augmentation.utils.file_io import txt_io, excel_io
+from text_augmentation.utils.file_io import txt_io, txt_iter, excel_iter
+from text_augmentation.utils.string_store import StringStore, is_string_store
+from text_augmentation.utils.alias_table import AliasTable
+from text_augmentation.utils.vocab_builder import build_vocab_counts
+from text_augmentation.utils.token_corpus import TokenizedCorpus, sample_positions, distinct_positions
+from text_augmentation.utils.dedup import make_dedup_index
+from text_augmentation.utils.writers import get_pair_writer
+from text_augmentation.utils.metrics import PipelineMetrics
+from text_augmentation.utils.audit import MemoryAuditLog
+from text_augmentation.utils.rng import CounterRNG, new_seed
+from text_augmentation.utils.parse_cache import ParseCache, make_parse_cache
+from text_augmentation.edit_plan import EditPlan, compile_plan, compile_plan_batch
+from text_augmentation.language_packs import get_language_pack
+from text_augmentation.embedding import WordVectors
+from text_augmentation.backends import MicroBatcher
 # import tensorflow as tf
 
 """
@@ -21,34 +39,122 @@ from text_augmentation.utils.file_io import txt_io, excel_io
 
 class EasyAugmentation:
 
-    def __init__(self, vocab_path=None):
+    batch_methods = ("swapping", "deletion", "insertion", "replacement")
+    verbose = True
+
+    def __init__(self, vocab_path=None, sampling="uniform", temperature=1.0, seed=None, language=None):
         self.vocab_path = vocab_path
         self.vocab = []
+        self.vocab_counts = None
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)  # default random stream of all operations
+        self.sampling = sampling
+        self.temperature = temperature
+        self._alias = None
+        # articles and determiners of the text language, used by add_article
+        self.language_pack = None if language is None else get_language_pack(language)
+        self.embeddings = None  # WordVectors used by embedding_replacement, see load_embeddings
 
     def load_vocab(self):
-        """Load existing vocabulary file"""
+        """Load existing vocabulary file, a binary vocabulary is memory-mapped rather than read.
+           Counts are loaded as well if the file has them ('word\tcount' lines in a text vocabulary)."""
         if os.path.isfile(self.vocab_path):
-            self.vocab = txt_io(self.vocab_path, action='r')
-        else:
+            if is_string_store(self.vocab_path):
+                self.vocab = StringStore(self.vocab_path)
+                self.vocab_counts = self.vocab.weights
+            else:
+                lines = txt_io(self.vocab_path, action='r')
+                if lines and "\t" in lines[0]:
+                    rows = [line.split("\t") for line in lines]
+                    self.vocab = [row[0] for row in rows]
+                    self.vocab_counts = np.array([int(row[1]) for row in rows], dtype=np.int64)
+                else:
+                    self.vocab = lines
+                    self.vocab_counts = None
+            self._build_sampler()
+        elif self.verbose:
             print("No vocab file is found.")
 
-    def save_vacab(self, filepath):
-        """save vocabulary"""
-        txt_io(filepath, action="w", write_lines=self.vocab)
+    def save_vacab(self, filepath, binary=False):
+        """save vocabulary, with counts if they are known.
+            :arg binary: save as a binary string store that load_vocab memory-maps."""
+        if binary:
+            StringStore.write(filepath, self.vocab, weights=self.vocab_counts)
+        elif self.vocab_counts is not None:
+            txt_io(filepath, action="w",
+                   write_lines=("{}\t{}".format(w, c) for w, c in zip(self.vocab, self.vocab_counts)))
+        else:
+            txt_io(filepath, action="w", write_lines=self.vocab)
 
     def create_vocab_from_file(self, text_filepath):
-        """Create vocabulary from given file of sentences"""
-        with open(text_filepath, "r") as f:
-            lines = f.read().splitlines()
+        """Create vocabulary from given file of sentences, words are kept with their counts, most frequent first."""
+        self.build_vocab([text_filepath])
+
+    def build_vocab(self, text_filepaths, n_jobs=1, min_count=1, max_size=None, output_path=None, binary=False):
+        """Create vocabulary with counts from any number of files of sentences.
+           Files are streamed in chunks that are counted in n_jobs processes, then the counts are merged.
+            :arg min_count: drop words seen less often.
+            :arg max_size: keep only the max_size most frequent words.
+            :arg output_path: save the vocabulary there if given.
+            :arg binary: save as a binary string store."""
+        if n_jobs == -1:
+            n_jobs = os.cpu_count()
+        vocab_counts = build_vocab_counts(text_filepaths, n_jobs=n_jobs, min_count=min_count, max_size=max_size)
+
+        self.vocab = [w for w, _ in vocab_counts]
+        self.vocab_counts = np.array([c for _, c in vocab_counts], dtype=np.int64)
+        del vocab_counts
+        self._build_sampler()
+        if self.verbose:
+            print("{} vocabularies created.".format(len(self.vocab)))
+
+        if output_path:
+            self.save_vacab(output_path, binary=binary)
 
-        total_vocab = " ".join(lines).split()
-        self.vocab = list(set(total_vocab))
-        print("{} vocabularies created.".format(len(self.vocab)))
+    def set_sampling(self, sampling="uniform", temperature=1.0):
+        """Choose how insertion and replacement words are drawn from the vocabulary.
+            :arg sampling: 'uniform', or 'frequency' to draw words in proportion to count ** (1 / temperature).
+            :arg temperature: above 1 flattens the frequency distribution towards uniform."""
+        self.sampling = sampling
+        self.temperature = temperature
+        self._build_sampler()
 
-    def swapping(self, text, n_iteration=1, position="random"):
+    def _build_sampler(self):
+        """Precompute the alias table used by frequency sampling."""
+        if self.sampling not in ("uniform", "frequency"):
+            raise Exception("sampling should be either 'uniform' or 'frequency'.")
+
+        self._alias = None
+        if self.sampling == "frequency" and len(self.vocab) > 0:
+            if self.vocab_counts is None:
+                raise Exception("Frequency sampling needs a vocabulary with counts.")
+            weights = np.asarray(self.vocab_counts, dtype=np.float64) ** (1.0 / self.temperature)
+            self._alias = AliasTable(weights)
+
+    def _random_word(self, rng):
+        """Draw one vocabulary word with a numpy Generator."""
+        if self._alias is None:
+            return self.vocab[int(rng.integers(len(self.vocab)))]
+        return self.vocab[self._alias.draw(rng)]
+
+    def _words_from_uniforms(self, uniforms):
+        """Draw one vocabulary word from each uniform number in [0, 1)."""
+        if self._alias is None:
+            n = len(self.vocab)
+            return [self.vocab[int(u * n)] for u in uniforms]
+        return [self.vocab[self._alias.draw_from_uniform(u)] for u in uniforms]
+
+    def _random_word_ids(self, rng, size):
+        """Draw vocabulary indices with a numpy Generator."""
+        if self._alias is None:
+            return rng.integers(len(self.vocab), size=size)
+        return self._alias.sample(rng, size)
+
+    def swapping(self, text, n_iteration=1, position="random", rng=None):
         """Swapping (randomly or specific positional) words in the text.
             :arg n_iteration: the number of swaps to be performed.
-            :arg position: randomly swapping or specified swaps"""
+            :arg position: randomly swapping or specified swaps
+            :arg rng: numpy Generator, self.rng if not given."""
         assert position == "random" or type(position) == tuple, "position should be either 'random' or a tuple."
         words = text.split()
         length = len(words)
@@ -57,8 +163,9 @@ class EasyAugmentation:
             return text
 
         if position == "random":
+            rng = self.rng if rng is None else rng
             for _ in range(n_iteration):
-                index_1, index_2 = np.random.choice(range(length), 2, replace=False)
+                index_1, index_2 = distinct_positions(rng, length, 2)
                 words[index_1], words[index_2] = words[index_2], words[index_1]
         else:
             index_1, index_2 = position
@@ -68,10 +175,11 @@ class EasyAugmentation:
 
         return new_text
 
-    def deletion(self, text, n_words=2, position="random"):
+    def deletion(self, text, n_words=2, position="random", rng=None):
         """Deleting (randomly or specific positional) words in the text.
             :arg n_words: the number of word to be deleted.
             :arg position: randomly deleting or specified deletion by index
+            :arg rng: numpy Generator, self.rng if not given.
             :return same text of word number is less than 2, or less than or or equal to n_word."""
         assert position == "random" or type(position) == tuple, "position should be either 'random' or a tuple."
         words = text.split()
@@ -81,40 +189,43 @@ class EasyAugmentation:
             return text
 
         if position == "random":
-            indices = np.random.choice(range(length), n_words, replace=False)
+            rng = self.rng if rng is None else rng
+            indices = distinct_positions(rng, length, n_words)
         else:
             indices = position
 
-        words = np.delete(words, indices)
-        new_text = " ".join(words)
+        dropped = {i + length if i < 0 else i for i in indices}
+        new_text = " ".join(w for i, w in enumerate(words) if i not in dropped)
 
         return new_text
 
-    def insertion(self, text, n_words=2, position="random"):
+    def insertion(self, text, n_words=2, position="random", rng=None):
         """Inserting words into text
             :arg n_words: the number of word to be inserted.
-            :arg position: randomly inserting or specified inserting by index"""
+            :arg position: randomly inserting or specified inserting by index
+            :arg rng: numpy Generator, self.rng if not given."""
         assert position == "random" or type(position) == tuple, "position should be either 'random' or a tuple."
         words = text.split()
         length = len(words)
+        rng = self.rng if rng is None else rng
 
         if position == "random":
-            indices = np.random.choice(range(length + 1), n_words, replace=False)
+            indices = distinct_positions(rng, length + 1, n_words)
         else:
             indices = position
 
         for i in indices:
-            insert_word = random.choice(self.vocab)
-            words = words[:i] + [insert_word] + words[i:]
+            words.insert(i, self._random_word(rng))
 
         new_text = " ".join(words)
 
         return new_text
 
-    def replacement(self, text, n_words=2, position="random"):
+    def replacement(self, text, n_words=2, position="random", rng=None):
         """Inserting words into text
             :arg n_words: the number of word to be inserted.
-            :arg position: randomly inserting or specified inserting by index"""
+            :arg position: randomly inserting or specified inserting by index
+            :arg rng: numpy Generator, self.rng if not given."""
         assert position == "random" or type(position) == tuple, "position should be either 'random' or a tuple."
         words = text.split()
         length = len(words)
@@ -122,142 +233,759 @@ class EasyAugmentation:
         if n_words >= length:
             return text
 
+        rng = self.rng if rng is None else rng
         if position == "random":
-            indices = np.random.choice(range(length), n_words, replace=False)
+            indices = distinct_positions(rng, length, n_words)
         else:
             indices = position
 
         for i in indices:
-            insert_word = random.choice(self.vocab)
+            insert_word = self._random_word(rng)
             words[i] = insert_word
 
         new_text = " ".join(words)
 
         return new_text
 
+    def load_embeddings(self, prefix, k=10, block_size=2048):
+        """Memory-map word vectors converted by embedding.convert_word_vectors, and build their neighbour index
+           of k neighbours per word if it is not saved next to them yet."""
+        self.embeddings = WordVectors(prefix)
+        if self.embeddings.neighbours is None:
+            self.embeddings.build_neighbours(k=k, block_size=block_size)
+        return self.embeddings
 
-class EasyAugmentationFrench(EasyAugmentation):
+    def embedding_replacement(self, text, n_words=1, position="random", rng=None, min_similarity=0.0):
+        """Replace words with one of their nearest neighbours in the embedding space, e.g. 'cat' with 'dog'.
+           Only words with a vector can be replaced, a capitalized word gets a capitalized neighbour.
+            :arg n_words: the number of words to be replaced, fewer if fewer words have a vector.
+            :arg position: randomly replacing or specified replacing by index
+            :arg rng: numpy Generator, self.rng if not given.
+            :arg min_similarity: minimum cosine similarity of a neighbour to the replaced word.
+            :return same text if no word can be replaced."""
+        assert position == "random" or type(position) == tuple, "position should be either 'random' or a tuple."
+        if self.embeddings is None:
+            raise Exception("No word vectors, call load_embeddings first.")
+        words = text.split()
+
+        rng = self.rng if rng is None else rng
+        if position == "random":
+            candidates = [i for i, word in enumerate(words) if self.embeddings.word_id(word) is not None]
+            if not candidates:
+                return text
+            indices = [candidates[i] for i in distinct_positions(rng, len(candidates), min(n_words, len(candidates)))]
+        else:
+            indices = position
+
+        for i in indices:
+            neighbours = self.embeddings.most_similar(words[i], min_similarity)
+            if not neighbours:
+                continue
+            new_word = neighbours[int(rng.random() * len(neighbours))][0]
+            if words[i][:1].isupper():
+                new_word = new_word[:1].upper() + new_word[1:]
+            words[i] = new_word
+
+        new_text = " ".join(words)
 
-    def __init__(self, vocab_path=None):
-        super().__init__(vocab_path)
-        self.articles = ["le", "la", "les", "l'",
-                         "un", "une", "des", "du",
-                         "de la", "de l'"]
+        return new_text
 
-    def add_article(self, text, article="random"):
+    def add_article(self, text, article="random", rng=None):
         """Add a article to text, randomly or specified if text is without article.
-           otherwise, replace current article with another."""
-        words = text.split()
-        all_articles = self.articles
+           otherwise, replace current article or determiner (the longest one the text starts with) with another.
+            :arg rng: numpy Generator, self.rng if not given."""
+        if self.language_pack is None:
+            raise Exception("No language pack, create the augmenter with a language, e.g. language='fra'.")
 
+        text = text.lstrip()
         if article == "random":
-            first_word = words[0].lower()
-            first_two_words = " ".join(words[:2]).lower()
-            if first_word in self.articles:
-                all_articles.remove(first_word)
-                words = words[1:]  # remove first article
-                new_article = random.choice(all_articles)
-
-            elif first_two_words in self.articles:
-                all_articles.remove(first_two_words)
-                words = words[1:]  # remove first two articles
-                new_article = random.choice(all_articles)
-
+            rng = self.rng if rng is None else rng
+            match = self.language_pack.match(text)
+            if match is None:
+                articles = self.language_pack.alternatives()
             else:
-                new_article = random.choice(all_articles)
+                articles = self.language_pack.alternatives(match[0])
+                text = text[match[1]:]  # remove current article
+            new_article = articles[int(rng.integers(len(articles)))]
 
         else:
             new_article = article
 
-        words = [new_article] + words
-        new_text = " ".join(words)
+        return " ".join([new_article] + text.split())
 
-        return new_text
+    def augment_batch(self, texts, method, n_words=2, rng=None):
+        """Apply one augmentation method to a batch of texts, all random positions are drawn at once.
+            :arg texts: list of texts.
+            :arg method: 'swapping', 'deletion', 'insertion' or 'replacement'.
+            :arg n_words: the number of words to be altered in each text (number of swaps for swapping).
+            :arg rng: numpy Generator used for the batch, self.rng if not given.
+            :return list of new texts, a text that cannot be altered is returned as it is."""
+        if method not in self.batch_methods:
+            raise Exception("method should be one of {}.".format(", ".join(self.batch_methods)))
+        if method in ("insertion", "replacement") and len(self.vocab) == 0:
+            raise Exception("Vocabulary is empty, load or create a vocabulary first.")
+
+        rng = self.rng if rng is None else rng
+        texts = list(texts)
+        batch = [text.split() for text in texts]
+        lengths = np.fromiter(map(len, batch), dtype=np.int64, count=len(batch))
+        new_texts = list(texts)
+
+        if method == "swapping":
+            valid = (lengths >= 2).tolist()
+            first = (rng.random((len(batch), n_words)) * lengths[:, None]).astype(np.int64)
+            second = (rng.random((len(batch), n_words)) * (lengths[:, None] - 1)).astype(np.int64)
+            second += second >= first
+            for k, (words, firsts, seconds) in enumerate(zip(batch, first.tolist(), second.tolist())):
+                if valid[k]:
+                    for i, j in zip(firsts, seconds):
+                        words[i], words[j] = words[j], words[i]
+                    new_texts[k] = " ".join(words)
+
+        elif method == "deletion":
+            valid = ((lengths >= 2) & (n_words < lengths)).tolist()
+            positions = sample_positions(rng, lengths, n_words).tolist()
+            for k, (words, indices) in enumerate(zip(batch, positions)):
+                if valid[k]:
+                    indices = set(indices)
+                    new_texts[k] = " ".join(w for i, w in enumerate(words) if i not in indices)
+
+        elif method == "replacement":
+            valid = (n_words < lengths).tolist()
+            positions = sample_positions(rng, lengths, n_words).tolist()
+            word_ids = self._random_word_ids(rng, (len(batch), n_words)).tolist()
+            for k, (words, indices, ids) in enumerate(zip(batch, positions, word_ids)):
+                if valid[k]:
+                    for i, word_id in zip(indices, ids):
+                        words[i] = self.vocab[word_id]
+                    new_texts[k] = " ".join(words)
+
+        else:
+            valid = (n_words <= lengths + 1).tolist()
+            positions = sample_positions(rng, lengths + 1, n_words).tolist()
+            word_ids = self._random_word_ids(rng, (len(batch), n_words)).tolist()
+            for k, (words, indices, ids) in enumerate(zip(batch, positions, word_ids)):
+                if valid[k]:
+                    inserted = {i: self.vocab[word_id] for i, word_id in zip(indices, ids)}
+                    new_words = []
+                    for i, word in enumerate(words):
+                        if i in inserted:
+                            new_words.append(inserted[i])
+                        new_words.append(word)
+                    if len(words) in inserted:
+                        new_words.append(inserted[len(words)])
+                    new_texts[k] = " ".join(new_words)
+
+        return new_texts
+
+    def _check_plan(self, plan):
+        if not isinstance(plan, EditPlan):
+            raise Exception("plan should be an EditPlan, e.g. EditPlan().swap().delete(2).")
+        if plan.needs_vocab and len(self.vocab) == 0:
+            raise Exception("Vocabulary is empty, load or create a vocabulary first.")
+
+    def apply_plan(self, text, plan, rng=None):
+        """Apply all edits of an EditPlan to a text in one pass: the edits are composed into one map of
+           word positions, then the words are gathered and joined once.
+            :arg plan: EditPlan, e.g. EditPlan().swap().delete().replace(2).
+            :arg rng: numpy Generator, self.rng if not given.
+            :return new text."""
+        self._check_plan(plan)
+        rng = self.rng if rng is None else rng
+        words = text.split()
+        index_map, word_uniforms = compile_plan(plan, rng, len(words))
+        if not word_uniforms:
+            return " ".join([words[t] for t in index_map])
+
+        new_words = self._words_from_uniforms(word_uniforms)
+        return " ".join([words[t] if t >= 0 else new_words[-1 - t] for t in index_map])
+
+    def apply_plan_batch(self, texts, plan, rng=None):
+        """Apply an EditPlan to a batch of texts, the positions of every edit and the new words
+           are drawn for the whole batch at once.
+            :arg rng: numpy Generator, self.rng if not given.
+            :return list of new texts."""
+        self._check_plan(plan)
+        rng = self.rng if rng is None else rng
+        batch = [text.split() for text in texts]
+        index_maps, num_new = compile_plan_batch(plan, rng, [len(words) for words in batch])
+        new_words = [self.vocab[i] for i in self._random_word_ids(rng, num_new).tolist()]
+        return [" ".join([words[t] if t >= 0 else new_words[-1 - t] for t in index_map])
+                for words, index_map in zip(batch, index_maps)]
+
+    def tokenize_corpus(self, texts):
+        """Tokenize texts once into token ids of the vocabulary, to be altered by augment_corpus."""
+        return TokenizedCorpus.from_texts(texts, self.vocab)
+
+    def augment_corpus(self, corpus, method, n_words=2, rng=None):
+        """Apply one augmentation method to every sentence of a TokenizedCorpus with array edits on token ids.
+            :arg corpus: TokenizedCorpus from tokenize_corpus.
+            :arg method: 'swapping', 'deletion', 'insertion' or 'replacement'.
+            :arg n_words: the number of words to be altered in each sentence (number of swaps for swapping).
+            :arg rng: numpy Generator, self.rng if not given.
+            :return new TokenizedCorpus, sentences that cannot be altered are kept as they are."""
+        if method not in self.batch_methods:
+            raise Exception("method should be one of {}.".format(", ".join(self.batch_methods)))
+        if method in ("insertion", "replacement") and len(self.vocab) == 0:
+            raise Exception("Vocabulary is empty, load or create a vocabulary first.")
+
+        rng = self.rng if rng is None else rng
+        lengths = corpus.lengths
+        starts = corpus.offsets[:-1]
+        ids = corpus.ids.copy()
+
+        if method == "swapping":
+            valid = lengths >= 2
+            starts, lengths = starts[valid], lengths[valid]
+            for _ in range(n_words):
+                first = (rng.random(len(lengths)) * lengths).astype(np.int64)
+                second = (rng.random(len(lengths)) * (lengths - 1)).astype(np.int64)
+                second += second >= first
+                first, second = starts + first, starts + second
+                ids[first], ids[second] = ids[second], ids[first].copy()
+            return corpus.with_ids(ids, corpus.offsets)
+
+        if method == "replacement":
+            valid = n_words < lengths
+            positions = sample_positions(rng, lengths[valid], n_words)
+            flat = (starts[valid][:, None] + positions).ravel()
+            ids[flat] = self._random_word_ids(rng, len(flat))
+            return corpus.with_ids(ids, corpus.offsets)
+
+        if method == "deletion":
+            valid = (lengths >= 2) & (n_words < lengths)
+            positions = sample_positions(rng, lengths[valid], n_words)
+            keep = np.ones(len(ids), dtype=bool)
+            keep[(starts[valid][:, None] + positions).ravel()] = False
+            new_ids = ids[keep]
+            new_lengths = lengths - n_words * valid
+        else:
+            valid = n_words <= lengths + 1
+            positions = np.sort(sample_positions(rng, lengths[valid] + 1, n_words), axis=1)
+            flat = (starts[valid][:, None] + positions).ravel()  # sentence order is kept for equal indices
+            new_ids = np.insert(ids, flat, self._random_word_ids(rng, len(flat)).astype(np.int32))
+            new_lengths = lengths + n_words * valid
+
+        offsets = np.zeros(len(new_lengths) + 1, dtype=np.int64)
+        np.cumsum(new_lengths, out=offsets[1:])
+        return corpus.with_ids(new_ids, offsets)
+
+
+class EasyAugmentationFrench(EasyAugmentation):
+
+    def __init__(self, vocab_path=None, sampling="uniform", temperature=1.0, seed=None):
+        super().__init__(vocab_path, sampling, temperature, seed, language="fra")
+        self.articles = self.language_pack.articles
 
 
 class EasyAugmentationPipeline(EasyAugmentationFrench):
 
-    def __init__(self):
-        super().__init__()
+    max_attempts = 1000  # attempts to create one instance before giving up
+
+    def __init__(self, verbose=True, seed=None):
+        super().__init__(seed=seed)
+        self.verbose = verbose
+        self.run_seed = None  # seed of the last run, to regenerate its instances
         # self.src_lang = src_lang
         # self.tgt_lang = tgt_lang
         self.input_data = []
         self.new_data = []
         self.methods = ["swapping", "deletion", "replacement", "insertion"]
         self.fra_methods = ["add_article"]
+        self.metrics = None  # e.g. PipelineMetrics(), records every candidate instance
+        self.audit_log = None  # e.g. AuditLog(path), keeps original, augmented text and method of every candidate
         # self.original_file = None
 
-    def read_files(self, input_file):
-        """read input files"""
+    def read_files(self, input_file, cache=None):
+        """read input files
+            :arg cache: ParseCache or cache directory, input files read before are then memory-mapped from it
+                        and self.input_data is a read-only sequence of pairs."""
+        cache = make_parse_cache(cache)
+        if cache is not None:
+            key = cache.key(input_file, reader="read_files")
+            cached = cache.get(key)
+            if cached is None:
+                self.read_files(input_file)
+                cached = cache.put(key, [src for src, _ in self.input_data], [tgt for _, tgt in self.input_data])
+            elif self.verbose:
+                print("\n{} parallel data read from cache".format(len(cached)))
+            self.input_data = cached
+            return
+
         if (type(input_file) is list) and len(input_file) == 2:
             src_lines = txt_io(input_file[0], action='r')
             tgt_lines = txt_io(input_file[1], action='r')
             self.input_data = list(zip(src_lines, tgt_lines))
 
         elif (type(input_file) is str) and (os.path.splitext(input_file)[1] == ".xlsx"):
-            df = excel_io(input_file, action='r')
-            cols = df.columns
-            self.input_data = list(zip(df[cols[0]], df[cols[1]]))
+            self.input_data = list(excel_iter(input_file))
         else:
             raise Exception("input file not supported.")
 
-        print("\n{} parallel data read".format(len(self.input_data)))
+        if self.verbose:
+            print("\n{} parallel data read".format(len(self.input_data)))
+
+    def iter_input_pairs(self, input_file):
+        """Iterate over pairs of input files, lazily for 2txt and .xlsx files."""
+        if (type(input_file) is list) and len(input_file) == 2:
+            return zip(txt_iter(input_file[0]), txt_iter(input_file[1]))
+        if (type(input_file) is str) and (os.path.splitext(input_file)[1] == ".xlsx"):
+            return excel_iter(input_file)
 
-    def save_new_data(self, output_file):
-        # df = pd.DataFrame(self.new_data, columns=["source", "target"])
-        if (type(output_file) is list) and len(output_file) == 2:
-            txt_io(output_file[0], action='w', write_lines=[p[0] for p in self.new_data])
-            txt_io(output_file[1], action='w', write_lines=[p[1] for p in self.new_data])
-        elif (type(output_file) is str) and (os.path.splitext(output_file)[1] == ".xlsx"):
-            excel_io(output_file, action='w', write_df=self.new_data)
+        self.read_files(input_file)
+        input_data, self.input_data = self.input_data, []
+        return iter(input_data)
+
+    def save_new_data(self, output_file, **kwargs):
+        """Save new data in chunks to a list of two txt files, or a .xlsx, .jsonl or .tsv file.
+            :arg kwargs: writer options, e.g. chunk_size, or max_rows and rollover for Excel."""
+        with get_pair_writer(output_file, **kwargs) as writer:
+            writer.write_pairs(self.new_data)
+
+    def _draw_method(self, alter_source=True, rng=None):
+        """Draw the method of a candidate and its parameter (None for a method of self.fra_methods)."""
+        rng = self.rng if rng is None else rng
+        u_method, u_param, u_article, u_fra_method = rng.random(4).tolist()
+        if not alter_source and u_article < 0.1:  # 10% of time, add articles
+            return self.fra_methods[int(u_fra_method * len(self.fra_methods))], None
+        return self.methods[int(u_method * len(self.methods))], 1 + int(u_param * 2)
+
+    def _create_bad_instance(self, src, tgt, alter_source=True, rng=None):
+        """Alter source or target text of one pair with a randomly chosen method.
+            :arg rng: numpy Generator of all draws, self.rng if not given.
+            :return new pair and the method used."""
+        rng = self.rng if rng is None else rng
+        method, param = self._draw_method(alter_source, rng)
+        return self._apply_method(src, tgt, method, param, alter_source, rng), method
+
+    def _apply_method(self, src, tgt, method, param, alter_source, rng):
+        text = src if alter_source else tgt
+        if param is None:
+            new_text = self.__getattribute__(method)(text, rng=rng)
+        else:
+            new_text = self.__getattribute__(method)(text, param, rng=rng)
+
+        return (new_text, tgt) if alter_source else (src, new_text)
+
+    def _try_bad_instance(self, src, tgt, alter_source=True, dedup_index=None, rng=None, index=None, attempt=None):
+        """Create a candidate instance from one pair, check it and record it in self.metrics and self.audit_log.
+            :arg index, attempt: instance number and attempt the candidate is created for, kept in the audit log.
+            :return new pair, or None if it is rejected, and the method used."""
+        start = time.perf_counter()
+        new_pair, method_used = self._create_bad_instance(src, tgt, alter_source, rng)
+        return self._check_candidate(src, tgt, new_pair, method_used, alter_source, dedup_index, start, index,
+                                     attempt), method_used
+
+    def _check_candidate(self, src, tgt, new_pair, method_used, alter_source, dedup_index, start, index, attempt):
+        """Reject a candidate equal to its original or, with dedup, already seen, and record it.
+            :arg start: perf_counter time the candidate creation started at.
+            :return new pair, or None if it is rejected."""
+        if (src, tgt) == new_pair:
+            reason = "unchanged"
+        elif dedup_index is not None and not dedup_index.add(new_pair):
+            reason = "duplicate"
         else:
-            raise Exception("output file not supported.")
+            reason = None
+
+        if self.metrics is not None:
+            self.metrics.record(method_used, time.perf_counter() - start, reason)
+        if self.audit_log is not None:
+            k = 0 if alter_source else 1
+            self.audit_log.log({"original": (src, tgt)[k], "augmented": new_pair[k], "method": method_used,
+                                "accepted": reason is None, "reason": reason, "index": index, "attempt": attempt})
+
+        return new_pair if reason is None else None
+
+    def _start_metrics(self):
+        if self.metrics is not None and hasattr(self.metrics, "start"):
+            self.metrics.start()
+
+    def _start_run(self, seed=None):
+        """Record the seed of a run in self.run_seed, self.seed if seed is not given, or a fresh one.
+            :return CounterRNG keyed by the seed."""
+        seed = self.seed if seed is None else seed
+        self.run_seed = new_seed() if seed is None else seed
+        return CounterRNG(self.run_seed)
+
+    def _create_instance_at(self, counter_rng, index, alter_source=True, dedup_index=None):
+        """Create instance #index. Attempt a draws the input pair and the edit from the random stream
+           (index, a) only, attempts go on until a candidate is accepted.
+            :return new pair and the method used."""
+        length = len(self.input_data)
+        for attempt in range(self.max_attempts):
+            rng = counter_rng.at(index, attempt)
+            src, tgt = self.input_data[int(rng.random() * length)]
+            new_pair, method_used = self._try_bad_instance(src, tgt, alter_source, dedup_index, rng, index, attempt)
+            if new_pair is not None:
+                return new_pair, method_used
+
+        raise Exception("No bad instance can be created for instance #{} in {} attempts.".format(index,
+                                                                                              self.max_attempts))
+
+    def regenerate_instance(self, index, alter_source=True, seed=None):
+        """Create instance #index of a run again, e.g. when QA flags it. Input data and vocabulary must be loaded.
+           The instance is the same as in the run if it was created without dedup.
+            :arg seed: seed of the run, self.run_seed if not given.
+            :return new pair and the method used."""
+        seed = self.run_seed if seed is None else seed
+        if seed is None:
+            raise Exception("seed of the run to regenerate is unknown.")
+        return self._create_instance_at(CounterRNG(seed), index, alter_source)
 
     def create_bad_instance_from_good(self,
                                       original_files,
                                       vocab_path,
                                       alter_source=True,
-                                      num_instances=100):
+                                      num_instances=100,
+                                      n_jobs=1,
+                                      seed=None,
+                                      dedup=None,
+                                      start_index=0,
+                                      cache=None,
+                                      backend=None,
+                                      max_batch_size=32,
+                                      max_latency=0.01,
+                                      max_concurrency=4,
+                                      max_queue_size=1024):
         """Create bad instances (randomly) from original TM/TB file.
+           Instance #i only depends on the seed, i and the input data, so a job can be split in shards
+           on any number of processes or machines and give the same instances as a single run.
             :arg original_files: input original TM/TB file
             :arg vocab_path: vocab filepath of specified src or tgt language.
             :arg lang: text of which language will be used to create bad instances.
             :arg randomly: randomly create bad instances or not.
-            :arg num_instances: number of instance to create."""
-        self.read_files(original_files)
+            :arg num_instances: number of instance to create.
+            :arg n_jobs: number of worker processes, -1 to use all cores.
+            :arg seed: key of the counter-based random streams, self.seed if not given, or a fresh seed
+                       recorded in self.run_seed.
+            :arg dedup: None, 'exact' or 'bloom', or a dedup index object. When set, an instance equal to
+                        an instance already created or to any original pair is not counted, which makes
+                        instances depend on the ones before them: shards are only reproducible without dedup.
+            :arg start_index: number of the first instance, a shard creates instances start_index to
+                              start_index + num_instances - 1.
+            :arg cache: ParseCache or cache directory to read input files from when they were read before.
+            :arg backend: AugmentationBackend used as one more method, see create_bad_instance_from_good_async.
+            :arg max_batch_size, max_latency, max_concurrency, max_queue_size: micro-batching of the backend texts,
+                 see backends.MicroBatcher."""
+        if backend is not None:
+            if n_jobs not in (1, None):
+                raise Exception("A backend runs in a single process, n_jobs should be 1.")
+            asyncio.run(self.create_bad_instance_from_good_async(original_files, vocab_path, backend,
+                                                                 alter_source=alter_source,
+                                                                 num_instances=num_instances, seed=seed,
+                                                                 dedup=dedup, start_index=start_index,
+                                                                 cache=cache, max_batch_size=max_batch_size,
+                                                                 max_latency=max_latency,
+                                                                 max_concurrency=max_concurrency,
+                                                                 max_queue_size=max_queue_size))
+            return
+
+        if n_jobs == -1:
+            n_jobs = os.cpu_count()
+        if n_jobs > 1:
+            self._create_bad_instances_parallel(original_files, vocab_path, alter_source, num_instances, n_jobs, seed,
+                                                dedup, start_index, cache)
+            return
+
+        self.read_files(original_files, cache=cache)
         self.vocab_path = vocab_path  # load specified
         self.load_vocab()
-        num_created = 0
+        self._create_bad_instances(num_instances, alter_source, dedup, seed=seed, start_index=start_index)
+
+    def _create_bad_instances(self, num_instances, alter_source=True, dedup=None, methods_used=None, seed=None,
+                              start_index=0):
+        """Create instances start_index to start_index + num_instances - 1 from self.input_data into self.new_data.
+            :arg methods_used: list to collect the method of every new instance in."""
+        counter_rng = self._start_run(seed)
+        self._start_metrics()
         length = len(self.input_data)
+        dedup_index = make_dedup_index(dedup, capacity=length + num_instances)
+        if dedup_index is not None:
+            dedup_index.update(self.input_data)
 
-        while num_created < num_instances:
-        # for j, i in enumerate(np.random.randint(0, len(self.input_data), num_instances)):
-            ind = random.choice(range(length))
-            src, tgt = self.input_data[ind]
-            method = random.choice(self.methods)
-            fra_method = None
-            param = random.choice(range(1, 3))
-            if alter_source:
-                print("\nOriginal : {}".format(src))
-                new_text = self.__getattribute__(method)(src, param)
-                new_pair = (new_text, tgt)
+        for index in range(start_index, start_index + num_instances):
+            new_pair, method_used = self._create_instance_at(counter_rng, index, alter_source, dedup_index)
+            self.new_data.append(new_pair)
+            if methods_used is not None:
+                methods_used.append(method_used)
 
+    async def _create_instance_at_async(self, counter_rng, index, alter_source, dedup_index, batcher):
+        """Create instance #index as _create_instance_at does, the texts of the backend method are sent to batcher.
+           All draws of an attempt are made before waiting for the backend, so the generator shared by the
+           instances in progress is never moved to another stream in the middle of an attempt."""
+        length = len(self.input_data)
+        for attempt in range(self.max_attempts):
+            start = time.perf_counter()
+            rng = counter_rng.at(index, attempt)
+            src, tgt = self.input_data[int(rng.random() * length)]
+            method, param = self._draw_method(alter_source, rng)
+            if method == batcher.backend.name:
+                new_text = await batcher.submit(src if alter_source else tgt)
+                new_pair = (new_text, tgt) if alter_source else (src, new_text)
             else:
-                print("\nOriginal: {}".format(tgt))
-                if random.choice([False] * 9 + [True]):  # 10% of time, add articles
-                    fra_method = random.choice(self.fra_methods)
-                    new_text = self.__getattribute__(fra_method)(tgt)
-                else:
-                    new_text = self.__getattribute__(method)(tgt, param)
+                new_pair = self._apply_method(src, tgt, method, param, alter_source, rng)
+
+            new_pair = self._check_candidate(src, tgt, new_pair, method, alter_source, dedup_index, start, index,
+                                             attempt)
+            if new_pair is not None:
+                return new_pair
+
+        raise Exception("No bad instance can be created for instance #{} in {} attempts.".format(index,
+                                                                                              self.max_attempts))
+
+    async def create_bad_instance_from_good_async(self,
+                                                  original_files,
+                                                  vocab_path,
+                                                  backend,
+                                                  alter_source=True,
+                                                  num_instances=100,
+                                                  seed=None,
+                                                  dedup=None,
+                                                  start_index=0,
+                                                  cache=None,
+                                                  max_batch_size=32,
+                                                  max_latency=0.01,
+                                                  max_concurrency=4,
+                                                  max_queue_size=1024):
+        """Create bad instances with a model backend (e.g. back-translation) among the methods.
+           The backend is drawn like the other methods under its name (added to self.methods for the run if
+           missing, set self.methods to [backend.name] to only use it). Up to max_queue_size instances are
+           created concurrently, their backend texts micro-batched, and new data is kept in instance order:
+           without dedup, instances are the same as a run with the same seed whatever the batching.
+            :arg backend: AugmentationBackend.
+            :arg max_batch_size, max_latency, max_concurrency, max_queue_size: see backends.MicroBatcher.
+            other arguments: see create_bad_instance_from_good."""
+        self.read_files(original_files, cache=cache)
+        self.vocab_path = vocab_path  # load specified
+        self.load_vocab()
+
+        methods = self.methods
+        if backend.name not in methods:
+            self.methods = methods + [backend.name]
+        counter_rng = self._start_run(seed)
+        self._start_metrics()
+        dedup_index = make_dedup_index(dedup, capacity=len(self.input_data) + num_instances)
+        if dedup_index is not None:
+            dedup_index.update(self.input_data)
+
+        pending = deque()
+        try:
+            async with MicroBatcher(backend, max_batch_size=max_batch_size, max_latency=max_latency,
+                                    max_concurrency=max_concurrency, max_queue_size=max_queue_size) as batcher:
+                try:
+                    for index in range(start_index, start_index + num_instances):
+                        pending.append(asyncio.ensure_future(
+                            self._create_instance_at_async(counter_rng, index, alter_source, dedup_index, batcher)))
+                        if len(pending) >= max_queue_size:
+                            self.new_data.append(await pending.popleft())
+                    while pending:
+                        self.new_data.append(await pending.popleft())
+                except BaseException:
+                    for task in pending:
+                        task.cancel()
+                    await asyncio.gather(*pending, return_exceptions=True)
+                    raise
+        finally:
+            self.methods = methods
+
+    def _create_bad_instances_parallel(self, original_files, vocab_path, alter_source, num_instances, n_jobs, seed,
+                                       dedup=None, start_index=0, cache=None):
+        """Split instances in n_jobs ranges of consecutive numbers created in a pool of n_jobs processes.
+           Input files are read once here into the parse cache, a temporary one if cache is not given, and
+           workers memory-map its entry, so the input data is held once whatever n_jobs. Each worker loads
+           the vocabulary once.
+           Results are merged in range order, so without dedup the new data is the same as a single process run.
+           With dedup, workers drop their own duplicates and the merge drops duplicates across workers,
+           the instances missing after the merge are created with the next numbers in another round, by
+           workers that also know the pairs accepted so far. Rounds stop with an error when max_attempts of
+           them in a row accept nothing."""
+        if cache is not None:
+            self._create_bad_instances_in_pool(original_files, vocab_path, alter_source, num_instances, n_jobs, seed,
+                                               dedup, start_index, cache)
+            return
+
+        with tempfile.TemporaryDirectory(prefix="text_augmentation_", ignore_cleanup_errors=True) as cache_dir:
+            try:
+                self._create_bad_instances_in_pool(original_files, vocab_path, alter_source, num_instances, n_jobs,
+                                                   seed, dedup, start_index, ParseCache(cache_dir))
+            finally:
+                self.input_data = []  # release the memory-mapped entry before its directory is removed
+
+    def _create_bad_instances_in_pool(self, original_files, vocab_path, alter_source, num_instances, n_jobs, seed,
+                                      dedup, start_index, cache):
+        # parsed and keyed once here, workers memory-map the cache entry without reading the files again
+        self.read_files(original_files, cache=cache)
+        cached_pairs = self.input_data
+        dedup_index = None
+        if dedup is not None:
+            dedup_index = make_dedup_index(dedup, capacity=len(cached_pairs) + num_instances)
+            dedup_index.update(cached_pairs)
+        worker_dedup = dedup if isinstance(dedup, str) else None
+        worker_metrics = self.metrics is not None and hasattr(self.metrics, "merge")
+        worker_audit = self.audit_log is not None
+        self._start_run(seed)
+        self._start_metrics()
+
+        remaining = num_instances
+        next_index = start_index
+        failed_rounds = 0
+
+        # settings of this pipeline the instances depend on, so workers create the same ones as a single process
+        settings = {"sampling": self.sampling, "temperature": self.temperature, "language_pack": self.language_pack,
+                    "max_attempts": self.max_attempts}
+
+        with ProcessPoolExecutor(max_workers=n_jobs,
+                                 initializer=_init_pipeline_worker,
+                                 initargs=(cached_pairs, vocab_path, settings)) as executor:
+            while remaining > 0:
+                if failed_rounds == self.max_attempts:
+                    raise Exception("No bad instance can be created for instance #{} in {} attempts.".format(
+                        next_index, self.max_attempts))
+                budgets = [remaining // n_jobs + (i < remaining % n_jobs) for i in range(n_jobs)]
+                # pairs accepted in previous rounds, so workers do not create them again
+                seen_pairs = self.new_data if worker_dedup is not None else []
+                tasks = []
+                for budget in budgets:
+                    if budget > 0:
+                        tasks.append((budget, next_index, self.run_seed, alter_source, self.methods, self.fra_methods,
+                                      worker_dedup, worker_metrics, worker_audit, seen_pairs))
+                        next_index += budget
+
+                remaining_before = remaining
+
+                for new_data, methods_used, metrics, audit_records in executor.map(_run_pipeline_worker, tasks):
+                    if worker_metrics:
+                        self.metrics.merge(metrics)
+                    if worker_audit:
+                        for record in audit_records:
+                            self.audit_log.log(record)
+                    for k, new_pair in enumerate(new_data):
+                        if dedup_index is None or dedup_index.add(new_pair):
+                            self.new_data.append(new_pair)
+                            remaining -= 1
+                        elif worker_metrics:
+                            self.metrics.revoke(methods_used[k], "duplicate")
+                failed_rounds = failed_rounds + 1 if remaining == remaining_before else 0
+
+    def iter_bad_instances_from_good(self,
+                                     original_files,
+                                     vocab_path,
+                                     alter_source=True,
+                                     num_instances=100,
+                                     dedup=None,
+                                     seed=None):
+        """Lazily create bad instances from original 2txt or .xlsx TM/TB files, nothing is kept in memory.
+           Each pass over the files spreads the instances still to create over the lines with sequential
+           binomial draws (a multinomial sample, as picking lines at random), so pairs come out in file order.
+           Passes are repeated until the instances rejected because they equal their original are made up.
+            :arg original_files: list of source and target txt files, or a .xlsx file.
+            :arg vocab_path: vocab filepath of specified src or tgt language.
+            :arg num_instances: number of instance to create.
+            :arg dedup: None, 'exact' or 'bloom' (memory bounded), or a dedup index object.
+            :arg seed: key of the random streams of the passes and candidates, see create_bad_instance_from_good.
+            :return generator of new pairs."""
+        is_2txt = (type(original_files) is list) and len(original_files) == 2
+        is_xlsx = (type(original_files) is str) and (os.path.splitext(original_files)[1] == ".xlsx")
+        if not (is_2txt or is_xlsx):
+            raise Exception("streaming mode only supports 2txt and .xlsx input files.")
+
+        self.vocab_path = vocab_path  # load specified
+        self.load_vocab()
+        length = sum(1 for _ in self.iter_input_pairs(original_files))
+        if length == 0:
+            raise Exception("input files are empty.")
+
+        dedup_index = make_dedup_index(dedup, capacity=length + num_instances)
+        if dedup_index is not None:
+            dedup_index.update(self.iter_input_pairs(original_files))
+
+        counter_rng = self._start_run(seed)
+        pass_rngs = CounterRNG(self.run_seed)
+        self._start_metrics()
+        num_created = 0
+        num_candidates = 0
+        num_passes = 0
+        while num_created < num_instances:
+            remaining = num_instances - num_created
+            created_in_pass = 0
+            pass_rng = pass_rngs.at(num_passes, stream=1)
+            num_passes += 1
+
+            for i, (src, tgt) in enumerate(self.iter_input_pairs(original_files)):
+                if remaining == 0:
+                    break
+                n_picks = int(pass_rng.binomial(remaining, 1 / (length - i)))
+                remaining -= n_picks
+
+                for _ in range(n_picks):
+                    rng = counter_rng.at(num_candidates)
+                    num_candidates += 1
+                    new_pair, _ = self._try_bad_instance(src, tgt, alter_source, dedup_index, rng)
+                    if new_pair is not None:
+                        created_in_pass += 1
+                        yield new_pair
+
+            if created_in_pass == 0:
+                raise Exception("No bad instance can be created from input files.")
+            num_created += created_in_pass
+
+    def create_bad_instance_from_good_stream(self,
+                                             original_files,
+                                             vocab_path,
+                                             output_file,
+                                             alter_source=True,
+                                             num_instances=100,
+                                             dedup=None,
+                                             seed=None):
+        """Create bad instances from original 2txt or .xlsx TM/TB files and write each of them as soon as it is created,
+           memory use does not grow with the corpus size or num_instances.
+            :arg output_file: list of two txt files, or a .xlsx, .jsonl or .tsv file to write.
+            :return number of instances written."""
+        with get_pair_writer(output_file) as writer:
+            num_written = writer.write_pairs(self.iter_bad_instances_from_good(original_files, vocab_path,
+                                                                               alter_source=alter_source,
+                                                                               num_instances=num_instances,
+                                                                               dedup=dedup,
+                                                                               seed=seed))
+
+        return num_written
+
+
+_worker_pipeline = None
+
+
+def _init_pipeline_worker(cached_pairs, vocab_path, settings=None):
+    """Open the CachedPairs of the input files (pickled as the paths of the cache entry) and read the vocabulary
+       once per worker process.
+        :arg settings: attributes of the parent pipeline, e.g. sampling and language_pack, set before the
+                       vocabulary is loaded."""
+    global _worker_pipeline
+    _worker_pipeline = EasyAugmentationPipeline(verbose=False)
+    for name, value in (settings or {}).items():
+        setattr(_worker_pipeline, name, value)
+    _worker_pipeline.input_data = cached_pairs
+    _worker_pipeline.vocab_path = vocab_path
+    _worker_pipeline.load_vocab()
+
 
-                new_pair = (src, new_text)
+def _run_pipeline_worker(task):
+    """Create a range of consecutive bad instances in a worker process."""
+    (num_instances, start_index, seed, alter_source, methods, fra_methods, dedup, with_metrics, with_audit,
+     seen_pairs) = task
 
-            method_used = fra_method if fra_method else method
-            print("{}: {}".format(method_used, new_text))
+    pipe = _worker_pipeline
+    pipe.methods = methods
+    pipe.fra_methods = fra_methods
+    pipe.new_data = []
+    pipe.metrics = PipelineMetrics() if with_metrics else None
+    pipe.audit_log = MemoryAuditLog() if with_audit else None
+    methods_used = [] if with_metrics else None
+    if dedup is not None:
+        dedup = make_dedup_index(dedup, capacity=len(pipe.input_data) + len(seen_pairs) + num_instances)
+        dedup.update(seen_pairs)  # the original pairs are added by _create_bad_instances
+    pipe._create_bad_instances(num_instances, alter_source, dedup, methods_used, seed=seed, start_index=start_index)
 
-            if (src, tgt) != new_pair:
-                self.new_data.append(new_pair)
-                num_created += 1
+    return pipe.new_data, methods_used, pipe.metrics.to_dict() if with_metrics else None, pipe.audit_log
 
 
 def test_create_vocab():
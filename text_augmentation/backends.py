@@ -0,0 +1,162 @@
+import asyncio
+from abc import ABC, abstractmethod
+
+
+class AugmentationBackend(ABC):
+    """Model-based augmenter, e.g. back-translation or paraphrasing, called on batches of texts.
+
+       Subclasses implement the coroutine augment_batch. The pipeline uses a backend as one more method,
+       drawn by its name, and sends its texts through a MicroBatcher so many instances share each call."""
+
+    name = "backend"
+
+    @abstractmethod
+    async def augment_batch(self, texts):
+        """:return one augmented text for each text, in the same order."""
+
+
+def _reverse_words(text):
+    return " ".join(reversed(text.split()))
+
+
+class StubBackend(AugmentationBackend):
+    """Local backend for tests: waits latency seconds, plus per_item_latency seconds per text, like a model
+       server would, then applies transform (reverses word order by default) to each text.
+       Sizes of the batches received are kept in batch_sizes, and the highest number of calls running
+       at once in max_running."""
+
+    def __init__(self, latency=0.01, per_item_latency=0.0, transform=_reverse_words, name="stub"):
+        self.latency = latency
+        self.per_item_latency = per_item_latency
+        self.transform = transform
+        self.name = name
+        self.batch_sizes = []
+        self.running = 0
+        self.max_running = 0
+
+    async def augment_batch(self, texts):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(self.latency + self.per_item_latency * len(texts))
+            self.batch_sizes.append(len(texts))
+            return [self.transform(text) for text in texts]
+        finally:
+            self.running -= 1
+
+
+class MicroBatcher(object):
+    """Group texts submitted one at a time by concurrent callers into backend batches.
+
+       A batch is sent when it has max_batch_size texts, or max_latency seconds after its first text
+       arrived. At most max_concurrency batches run at once, and at most max_queue_size texts wait in the
+       queue: submit blocks when it is full, so producers cannot run far ahead of the backend.
+       Each caller gets the result of its own text whatever the order batches complete in.
+
+       >>> async with MicroBatcher(backend, max_batch_size=32) as batcher:
+       ...     results = await batcher.map(texts)"""
+
+    def __init__(self, backend, max_batch_size=32, max_latency=0.01, max_concurrency=4, max_queue_size=1024):
+        if max_batch_size < 1 or max_concurrency < 1 or max_queue_size < 1:
+            raise Exception("max_batch_size, max_concurrency and max_queue_size should be at least 1.")
+        self.backend = backend
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.max_concurrency = max_concurrency
+        self.max_queue_size = max_queue_size
+        self._queue = None
+        self._collector = None
+        self._batches = set()
+
+    async def start(self):
+        if self._collector is None:
+            self._queue = asyncio.Queue(self.max_queue_size)
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+            self._collector = asyncio.ensure_future(self._collect())
+        return self
+
+    async def close(self):
+        """Send the texts still queued and wait for all batches to complete."""
+        if self._collector is None:
+            return
+        await self._queue.put(None)
+        await self._collector
+        if self._batches:
+            await asyncio.gather(*self._batches, return_exceptions=True)
+        self._collector = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def submit(self, text):
+        """Queue one text, waiting while the queue is full.
+            :return augmented text from the batch it was sent in."""
+        await self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future))
+        return await future
+
+    async def map(self, texts):
+        """Augment texts concurrently, keeping at most max_queue_size of them in flight.
+            :return augmented texts in the order of texts."""
+        results = []
+        pending = []
+        for text in texts:
+            pending.append(asyncio.ensure_future(self.submit(text)))
+            if len(pending) >= self.max_queue_size:
+                results += await asyncio.gather(*pending)
+                pending = []
+        results += await asyncio.gather(*pending)
+        return results
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        closing = False
+        while not closing:
+            await self._slots.acquire()  # wait for a free slot first, texts meanwhile pile up in full batches
+            item = await self._queue.get()
+            if item is None:
+                self._slots.release()
+                break
+
+            batch = [item]
+            deadline = loop.time() + self.max_latency
+            while len(batch) < self.max_batch_size:
+                if self._queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    item = self._queue.get_nowait()
+                if item is None:
+                    closing = True
+                    break
+                batch.append(item)
+
+            task = asyncio.ensure_future(self._send(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _send(self, batch):
+        try:
+            results = await self.backend.augment_batch([text for text, _ in batch])
+            if len(results) != len(batch):
+                raise Exception("Backend '{}' returned {} texts for a batch of {}.".format(self.backend.name,
+                                                                                           len(results), len(batch)))
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._slots.release()
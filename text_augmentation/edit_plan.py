@@ -0,0 +1,164 @@
+import numpy as np
+from text_augmentation.utils.token_corpus import sample_positions, positions_from_uniforms
+
+EDIT_OPS = ("swap", "delete", "insert", "replace")
+
+
+class EditPlan(object):
+    """Sequence of word edits (swaps, deletions, insertions and replacements) applied to a sentence at once.
+
+       Plans are immutable and built by chaining, e.g. EditPlan().swap().delete(2).replace(), so one plan
+       can be shared by threads and reused for any number of sentences. Edits apply in order, each one to
+       the words left by the previous ones. An edit that cannot apply to a sentence (same rules as the
+       single augmentation methods, e.g. deleting all words) is skipped for that sentence."""
+
+    def __init__(self, edits=()):
+        for op, n in edits:
+            if op not in EDIT_OPS:
+                raise Exception("edit should be one of {}.".format(", ".join(EDIT_OPS)))
+            if n < 1:
+                raise Exception("number of words of an edit should be at least 1.")
+        self.edits = tuple((op, int(n)) for op, n in edits)
+        # uniform numbers drawn for one sentence: positions of the edits, then the new words
+        self.num_position_draws = sum(2 * n if op == "swap" else n for op, n in self.edits)
+        self.max_new_words = sum(n for op, n in self.edits if op in ("insert", "replace"))
+
+    def _then(self, op, n):
+        return EditPlan(self.edits + ((op, n),))
+
+    def swap(self, n=1):
+        """Plan n swaps of two words."""
+        return self._then("swap", n)
+
+    def delete(self, n=1):
+        """Plan the deletion of n words."""
+        return self._then("delete", n)
+
+    def insert(self, n=1):
+        """Plan the insertion of n vocabulary words."""
+        return self._then("insert", n)
+
+    def replace(self, n=1):
+        """Plan the replacement of n words by vocabulary words."""
+        return self._then("replace", n)
+
+    @property
+    def needs_vocab(self):
+        return self.max_new_words > 0
+
+    def __iter__(self):
+        return iter(self.edits)
+
+    def __len__(self):
+        return len(self.edits)
+
+    def __eq__(self, other):
+        return isinstance(other, EditPlan) and self.edits == other.edits
+
+    def __hash__(self):
+        return hash(self.edits)
+
+    def __repr__(self):
+        return "EditPlan({})".format(".".join("{}({})".format(op, n) for op, n in self.edits))
+
+
+def _can_apply(op, n, length):
+    if op == "swap":
+        return length >= 2
+    if op in ("delete", "replace"):
+        return n < length and (op == "replace" or length >= 2)
+    return n <= length + 1
+
+
+def apply_edit(index_map, op, positions, num_new):
+    """Apply one edit at drawn positions to an index map, a list of original word positions where the k-th
+       new word is -1 - k. Positions are pairs of positions for swaps, and gaps before words (len for the end)
+       for insertions.
+        :return new index map and number of new words."""
+    if op == "swap":
+        for i, j in zip(positions[::2], positions[1::2]):
+            index_map[i], index_map[j] = index_map[j], index_map[i]
+        return index_map, num_new
+
+    if op == "delete":
+        dropped = set(positions)
+        return [t for i, t in enumerate(index_map) if i not in dropped], num_new
+
+    if op == "replace":
+        for i in positions:
+            index_map[i] = -1 - num_new
+            num_new += 1
+        return index_map, num_new
+
+    inserted = {}
+    for i in sorted(positions):
+        inserted[i] = -1 - num_new
+        num_new += 1
+    new_map = []
+    for i, t in enumerate(index_map):
+        if i in inserted:
+            new_map.append(inserted[i])
+        new_map.append(t)
+    if len(index_map) in inserted:
+        new_map.append(inserted[len(index_map)])
+    return new_map, num_new
+
+
+def compile_plan(plan, rng, length):
+    """Compose the edits of plan for a sentence of length words into one index map, all random numbers
+       being drawn with a single call of rng.
+        :return index map (see apply_edit), and one uniform number in [0, 1) to draw each new word from."""
+    uniforms = rng.random(plan.num_position_draws + plan.max_new_words).tolist()
+    index_map = list(range(length))
+    num_new = 0
+    u = 0
+    for op, n in plan.edits:
+        if not _can_apply(op, n, len(index_map)):
+            continue
+        if op == "swap":
+            positions = []
+            for _ in range(n):
+                positions += positions_from_uniforms(uniforms[u:u + 2], len(index_map))
+                u += 2
+        else:
+            positions = positions_from_uniforms(uniforms[u:u + n], len(index_map) + (op == "insert"))
+            u += n
+        index_map, num_new = apply_edit(index_map, op, positions, num_new)
+
+    return index_map, uniforms[plan.num_position_draws:plan.num_position_draws + num_new]
+
+
+def compile_plan_batch(plan, rng, lengths):
+    """Compile plan for a batch of sentences, the positions of every edit are drawn for all sentences at once.
+        :return list of index maps, and number of new words of all sentences, numbered in sentence order
+                after an offset of the previous sentences."""
+    lengths = np.asarray(lengths, dtype=np.int64)
+    index_maps = [list(range(length)) for length in lengths.tolist()]
+    num_new = [0] * len(index_maps)
+
+    for op, n in plan.edits:
+        if op == "swap":
+            valid = lengths >= 2
+            positions = np.concatenate([sample_positions(rng, lengths, 2) for _ in range(n)], axis=1)
+        elif op in ("delete", "replace"):
+            valid = (n < lengths) & ((lengths >= 2) | (op == "replace"))
+            positions = sample_positions(rng, lengths, n)
+        else:
+            valid = n <= lengths + 1
+            positions = sample_positions(rng, lengths + 1, n)
+
+        positions = positions.tolist()
+        for k in np.flatnonzero(valid).tolist():
+            index_maps[k], num_new[k] = apply_edit(index_maps[k], op, positions[k], num_new[k])
+        if op == "delete":
+            lengths = lengths - n * valid
+        elif op == "insert":
+            lengths = lengths + n * valid
+
+    # number new words of the whole batch consecutively
+    offset = 0
+    for k, index_map in enumerate(index_maps):
+        if offset and num_new[k]:
+            index_maps[k] = [t - offset if t < 0 else t for t in index_map]
+        offset += num_new[k]
+    return index_maps, offset
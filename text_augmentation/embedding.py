@@ -0,0 +1,205 @@
+import os
+import numpy as np
+from text_augmentation.utils.string_store import StringStore
+from text_augmentation.utils.file_io import txt_iter
+
+
+def _read_text_vectors(source, max_words=None):
+    """Read words and count vectors of a word2vec/fastText text file, with or without its 'count dim' header.
+        :arg max_words: stop reading after max_words vectors.
+        :return list of words, vector dimension and whether the first line is a header."""
+    words = []
+    dim = None
+    has_header = False
+    with open(source, 'r', encoding='utf-8', errors='replace') as f:
+        for k, line in enumerate(f):
+            if max_words is not None and len(words) >= max_words and dim is not None:
+                break
+            parts = line.rstrip().split(" ")
+            if k == 0 and len(parts) == 2 and parts[0].isdigit() and parts[1].isdigit():
+                has_header = True
+                continue
+            if dim is None:
+                dim = len(parts) - 1
+            words.append(parts[0])
+    return words, dim, has_header
+
+
+def _normalize_rows(block):
+    norms = np.linalg.norm(block, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return block / norms
+
+
+def convert_word_vectors(source, output_prefix, words_path=None, max_words=None, dtype=np.float32,
+                         chunk_size=10000):
+    """Convert word vectors into a store that is memory-mapped by WordVectors: the words in a string store
+       (<output_prefix>.words) and the L2-normalized vectors in a .npy matrix (<output_prefix>.vectors.npy).
+       Vectors are streamed in chunks, the whole matrix is never held in memory.
+        :arg source: word2vec/fastText text file (.vec, .txt) or .npy matrix.
+        :arg words_path: text file of the words of a .npy matrix, one per line.
+        :arg max_words: keep the first max_words vectors only, the most frequent words in usual files.
+        :arg dtype: np.float32, or np.float16 to halve the size of the store.
+        :return WordVectors."""
+    words_store_path, vectors_path = output_prefix + ".words", output_prefix + ".vectors.npy"
+
+    if os.path.splitext(source)[1] == ".npy":
+        if words_path is None:
+            raise Exception("words_path is needed to convert a .npy matrix.")
+        matrix = np.load(source, mmap_mode='r')
+        words = list(txt_iter(words_path))
+        n = min(len(words), len(matrix)) if max_words is None else min(len(words), len(matrix), max_words)
+        vectors = np.lib.format.open_memmap(vectors_path, mode='w+', dtype=dtype, shape=(n, matrix.shape[1]))
+        for start in range(0, n, chunk_size):
+            end = min(start + chunk_size, n)
+            vectors[start:end] = _normalize_rows(np.asarray(matrix[start:end], dtype=np.float32))
+
+    else:
+        words, dim, has_header = _read_text_vectors(source, max_words)
+        n = len(words) if max_words is None else min(len(words), max_words)
+        vectors = np.lib.format.open_memmap(vectors_path, mode='w+', dtype=dtype, shape=(n, dim))
+        with open(source, 'r', encoding='utf-8', errors='replace') as f:
+            if has_header:
+                next(f)
+            row = 0
+            while row < n:
+                rows = []
+                for line in f:
+                    values = line.rstrip().split(" ")[1:]
+                    if len(values) != dim:
+                        raise Exception("Line {} has {} values instead of {}.".format(row + len(rows) + 1 + has_header,
+                                                                                    len(values), dim))
+                    rows.append(values)
+                    if len(rows) == chunk_size or row + len(rows) == n:
+                        break
+                vectors[row:row + len(rows)] = _normalize_rows(np.array(rows, dtype=np.float32))
+                row += len(rows)
+
+    vectors.flush()
+    del vectors
+    StringStore.write(words_store_path, words[:n])
+    return WordVectors(output_prefix)
+
+
+def _merge_top_k(best_sims, best_ids, sims, col_start):
+    """Merge the similarities of a block of columns starting at col_start into the running top k of each row.
+       Once the top k fill up, few similarities of a block beat the k-th best one of their row, so only those
+       are gathered and partitioned rather than the whole block."""
+    k = best_sims.shape[1]
+    mask = sims > best_sims.min(axis=1)[:, None]
+    counts = mask.sum(axis=1)
+    width = int(counts.max())
+    if width == 0:
+        return best_sims, best_ids
+
+    if width * 4 < sims.shape[1]:
+        rows, cols = np.divmod(np.flatnonzero(mask), sims.shape[1])
+        slots = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+        candidate_sims = np.full((len(sims), width), -np.inf, dtype=sims.dtype)
+        candidate_ids = np.zeros((len(sims), width), dtype=np.int64)
+        candidate_sims[rows, slots] = sims[rows, cols]
+        candidate_ids[rows, slots] = cols + col_start
+    else:
+        candidate_sims = sims
+        candidate_ids = np.broadcast_to(np.arange(col_start, col_start + sims.shape[1]), sims.shape)
+
+    sims = np.concatenate([best_sims, candidate_sims], axis=1)
+    ids = np.concatenate([best_ids, candidate_ids], axis=1)
+    top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(sims, top, axis=1), np.take_along_axis(ids, top, axis=1)
+
+
+class WordVectors(object):
+    """Word vectors memory-mapped from a store made by convert_word_vectors, with a precomputed index of
+       the nearest neighbours of every word, so finding similar words is a lookup during augmentation."""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.words = StringStore(prefix + ".words")
+        self.vectors = np.load(prefix + ".vectors.npy", mmap_mode='r')
+        self.neighbours = None
+        self.similarities = None
+        if os.path.isfile(prefix + ".knn.npy") and os.path.isfile(prefix + ".knn_sim.npy"):
+            self.neighbours = np.load(prefix + ".knn.npy", mmap_mode='r')
+            self.similarities = np.load(prefix + ".knn_sim.npy", mmap_mode='r')
+        self._word_to_id = None
+
+    def __len__(self):
+        return len(self.words)
+
+    @property
+    def word_to_id(self):
+        if self._word_to_id is None:
+            word_to_id = {}
+            for i, word in enumerate(self.words):
+                word_to_id.setdefault(word, i)
+            self._word_to_id = word_to_id
+        return self._word_to_id
+
+    def build_neighbours(self, k=10, block_size=2048):
+        """Precompute the k most similar words (cosine) of every word and save them next to the vectors.
+           Similarities are computed by blocks of block_size x block_size vectors with matrix products, keeping
+           a running top k per row, so memory stays bounded whatever the vocabulary size.
+           Neighbour ids are saved as int32 and similarities as float16."""
+        n = len(self.vectors)
+        k = min(k, n - 1)
+        if k < 1:
+            raise Exception("At least two word vectors are needed to find neighbours.")
+
+        neighbours = np.lib.format.open_memmap(self.prefix + ".knn.npy", mode='w+', dtype=np.int32, shape=(n, k))
+        similarities = np.lib.format.open_memmap(self.prefix + ".knn_sim.npy", mode='w+', dtype=np.float16,
+                                                 shape=(n, k))
+
+        for start in range(0, n, block_size):
+            rows = np.asarray(self.vectors[start:start + block_size], dtype=np.float32)
+            best_sims = np.full((len(rows), k), -np.inf, dtype=np.float32)
+            best_ids = np.zeros((len(rows), k), dtype=np.int64)
+
+            for col_start in range(0, n, block_size):
+                cols = np.asarray(self.vectors[col_start:col_start + block_size], dtype=np.float32)
+                sims = rows @ cols.T
+                if col_start == start:
+                    np.fill_diagonal(sims, -np.inf)  # a word is not its own neighbour
+                best_sims, best_ids = _merge_top_k(best_sims, best_ids, sims, col_start)
+
+            order = np.argsort(-best_sims, axis=1, kind='stable')
+            neighbours[start:start + len(rows)] = np.take_along_axis(best_ids, order, axis=1)
+            similarities[start:start + len(rows)] = np.take_along_axis(best_sims, order, axis=1)
+
+        neighbours.flush()
+        similarities.flush()
+        del neighbours, similarities
+        self.neighbours = np.load(self.prefix + ".knn.npy", mmap_mode='r')
+        self.similarities = np.load(self.prefix + ".knn_sim.npy", mmap_mode='r')
+
+    def word_id(self, word):
+        """Id of a word, or of its lowercase form if only that one has a vector, None if neither has."""
+        word_id = self.word_to_id.get(word)
+        if word_id is None:
+            word_id = self.word_to_id.get(word.lower())
+        return word_id
+
+    def most_similar(self, word, min_similarity=-1.0):
+        """Precomputed neighbours of a word that are not a case variant of it, most similar first.
+            :return list of (word, similarity)."""
+        if self.neighbours is None:
+            raise Exception("Neighbour index is missing, call build_neighbours first.")
+        word_id = self.word_id(word)
+        if word_id is None:
+            return []
+
+        lower = word.lower()
+        result = []
+        for i, sim in zip(self.neighbours[word_id].tolist(), self.similarities[word_id].tolist()):
+            if sim < min_similarity:
+                break
+            neighbour = self.words[i]
+            if neighbour.lower() != lower:
+                result.append((neighbour, sim))
+        return result
+
+    def __getstate__(self):
+        return {"prefix": self.prefix}
+
+    def __setstate__(self, state):
+        self.__init__(state["prefix"])
@@ -0,0 +1,93 @@
+from types import MappingProxyType
+
+_END = ""  # trie key of the entry ending at a node, never a character
+_APOSTROPHES = {"’": "'", "ʼ": "'"}
+
+
+def _freeze(node):
+    return MappingProxyType({k: (v if k == _END else _freeze(v)) for k, v in node.items()})
+
+
+class LanguagePack(object):
+    """Immutable articles and determiners of a language, precompiled into a character trie.
+
+       match finds the longest determiner a text starts with while reading the text only once, up to the
+       length of that determiner. An entry matches when it is followed by a space or the end of the text,
+       or anywhere when it is elided (ends with an apostrophe, e.g. "l'homme").
+       Nothing is ever mutated, so one pack is shared by all augmenters and threads."""
+
+    def __init__(self, code, articles, determiners=()):
+        """:arg code: language code, e.g. 'fra'.
+           :arg articles: articles that can be added to a text, also recognized at its start.
+           :arg determiners: other determiners recognized and replaced at the start of a text."""
+        self.code = code
+        self.articles = tuple(articles)
+        self.determiners = tuple(d for d in determiners if d not in self.articles)
+
+        trie = {}
+        for entry in self.articles + self.determiners:
+            node = trie
+            for c in entry.lower():
+                node = node.setdefault(_APOSTROPHES.get(c, c), {})
+            node[_END] = entry
+        self._trie = _freeze(trie)
+        # articles to choose from to replace a leading article or determiner
+        self._alternatives = MappingProxyType({entry: tuple(a for a in self.articles if a != entry)
+                                               for entry in self.articles + self.determiners})
+
+    def match(self, text):
+        """Find the longest article or determiner text starts with, case-insensitive.
+            :return (entry, end position in text), or None."""
+        node = self._trie
+        best = None
+        for i, c in enumerate(text):
+            c = c.lower()
+            node = node.get(_APOSTROPHES.get(c, c))
+            if node is None:
+                break
+            entry = node.get(_END)
+            if entry is not None and (i + 1 == len(text) or text[i + 1].isspace() or entry.endswith("'")):
+                best = (entry, i + 1)
+        return best
+
+    def alternatives(self, entry=None):
+        """Articles that can replace entry, all articles if entry is None."""
+        return self.articles if entry is None else self._alternatives[entry]
+
+    def __reduce__(self):
+        # the frozen trie is not picklable, a pack sent to worker processes is compiled again there
+        return LanguagePack, (self.code, self.articles, self.determiners)
+
+    def __repr__(self):
+        return "LanguagePack({!r}, {} articles, {} determiners)".format(self.code, len(self.articles),
+                                                                        len(self.determiners))
+
+
+_LANGUAGE_PACKS = {}
+
+
+def register_language_pack(pack):
+    """Make a language pack available to augmenters by its code, replacing a pack of the same code."""
+    _LANGUAGE_PACKS[pack.code] = pack
+    return pack
+
+
+def get_language_pack(code):
+    """Language pack registered for a language code, e.g. 'fra' or 'eng'."""
+    try:
+        return _LANGUAGE_PACKS[code]
+    except KeyError:
+        raise Exception("No language pack for '{}', available: {}.".format(code, ", ".join(sorted(_LANGUAGE_PACKS))))
+
+
+register_language_pack(LanguagePack(
+    "fra",
+    articles=["le", "la", "les", "l'", "un", "une", "des", "du", "de la", "de l'"],
+    determiners=["au", "aux", "d'", "de", "ce", "cet", "cette", "ces", "mon", "ma", "mes", "ton", "ta", "tes",
+                 "son", "sa", "ses", "notre", "nos", "votre", "vos", "leur", "leurs", "chaque", "quelques"]))
+
+register_language_pack(LanguagePack(
+    "eng",
+    articles=["the", "a", "an"],
+    determiners=["this", "that", "these", "those", "some", "any", "each", "every", "my", "your", "his", "her",
+                 "its", "our", "their"]))
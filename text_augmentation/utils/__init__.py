@@ -1,3 +1,65 @@
-from text_augmentation.utils.file_io import *
-from text_augmentation.utils.sample import *
-from text_augmentation.utils.tm_fileparser import *
\ No newline at end of file
+"""Utilities are imported lazily on first access (PEP 562), so importing the package does not load
+pandas, lxml or openpyxl until an Excel, XML or TMX feature is actually used."""
+import sys
+import types
+import importlib
+
+_SUBMODULE_NAMES = {
+    "file_io": ["txt_io", "txt_iter", "excel_io", "excel_cell_str", "iter_sheet_rows", "excel_iter",
+                "save_terms_as_pickle", "loads_terms_from_pickle", "TmxWriter", "writeToTmxFile",
+                "merge_monolingual_txt_into_one"],
+    "sample": ["reservoir_sample", "sample", "LineOffsetIndex", "stratified_sample"],
+    "tm_fileparser": ["TmFileParser", "iter_mqxliff", "parse_mqxliff"],
+    "string_store": ["is_string_store", "StringStore", "STRING_STORE_MAGIC", "FLAG_WEIGHTS"],
+    "alias_table": ["AliasTable"],
+    "vocab_builder": ["chunk_ranges", "count_chunk", "build_vocab_counts"],
+    "token_corpus": ["sample_positions", "distinct_positions", "positions_from_uniforms", "TokenizedCorpus"],
+    "dedup": ["pair_digest", "ExactDedupIndex", "BloomDedupIndex", "make_dedup_index"],
+    "writers": ["PairWriter", "TwoTxtPairWriter", "TsvPairWriter", "JsonlPairWriter", "XlsxPairWriter",
+                "get_pair_writer", "EXCEL_MAX_ROWS"],
+    "metrics": ["PipelineMetrics", "LATENCY_BUCKETS"],
+    "audit": ["AuditLog", "MemoryAuditLog"],
+    "ingest": ["TmPair", "FileReport", "detect_file_type", "find_tm_files", "TmCorpusIngestor",
+               "TM_FILE_EXTENSIONS", "PICKLE_EXTENSION"],
+    "parse_cache": ["ParseCache", "CachedPairs", "make_parse_cache", "PARSE_CACHE_VERSION"],
+}
+
+_NAME_TO_SUBMODULE = {name: module for module, names in _SUBMODULE_NAMES.items() for name in names}
+
+__all__ = list(_NAME_TO_SUBMODULE)
+
+
+def _exported(name, value):
+    """Object to bind on the package for name: importing a submodule binds it on the package, but a name
+       the submodule exports itself (the 'sample' function of the 'sample' submodule) must stay that export."""
+    if isinstance(value, types.ModuleType) and _NAME_TO_SUBMODULE.get(name) == name and \
+            value.__name__ == __name__ + "." + name:
+        return getattr(value, name)
+    return value
+
+
+class _UtilsModule(types.ModuleType):
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, _exported(name, value))
+
+
+sys.modules[__name__].__class__ = _UtilsModule
+
+
+def __getattr__(name):
+    if name in _SUBMODULE_NAMES and name not in _NAME_TO_SUBMODULE:
+        return importlib.import_module(__name__ + "." + name)
+    if name not in _NAME_TO_SUBMODULE:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+    submodule = _NAME_TO_SUBMODULE[name]
+    module = importlib.import_module(__name__ + "." + submodule)
+    # bind all names of the submodule at once, the 'sample' function must replace the 'sample' submodule
+    for submodule_name in _SUBMODULE_NAMES[submodule]:
+        globals()[submodule_name] = getattr(module, submodule_name)
+    return globals()[name]
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
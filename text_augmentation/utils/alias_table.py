@@ -0,0 +1,53 @@
+import numpy as np
+
+
+class AliasTable(object):
+    """Walker's alias table over non-negative weights (Vose's construction).
+
+       Building it is O(n) once, after which every draw costs two random numbers and two lookups
+       whatever the number of outcomes."""
+
+    def __init__(self, weights):
+        weights = np.asarray(weights, dtype=np.float64)
+        n = len(weights)
+        if n == 0 or weights.sum() <= 0 or (weights < 0).any():
+            raise Exception("Alias table needs at least one positive weight and no negative weights.")
+
+        scaled = (weights * (n / weights.sum())).tolist()
+        prob = [1.0] * n
+        alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+
+        while small and large:
+            s = small.pop()
+            l = large[-1]
+            prob[s] = scaled[s]
+            alias[s] = l
+            scaled[l] -= 1.0 - scaled[s]
+            if scaled[l] < 1.0:
+                small.append(large.pop())
+        # whatever is left only differs from 1 by rounding errors and keeps prob 1
+
+        self.n = n
+        self.prob = np.array(prob, dtype=np.float64)
+        self.alias = np.array(alias, dtype=np.int64)
+
+    def __len__(self):
+        return self.n
+
+    def draw(self, rng):
+        """Draw one index with a numpy Generator (or any object with a random() method)."""
+        return self.draw_from_uniform(rng.random())
+
+    def draw_from_uniform(self, u):
+        """Draw one index from a single uniform number in [0, 1): its integer part picks the column
+           and its fractional part decides between the column and its alias."""
+        u *= self.n
+        i = int(u)
+        return i if u - i < self.prob[i] else int(self.alias[i])
+
+    def sample(self, rng, size=None):
+        """Draw indices with a numpy Generator."""
+        i = rng.integers(self.n, size=size)
+        return np.where(rng.random(size) < self.prob[i], i, self.alias[i])
@@ -0,0 +1,60 @@
+import json
+import queue
+import threading
+
+
+class AuditLog(object):
+    """JSONL audit sink of augmented instances, disabled unless one is given to the pipeline.
+
+       Records are batched and serialized and written by a background thread, so logging one is a list append.
+       The bounded queue of batches makes logging wait for the writer rather than buffer without limit."""
+
+    def __init__(self, path, batch_size=1000, max_pending_batches=100):
+        self.path = path
+        self.batch_size = batch_size
+        self.batch = []
+        self.queue = queue.Queue(maxsize=max_pending_batches)
+        self.file = open(path, 'w', encoding='utf-8')
+        self.thread = threading.Thread(target=self._write_batches, daemon=True)
+        self.thread.start()
+
+    def log(self, record):
+        """Log one record, a JSON serializable dict."""
+        self.batch.append(record)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Hand the pending records over to the writer thread."""
+        if self.batch:
+            self.queue.put(self.batch)
+            self.batch = []
+
+    def _write_batches(self):
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                break
+            self.file.write("".join(json.dumps(record, ensure_ascii=False) + '\n' for record in batch))
+            self.file.flush()
+
+    def close(self):
+        """Write every pending record and close the file."""
+        if self.thread.is_alive():
+            self.flush()
+            self.queue.put(None)
+            self.thread.join()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class MemoryAuditLog(list):
+    """Audit sink keeping records in a list, e.g. to send them from a worker process to the parent's AuditLog."""
+
+    def log(self, record):
+        self.append(record)
@@ -0,0 +1,89 @@
+import math
+import hashlib
+
+
+def pair_digest(pair):
+    """128-bit digest of a (source, target) pair."""
+    src, tgt = pair
+    return hashlib.blake2b((src + "\x00" + tgt).encode('utf-8'), digest_size=16).digest()
+
+
+class ExactDedupIndex(object):
+    """Set of pair digests. With 128-bit digests, collisions are negligible even for billions of pairs."""
+
+    def __init__(self):
+        self.seen = set()
+
+    def add(self, pair):
+        """Add a pair, return False if it was already in the index."""
+        digest = pair_digest(pair)
+        if digest in self.seen:
+            return False
+        self.seen.add(digest)
+        return True
+
+    def update(self, pairs):
+        for pair in pairs:
+            self.add(pair)
+
+    def __contains__(self, pair):
+        return pair_digest(pair) in self.seen
+
+    def __len__(self):
+        return len(self.seen)
+
+
+class BloomDedupIndex(object):
+    """Bloom filter of pairs, its memory is fixed by capacity and error_rate.
+       A new pair is wrongly reported as seen with probability error_rate once capacity pairs are added,
+       a pair already added is never reported as new."""
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(int(capacity), 1)
+        self.num_bits = max(int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)), 8)
+        self.num_hashes = max(int(round(self.num_bits / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, pair):
+        digest = pair_digest(pair)
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, pair):
+        """Add a pair, return False if it was (probably) already in the filter."""
+        bits = self.bits
+        is_new = False
+        for p in self._positions(pair):
+            mask = 1 << (p & 7)
+            if not bits[p >> 3] & mask:
+                bits[p >> 3] |= mask
+                is_new = True
+        if is_new:
+            self.count += 1
+        return is_new
+
+    def update(self, pairs):
+        for pair in pairs:
+            self.add(pair)
+
+    def __contains__(self, pair):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(pair))
+
+    def __len__(self):
+        return self.count
+
+
+def make_dedup_index(dedup, capacity=None, error_rate=0.001):
+    """Create a dedup index from its mode: None, 'exact', or 'bloom' sized for capacity pairs.
+       Any object with an add(pair) method is returned as it is."""
+    if dedup is None or hasattr(dedup, "add"):
+        return dedup
+    if dedup == "exact":
+        return ExactDedupIndex()
+    if dedup == "bloom":
+        if capacity is None:
+            raise Exception("Bloom filter dedup needs a capacity.")
+        return BloomDedupIndex(capacity, error_rate)
+    raise Exception("dedup should be None, 'exact' or 'bloom'.")
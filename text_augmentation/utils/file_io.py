@@ -1,7 +1,11 @@
 import os
+import re
+import sys
+import gzip
+import codecs
 import pickle
-import pandas as pd
-from bs4 import BeautifulSoup
+from xml.sax.saxutils import escape, quoteattr
+from text_augmentation.utils.writers import XlsxPairWriter
 
 
 def txt_io(file, action='r', write_lines=None):
@@ -19,101 +23,218 @@ def txt_io(file, action='r', write_lines=None):
         print(f"Action {action} not supported")
 
 
+def txt_iter(file, encoding=None):
+    """Lazily read lines of a text file, without line endings, split as txt_io splits them (str.splitlines).
+        :arg encoding: file encoding, the locale encoding if not given (as txt_io)."""
+    with open(file, 'r', encoding=encoding) as f:
+        for line in f:
+            # a line can hold other boundaries of splitlines, e.g. \x0b, \x1c or \u2028
+            yield from line.splitlines()
+
+
 def excel_io(file, action='r', write_df=None, columns=["source", "target"]):
 
     if action == 'r':
+        import pandas as pd
+
         df = pd.read_excel(file)
         return df
 
     elif action == 'w':
-        df = pd.DataFrame(write_df, columns=columns)
-        df.to_excel(file, header=True, index=None)
+        pd = sys.modules.get("pandas")  # write_df cannot be a DataFrame if pandas was never imported
+        if pd is not None and isinstance(write_df, pd.DataFrame):
+            write_df = write_df.reindex(columns=columns)
+            write_df = write_df.astype(object).where(write_df.notna(), None).itertuples(index=False, name=None)
+        with XlsxPairWriter(file, columns=columns) as writer:
+            writer.write_pairs(write_df)
 
     else:
         print(f"Action {action} not supported")
 
 
-def save_terms_as_pickle(data, pickle_dir):
+def excel_cell_str(value):
+    """Text of an Excel cell value, as pandas reads it with dtype=str: empty for None, no '.0' for whole floats."""
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def iter_sheet_rows(sheet):
+    """Lazily read rows of an openpyxl sheet as tuples of values, without trailing empty cells.
+       Empty rows are yielded only when a non-empty row follows them, like pandas does."""
+    empty_rows = 0
+    for row in sheet.iter_rows(values_only=True):
+        row = list(row)
+        while row and (row[-1] is None or row[-1] == ""):
+            row.pop()
+        if not row:
+            empty_rows += 1
+            continue
+        for _ in range(empty_rows):
+            yield ()
+        empty_rows = 0
+        yield tuple(row)
+
+
+def excel_iter(file, n_columns=2, skip_header=True):
+    """Lazily read the first n_columns of the first sheet of an Excel file as tuples of strings.
+       XLSX files are streamed by an openpyxl read-only workbook, XLS files are read by pandas."""
+
+    if os.path.splitext(file)[1] == ".xls":
+        import pandas as pd
+
+        df = pd.read_excel(file, dtype=str, na_filter=False, header=0 if skip_header else None)
+        for row in df.itertuples(index=False, name=None):
+            yield tuple(row[:n_columns]) + ("",) * (n_columns - len(row))
+        return
+
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = iter_sheet_rows(workbook.worksheets[0])
+        if skip_header:
+            next(rows, None)
+        for row in rows:
+            row = [excel_cell_str(value) for value in row[:n_columns]]
+            yield tuple(row) + ("",) * (n_columns - len(row))
+    finally:
+        workbook.close()
+
+
+def save_terms_as_pickle(data, pickle_dir, verbose=True):
     """Serialize data into pickle file."""
-    print("Saving terms to pickle file...")
+    if verbose:
+        print("Saving terms to pickle file...")
     try:
         file = open(pickle_dir, 'wb')
         pickle.dump(data, file)
         file.close()
     except:
         raise Exception("Failed to save terms in pickle.")
-    print("Terms saved.")
+    if verbose:
+        print("Terms saved.")
 
 
-def loads_terms_from_pickle(pickle_dir):
+def loads_terms_from_pickle(pickle_dir, verbose=True):
     """Load serialized data from pickle file."""
-    print("Loading terms from pickle file...")
+    if verbose:
+        print("Loading terms from pickle file...")
     try:
         file = open(pickle_dir, 'rb')
         data = pickle.load(file)
         file.close()
     except:
         raise Exception("Failed to load terms from pickle.")
-    print("Terms loaded.")
+    if verbose:
+        print("Terms loaded.")
 
     return data
 
 
-def writeToTmxFile(outputPath, pairs, srcLang, tgtLang, segType='seg', encoding='utf8'):
-    """Write to TMX (XML) file
+_XML_INVALID_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+
+def _xml_escape(text):
+    """Escape text for XML content, dropping characters that are not allowed in XML 1.0."""
+    return escape(_XML_INVALID_CHARS.sub('', str(text)))
+
+
+class TmxWriter(object):
+    """Write TMX (XML) file incrementally, every pair is serialized as soon as it is written.
+
+       Args:
+          outputPath (str): The path of the TMX file, gzip compressed if it ends with '.gz'
+          srcLang (str): source language code
+          tgtLang (str): target language code
+          segType (str): segment type, e.g., 'phrase'
+          encoding (str): the encoding method
+          pretty (bool): indent elements, one tag per line
+          compress (bool): gzip the output, guessed from outputPath if None
+    """
+
+    def __init__(self, outputPath, srcLang, tgtLang, segType='seg', encoding='utf8', pretty=False, compress=None):
+
+        if compress is None:
+            compress = outputPath.endswith('.gz')
+
+        # characters the encoding cannot represent are written as character references
+        if compress:
+            self.file = gzip.open(outputPath, 'wt', encoding=encoding, errors='xmlcharrefreplace')
+        else:
+            self.file = open(outputPath, 'w', encoding=encoding, errors='xmlcharrefreplace')
+
+        header_attrs = [('creationtool', 'YappnTmxGenerator'),
+                        ('creationtoolversion', '1.0.0.1905'),
+                        ('o-tmf', 'TMX'),
+                        ('adminlang', 'en'),
+                        ('datatype', 'plaintext'),
+                        ('segtype', segType),
+                        ('srclang', srcLang)]
+        header = '<header ' + ' '.join('{}={}'.format(k, quoteattr(v)) for k, v in header_attrs) + '/>'
+        srcLang, tgtLang = quoteattr(srcLang), quoteattr(tgtLang)
+
+        if pretty:
+            self.tu_template = ('  <tu>\n'
+                                '   <tuv xml:lang=' + srcLang + '>\n    <seg>{}</seg>\n   </tuv>\n'
+                                '   <tuv xml:lang=' + tgtLang + '>\n    <seg>{}</seg>\n   </tuv>\n'
+                                '  </tu>\n')
+            body_start, body_end = ' <body>\n', ' </body>\n'
+            header = ' ' + header + '\n'
+        else:
+            self.tu_template = ('<tu><tuv xml:lang=' + srcLang + '><seg>{}</seg></tuv>'
+                                '<tuv xml:lang=' + tgtLang + '><seg>{}</seg></tuv></tu>\n')
+            body_start, body_end = '\n<body>\n', '</body>\n'
+
+        self.footer = body_end + '</tmx>\n'
+        self.file.write('<?xml version="1.0" encoding="{}"?>\n'.format(codecs.lookup(encoding).name))
+        self.file.write('<tmx version="1.4b">\n' + header + body_start)
+
+    def write(self, src, tgt):
+        """Write one (source_text, target_text) pair."""
+        self.file.write(self.tu_template.format(_xml_escape(src), _xml_escape(tgt)))
+
+    def write_pairs(self, pairs):
+        """Write pairs from any iterable, return the number of pairs written."""
+        num_written = 0
+        for src, tgt in pairs:
+            self.write(src, tgt)
+            num_written += 1
+        return num_written
+
+    def close(self):
+        """Close body and tmx tags and the file."""
+        if not self.file.closed:
+            self.file.write(self.footer)
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def writeToTmxFile(outputPath, pairs, srcLang, tgtLang, segType='seg', encoding='utf8', pretty=True, compress=None):
+    """Write to TMX (XML) file, pairs are streamed to disk as they come from the iterable.
 
        Args:
           outputPath (str): The path of the TMX file
-          pairs (list): a list of (source_text, target_text) tuples
+          pairs (iterable): (source_text, target_text) tuples
           segType (str): segment type, e.g., 'phrase'
           srcLang (str): source language code
           tgtLang (str): target language code
           encoding (str): the encoding method
+          pretty (bool): indent elements, one tag per line
+          compress (bool): gzip the output, guessed from outputPath if None
     """
 
     try:
-        soup = BeautifulSoup(features='xml')
-        soup.append(soup.new_tag('tmx', version='1.4b'))
-
-        # Write header
-        header = soup.new_tag('header')
-        header['creationtool'] = 'YappnTmxGenerator'
-        header['creationtoolversion'] = '1.0.0.1905'
-        header['o-tmf'] = 'TMX'
-        header['adminlang'] = 'en'
-        header['datatype'] = 'plaintext'
-        header['segtype'] = segType
-        header['srclang'] = srcLang
-        tmx_tuTag = 'tu'
-        tmx_tuPieceTag = 'tuv'
-        tmx_textTag = 'seg'
-        soup.tmx.append(header)
-
-        # Write body
-        soup.tmx.append(soup.new_tag('body'))
-
-        for (src, tgt) in pairs:
-            tu = soup.new_tag(tmx_tuTag)
-
-            tuvSrc = soup.new_tag(tmx_tuPieceTag)
-            tuvSrc['xml:lang'] = srcLang
-            seg = soup.new_tag(tmx_textTag)
-            seg.string = src
-            tuvSrc.append(seg)
-
-            tuvTgt = soup.new_tag(tmx_tuPieceTag)
-            tuvTgt['xml:lang'] = tgtLang
-            seg = soup.new_tag(tmx_textTag)
-            seg.string = tgt
-            tuvTgt.append(seg)
-
-            tu.append(tuvSrc)
-            tu.append(tuvTgt)
-
-            soup.tmx.body.append(tu)
-
-        with open(outputPath, 'wb') as f:
-            f.write(soup.prettify().encode(encoding))
+        with TmxWriter(outputPath, srcLang, tgtLang, segType=segType, encoding=encoding,
+                       pretty=pretty, compress=compress) as writer:
+            writer.write_pairs(pairs)
 
         return True
 
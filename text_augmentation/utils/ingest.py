@@ -0,0 +1,175 @@
+import os
+import glob
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from text_augmentation.utils.tm_fileparser import TmFileParser
+
+# file types recognised by extension, .xml files are told apart by their root element
+TM_FILE_EXTENSIONS = {".tmx": "tmx",
+                      ".mxliff": "mxliff",
+                      ".sdlxliff": "sdlxliff",
+                      ".xlsx": "excel",
+                      ".xls": "excel",
+                      ".xml": None}
+# pickle files can run arbitrary code when loaded, they are only picked up with allow_pickle=True
+PICKLE_EXTENSION = ".pkl"
+
+TmPair = namedtuple("TmPair", ["source", "target", "file", "index"])
+FileReport = namedtuple("FileReport", ["file", "fileType", "num_pairs", "error"])
+
+
+def detect_file_type(file_dir, allow_pickle=False):
+    """Detect the TM file type of a file from its extension, or from its root element for .xml files.
+        :arg allow_pickle: detect .pkl files as pickle TM files, only for trusted files.
+        :return one of TmFileParser file types, or None if the file is not a TM file."""
+    ext = os.path.splitext(file_dir)[1].lower()
+    if ext == PICKLE_EXTENSION:
+        return "pickle" if allow_pickle else None
+    if ext not in TM_FILE_EXTENSIONS:
+        return None
+    if TM_FILE_EXTENSIONS[ext] is not None:
+        return TM_FILE_EXTENSIONS[ext]
+
+    from lxml import etree
+
+    try:
+        with open(file_dir, 'rb') as f:
+            _, root = next(etree.iterparse(f, events=("start",), recover=True, huge_tree=True))
+    except Exception:
+        return None
+
+    tag = etree.QName(root).localname.lower()
+    if tag == "tmx":
+        return "tmx"
+    if tag == "xliff":
+        if any("sdl.com" in ns for ns in root.nsmap.values() if ns):
+            return "sdlxliff"
+        return "mxliff"
+    return "xml"
+
+
+def find_tm_files(inputs, srcLang="eng", tgtLang="fra", allow_pickle=False):
+    """List TM files of directories (searched recursively), glob patterns or file paths, sorted by path.
+       Text files ending with .srcLang and .tgtLang that share a stem are paired as one 2txt input.
+       .pkl files are skipped unless allow_pickle is set, unpickling untrusted files can run any code.
+        :return list of (file, fileType) and list of FileReport for files that cannot be used."""
+    if isinstance(inputs, str):
+        inputs = [inputs]
+
+    paths = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            for base, _, filenames in os.walk(item):
+                paths.update(os.path.join(base, filename) for filename in filenames)
+        elif os.path.isfile(item):
+            paths.add(item)
+        else:
+            paths.update(path for path in glob.glob(item, recursive=True) if os.path.isfile(path))
+
+    files, reports = [], []
+    txt_sides = {}
+    for path in sorted(paths):
+        prefix, ext = os.path.splitext(path)
+        if ext in ("." + srcLang, "." + tgtLang):
+            txt_sides.setdefault(prefix, {})[ext[1:]] = path
+            continue
+
+        fileType = detect_file_type(path, allow_pickle)
+        if fileType is not None:
+            files.append((path, fileType))
+
+    for prefix, sides in txt_sides.items():
+        if len(sides) == 2:
+            files.append(([sides[srcLang], sides[tgtLang]], "2txt"))
+        else:
+            path = list(sides.values())[0]
+            reports.append(FileReport(path, "2txt", 0, "Missing the other side of 2txt files."))
+
+    files.sort(key=lambda f: f[0][0] if f[1] == "2txt" else f[0])
+    return files, reports
+
+
+def _parse_tm_file(task):
+    """Parse one TM file in a worker process, return (source texts, target texts, error message)."""
+    file_dir, fileType, parse_kwargs = task
+    tfp = TmFileParser(fileType=fileType, verbose=False, checkExtension=False)
+    try:
+        tfp.parse(file_dir, **parse_kwargs)
+    except Exception as ex:
+        return [], [], str(ex) or type(ex).__name__
+
+    if fileType == "2txt":
+        return [s.rstrip('\r\n') for s in tfp.srcTexts], [t.rstrip('\r\n') for t in tfp.tgtTexts], None
+    return tfp.srcTexts, tfp.tgtTexts, None
+
+
+class TmCorpusIngestor(object):
+    """Parse a corpus of mixed TM files (TMX, MXLIFF, SDLXLIFF, Excel, XML, 2txt, and pickle if allowed) in parallel.
+
+       Files are parsed in a pool of n_jobs processes and their pairs are merged in file path order,
+       so the stream is the same whatever the number of processes. Every pair carries the file it
+       comes from and its index in that file, and a file that cannot be parsed is reported instead of
+       stopping the ingestion."""
+
+    def __init__(self, n_jobs=1, srcLang="eng", tgtLang="fra", verbose=True, allow_pickle=False, **parse_kwargs):
+        """:arg n_jobs: number of worker processes, -1 to use all cores.
+           :arg allow_pickle: also parse .pkl files, only for trusted corpora.
+           :arg parse_kwargs: options passed to TmFileParser.parse, e.g. tmxHasAlignedFilenames."""
+        if n_jobs == -1:
+            n_jobs = os.cpu_count()
+        self.n_jobs = n_jobs
+        self.srcLang = srcLang
+        self.tgtLang = tgtLang
+        self.verbose = verbose
+        self.allow_pickle = allow_pickle
+        self.parse_kwargs = parse_kwargs
+        self.reports = []
+
+    @property
+    def errors(self):
+        return [report for report in self.reports if report.error is not None]
+
+    def _parse_all(self, files):
+        """Parse files in order. With n_jobs processes, at most 2 * n_jobs files are submitted ahead of the
+           one being consumed, so parsed files do not pile up in memory when the stream is read slowly."""
+        tasks = [(file_dir, fileType, self.parse_kwargs) for file_dir, fileType in files]
+        if self.n_jobs == 1 or len(tasks) <= 1:
+            for task in tasks:
+                yield _parse_tm_file(task)
+        else:
+            with ProcessPoolExecutor(max_workers=min(self.n_jobs, len(tasks))) as executor:
+                pending = deque()
+                try:
+                    for task in tasks:
+                        pending.append(executor.submit(_parse_tm_file, task))
+                        if len(pending) >= 2 * self.n_jobs:
+                            yield pending.popleft().result()
+                    while pending:
+                        yield pending.popleft().result()
+                finally:
+                    for future in pending:
+                        future.cancel()
+
+    def iter_pairs(self, inputs):
+        """Yield TmPair(source, target, file, index) of all TM files found in inputs, see find_tm_files.
+           self.reports holds one FileReport per file once the stream is exhausted."""
+        files, self.reports = find_tm_files(inputs, srcLang=self.srcLang, tgtLang=self.tgtLang,
+                                            allow_pickle=self.allow_pickle)
+
+        for (file_dir, fileType), (srcTexts, tgtTexts, error) in zip(files, self._parse_all(files)):
+            name = file_dir[0] if fileType == "2txt" else file_dir
+            self.reports.append(FileReport(name, fileType, len(srcTexts), error))
+            if error is not None:
+                if self.verbose:
+                    print("Failed to parse {}: {}".format(name, error))
+                continue
+            for i, (src, tgt) in enumerate(zip(srcTexts, tgtTexts)):
+                yield TmPair(src, tgt, name, i)
+
+        if self.verbose:
+            print("\n\tThe number of TM files parsed: {}, failed: {}".format(
+                len(self.reports) - len(self.errors), len(self.errors)))
+
+    def ingest(self, inputs):
+        """Parse all TM files found in inputs, return a list of TmPair."""
+        return list(self.iter_pairs(inputs))
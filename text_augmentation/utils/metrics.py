@@ -0,0 +1,129 @@
+import json
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+LATENCY_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 1e-1, 1.0)
+
+
+class PipelineMetrics(object):
+    """Counters and latency histograms of the bad-instance pipeline.
+
+       Recording a candidate costs a bisect and a few dict updates, so it can be left on in production.
+       Any object with the same record and revoke methods can be given to the pipeline instead."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.attempts = Counter()
+        self.accepted = Counter()
+        self.rejections = defaultdict(Counter)
+        self.latency_counts = defaultdict(lambda: [0] * (len(self.buckets) + 1))
+        self.latency_sum = Counter()
+        self.consecutive_rejections = 0
+        self.max_consecutive_rejections = 0
+        self.start_time = None
+        self.last_time = None
+
+    def start(self):
+        """Start the throughput clock, if not started yet."""
+        if self.start_time is None:
+            self.start_time = time.perf_counter()
+
+    def record(self, method, seconds, reason=None):
+        """Record one candidate created by method in seconds, accepted if there is no rejection reason."""
+        self.attempts[method] += 1
+        self.latency_counts[method][bisect_left(self.buckets, seconds)] += 1
+        self.latency_sum[method] += seconds
+
+        if reason is None:
+            self.accepted[method] += 1
+            self.consecutive_rejections = 0
+        else:
+            self.rejections[method][reason] += 1
+            self.consecutive_rejections += 1
+            if self.consecutive_rejections > self.max_consecutive_rejections:
+                self.max_consecutive_rejections = self.consecutive_rejections
+        self.last_time = time.perf_counter()
+
+    def revoke(self, method, reason):
+        """Turn a candidate recorded as accepted into a rejected one, e.g. when a merge finds it is a duplicate."""
+        self.accepted[method] -= 1
+        self.rejections[method][reason] += 1
+
+    @property
+    def elapsed(self):
+        if self.start_time is None or self.last_time is None:
+            return 0.0
+        return self.last_time - self.start_time
+
+    @property
+    def pairs_per_sec(self):
+        elapsed = self.elapsed
+        return sum(self.accepted.values()) / elapsed if elapsed > 0 else 0.0
+
+    def merge(self, other):
+        """Add the counts of other metrics (or their to_dict()), e.g. from a worker process."""
+        if isinstance(other, PipelineMetrics):
+            other = other.to_dict()
+
+        for method, m in other["methods"].items():
+            self.attempts[method] += m["attempts"]
+            self.accepted[method] += m["accepted"]
+            self.rejections[method].update(m["rejections"])
+            counts = self.latency_counts[method]
+            for i, c in enumerate(m["latency_counts"]):
+                counts[i] += c
+            self.latency_sum[method] += m["latency_sum"]
+        self.max_consecutive_rejections = max(self.max_consecutive_rejections,
+                                              other["max_consecutive_rejections"])
+        self.last_time = time.perf_counter()
+
+    def to_dict(self):
+        return {"buckets": list(self.buckets),
+                "methods": {method: {"attempts": self.attempts[method],
+                                     "accepted": self.accepted[method],
+                                     "rejections": dict(self.rejections[method]),
+                                     "latency_counts": list(self.latency_counts[method]),
+                                     "latency_sum": self.latency_sum[method]}
+                            for method in sorted(self.attempts)},
+                "max_consecutive_rejections": self.max_consecutive_rejections,
+                "elapsed": self.elapsed,
+                "pairs_per_sec": self.pairs_per_sec}
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def to_prometheus(self, prefix="text_augmentation"):
+        """Metrics in Prometheus text exposition format."""
+        lines = ["# HELP {}_attempts_total Candidate instances created.".format(prefix),
+                 "# TYPE {}_attempts_total counter".format(prefix)]
+        lines += ['{}_attempts_total{{method="{}"}} {}'.format(prefix, m, c) for m, c in sorted(self.attempts.items())]
+
+        lines += ["# HELP {}_accepted_total Instances kept.".format(prefix),
+                  "# TYPE {}_accepted_total counter".format(prefix)]
+        lines += ['{}_accepted_total{{method="{}"}} {}'.format(prefix, m, c) for m, c in sorted(self.accepted.items())]
+
+        lines += ["# HELP {}_rejected_total Candidates rejected, by reason.".format(prefix),
+                  "# TYPE {}_rejected_total counter".format(prefix)]
+        for m in sorted(self.rejections):
+            lines += ['{}_rejected_total{{method="{}",reason="{}"}} {}'.format(prefix, m, r, c)
+                      for r, c in sorted(self.rejections[m].items())]
+
+        lines += ["# HELP {}_latency_seconds Time to create a candidate.".format(prefix),
+                  "# TYPE {}_latency_seconds histogram".format(prefix)]
+        for m in sorted(self.latency_counts):
+            cumulative = 0
+            for le, c in zip(list(self.buckets) + ["+Inf"], self.latency_counts[m]):
+                cumulative += c
+                lines.append('{}_latency_seconds_bucket{{method="{}",le="{}"}} {}'.format(prefix, m, le, cumulative))
+            lines.append('{}_latency_seconds_sum{{method="{}"}} {}'.format(prefix, m, self.latency_sum[m]))
+            lines.append('{}_latency_seconds_count{{method="{}"}} {}'.format(prefix, m, cumulative))
+
+        lines += ["# HELP {}_max_consecutive_rejections Longest run of rejected candidates.".format(prefix),
+                  "# TYPE {}_max_consecutive_rejections gauge".format(prefix),
+                  "{}_max_consecutive_rejections {}".format(prefix, self.max_consecutive_rejections),
+                  "# HELP {}_pairs_per_second Instances kept per second.".format(prefix),
+                  "# TYPE {}_pairs_per_second gauge".format(prefix),
+                  "{}_pairs_per_second {}".format(prefix, self.pairs_per_sec)]
+
+        return "\n".join(lines) + "\n"
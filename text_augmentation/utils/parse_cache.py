@@ -0,0 +1,142 @@
+import os
+import json
+import hashlib
+from collections.abc import Sequence
+from text_augmentation.utils.string_store import StringStore
+
+# bump when the extracted pairs of a parser change, so entries of older versions are not hit anymore
+PARSE_CACHE_VERSION = 1
+
+
+class CachedPairs(Sequence):
+    """Read-only list of (source, target) pairs of a cache entry, each side memory-mapped from a string store,
+       so only the pairs that are accessed get decoded."""
+
+    def __init__(self, src_path, tgt_path):
+        self.srcTexts = StringStore(src_path)
+        self.tgtTexts = StringStore(tgt_path)
+        if len(self.srcTexts) != len(self.tgtTexts):
+            raise Exception("Cache entry {} is corrupted.".format(src_path))
+
+    def __len__(self):
+        return len(self.srcTexts)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(zip(self.srcTexts[index], self.tgtTexts[index]))
+        return self.srcTexts[index], self.tgtTexts[index]
+
+    def __iter__(self):
+        return zip(self.srcTexts, self.tgtTexts)
+
+
+class ParseCache(object):
+    """Persistent cache of the pairs parsed from TM files, in a directory.
+
+       An entry is keyed by the parsed files, identified by their (path, size, mtime) or by a hash of their
+       content, and by the parser options. It holds two string stores, <key>.src and <key>.tgt, opened
+       memory-mapped on a hit instead of parsing the files again. When the entries take more than max_size
+       bytes, the least recently used ones are removed."""
+
+    def __init__(self, cache_dir, max_size=2 * 1024 ** 3, key="stat"):
+        """:arg key: 'stat' to identify files by path, size and modification time, or 'content' to hash them,
+                     slower but still hits after files are copied or touched."""
+        if key not in ("stat", "content"):
+            raise Exception("key should be 'stat' or 'content'.")
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_size = max_size
+        self.key_mode = key
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _file_identity(self, path):
+        if self.key_mode == "stat":
+            stat = os.stat(path)
+            return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        return [digest.hexdigest()]
+
+    def key(self, files, **options):
+        """Key of the pairs parsed from a file or list of files with given options, e.g. fileType."""
+        files = [files] if isinstance(files, str) else list(files)
+        identity = {"version": PARSE_CACHE_VERSION,
+                    "files": [self._file_identity(path) for path in files],
+                    "options": options}
+        return hashlib.blake2b(json.dumps(identity, sort_keys=True, default=str).encode('utf-8'),
+                               digest_size=16).hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.cache_dir, key)
+        return base + ".src", base + ".tgt"
+
+    def get(self, key):
+        """:return CachedPairs of an entry, or None if there is no entry for key."""
+        src_path, tgt_path = self._paths(key)
+        if not (os.path.isfile(src_path) and os.path.isfile(tgt_path)):
+            return None
+        os.utime(src_path)  # last use, for eviction
+        return CachedPairs(src_path, tgt_path)
+
+    def put(self, key, srcTexts, tgtTexts):
+        """Store parsed texts under key, then evict old entries if the cache is over max_size.
+            :return CachedPairs of the new entry."""
+        if len(srcTexts) != len(tgtTexts):
+            raise Exception("Lengths of source and target texts not equal.")
+        src_path, tgt_path = self._paths(key)
+        # write under temporary names, a reader never sees a partial entry
+        for path, texts in ((tgt_path, tgtTexts), (src_path, srcTexts)):
+            tmp_path = "{}.{}.tmp".format(path, os.getpid())
+            StringStore.write(tmp_path, texts)
+            os.replace(tmp_path, path)
+
+        self.evict(keep=key)
+        return CachedPairs(src_path, tgt_path)
+
+    def entries(self):
+        """:return list of (key, size in bytes, last use time) of all entries, least recently used first."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".src"):
+                continue
+            key = name[:-4]
+            src_path, tgt_path = self._paths(key)
+            try:
+                src_stat, tgt_stat = os.stat(src_path), os.stat(tgt_path)
+            except OSError:
+                continue
+            entries.append((key, src_stat.st_size + tgt_stat.st_size, src_stat.st_mtime))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, keep=None):
+        """Remove least recently used entries, except keep, until entries take at most max_size bytes."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for key, size, _ in entries:
+            if total <= self.max_size:
+                break
+            if key == keep:
+                continue
+            self.remove(key)
+            total -= size
+
+    def remove(self, key):
+        for path in self._paths(key):
+            if os.path.isfile(path):
+                os.remove(path)
+
+    def clear(self):
+        for key, _, _ in self.entries():
+            self.remove(key)
+
+
+def make_parse_cache(cache):
+    """Create a parse cache from a cache directory, a ParseCache (or None) is returned as it is."""
+    if cache is None or isinstance(cache, ParseCache):
+        return cache
+    return ParseCache(cache)
@@ -0,0 +1,30 @@
+import numpy as np
+
+
+def new_seed():
+    """Draw a fresh 128-bit seed from the OS entropy, to be recorded when no seed is given."""
+    return int(np.random.SeedSequence().entropy)
+
+
+class CounterRNG(object):
+    """Counter-based random streams: a Philox generator keyed by seed, positioned on demand at the start
+       of the stream of (index, attempt, stream).
+
+       The draws of a stream only depend on the seed and these three numbers, not on what was drawn before,
+       so any shard of a job, on any machine, reproduces exactly the draws of a single process run.
+       Philox counter layout is [draws, stream, attempt, index], a stream is 2 ** 64 blocks long."""
+
+    def __init__(self, seed):
+        self.seed = seed
+        self._bit_generator = np.random.Philox(key=seed)
+        self._state = self._bit_generator.state
+        self._state.update(buffer=np.zeros(4, dtype=np.uint64), buffer_pos=4, has_uint32=0, uinteger=0)
+        self._counter = self._state["state"]["counter"]
+        self.generator = np.random.Generator(self._bit_generator)
+
+    def at(self, index, attempt=0, stream=0):
+        """Position the generator at the start of a stream and return it.
+           The generator is shared, so a previous stream is left as soon as another one is requested."""
+        self._counter[:] = (0, stream, attempt, index)  # the state setter copies it, so it can be reused
+        self._bit_generator.state = self._state
+        return self.generator
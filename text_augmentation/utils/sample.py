@@ -1,53 +1,275 @@
-import os, pandas as pd, codecs, sys
+import os, sys
+import re
+import math
 import random
+import hashlib
+from itertools import islice
+import numpy as np
+from text_augmentation.utils.file_io import txt_iter
+
+
+def _open_uniform(rand):
+    """Uniform number in (0, 1)."""
+    u = rand.random()
+    while u == 0.0:
+        u = rand.random()
+    return u
+
+
+def reservoir_sample(items, k, rand=random):
+    """Uniformly sample k items from an iterable of any length in a single pass (Algorithm L).
+       Memory is proportional to k only, and the items between two replacements are skipped without any draw.
+       If there are fewer than k items, all of them are returned."""
+    it = iter(items)
+    reservoir = list(islice(it, k))
+    if len(reservoir) < k or k == 0:
+        return reservoir
+
+    w = math.exp(math.log(_open_uniform(rand)) / k)
+    while True:
+        skip = int(math.log(_open_uniform(rand)) / math.log(1 - w))
+        try:
+            item = next(islice(it, skip, None))
+        except StopIteration:
+            break
+        reservoir[rand.randrange(k)] = item
+        w *= math.exp(math.log(_open_uniform(rand)) / k)
+
+    rand.shuffle(reservoir)
+    return reservoir
 
 
 def sample(input_file, output_file, sample_num=100, is_parallel=True, file_type='2txt', srcLang='eng', tgtLang="fra"):
-    """Sample texts from e.g. training data, TM, etc.
+    """Sample texts from e.g. training data, TM, etc. in one pass, only sample_num texts are held in memory.
     Note: output file has to be an Excel file."""
 
     # print(input_file, output_file, sample_num, is_parallel, file_type, srcLang, tgtLang)
+    import pandas as pd
+
     sample_num = int(sample_num)
-    is_parallel = True if is_parallel == "True" else False
+    is_parallel = is_parallel is True or is_parallel == "True"
     # print(is_parallel)
     if is_parallel:
 
         if file_type == '2txt':
 
             input_file = [input_file + "." + srcLang, input_file + "." + tgtLang]
-            with codecs.open(input_file[0], 'r') as f:
-                eng_lines = f.readlines()
-            with codecs.open(input_file[1], 'r') as f:
-                fra_lines = f.readlines()
+            data = zip(txt_iter(input_file[0], encoding='utf-8'), txt_iter(input_file[1], encoding='utf-8'))
 
         elif file_type == 'excel':
             df_input = pd.read_excel(input_file)
-            eng_lines = df_input["source"]
-            fra_lines = df_input["target"]
+            data = zip(df_input["source"], df_input["target"])
         else:
             raise Exception("file format not supported.")
 
-        data = list(zip(eng_lines, fra_lines))
         columns = ['src_sampled', 'tgt_sampled']
 
     else:
         if file_type == '2txt':
-            with codecs.open(input_file, 'r') as f:
-                data = f.readlines()
+            data = txt_iter(input_file, encoding='utf-8')
 
         elif file_type == 'excel':
             df_input = pd.read_excel(input_file)
             data = df_input[df_input.columns[0]]
-            del df_input
         else:
             raise Exception("file format not supported.")
         columns = ['sampled']
 
-    samples = random.sample(data, sample_num)
+    samples = reservoir_sample(data, sample_num)
     df = pd.DataFrame(samples, columns=columns)
     df.to_excel(output_file, header=True, index=None)
 
 
+# line boundaries of str.splitlines, as txt_iter splits lines, in utf-8 bytes
+_LINE_END = re.compile(rb'(\r\n|[\n\r\x0b\x0c\x1c-\x1e]|\xc2\x85|\xe2\x80[\xa8\xa9])')
+_OTHER_LINE_ENDS = (b'\r', b'\x0b', b'\x0c', b'\x1c', b'\x1d', b'\x1e', b'\xc2\x85', b'\xe2\x80\xa8', b'\xe2\x80\xa9')
+
+
+def _iter_line_blocks(f, block_size=1 << 20):
+    """Lines of a utf-8 file opened in binary mode, without line endings, by blocks of about block_size bytes.
+       Blocks are completed up to a newline, so no line ending is cut between two blocks, and only blocks
+       holding other line boundaries than newlines are split with a regular expression.
+        :return generator of (byte offsets of the lines, lines) of each block."""
+    pos = 0
+    while True:
+        block = f.read(block_size)
+        if not block:
+            break
+        block += f.readline()
+        # the last byte of a line ending is looked up first, a single byte search is much faster
+        if any(end[-1:] in block and end in block for end in _OTHER_LINE_ENDS):
+            parts = _LINE_END.split(block)  # lines and their line endings in turn
+            lines = parts[0::2]
+            sizes = np.fromiter(map(len, lines), dtype=np.int64, count=len(lines))
+            sizes[:-1] += np.fromiter(map(len, parts[1::2]), dtype=np.int64, count=len(lines) - 1)
+        else:
+            lines = block.split(b'\n')
+            sizes = np.fromiter(map(len, lines), dtype=np.int64, count=len(lines)) + 1
+        if not lines[-1]:  # block ends with a line ending
+            lines.pop()
+            sizes = sizes[:-1]
+        offsets = pos + np.cumsum(sizes) - sizes
+        pos += len(block)
+        yield offsets, lines
+
+
+def _count_lines(file):
+    with open(file, 'rb') as f:
+        return sum(len(lines) for _, lines in _iter_line_blocks(f))
+
+
+class LineOffsetIndex(object):
+    """Byte offset of every line of parallel text files and word count of the lines of the first file.
+
+       The index is saved as .npy files, next to the first file or in index_dir, and memory-mapped when loaded
+       again, so repeated samples seek straight to the lines they draw instead of rescanning the files.
+       It is rebuilt when a file is newer than the index. Lines are split as txt_iter splits them."""
+
+    chunk_size = 1 << 20  # lines of the bucket column processed at once
+
+    def __init__(self, files, rebuild=False, index_dir=None):
+        """:arg index_dir: directory of the index files, e.g. when the files are on a read-only volume."""
+        self.files = files
+        if index_dir is None:
+            self.base_path = files[0]
+        else:
+            index_dir = os.path.expanduser(index_dir)
+            os.makedirs(index_dir, exist_ok=True)
+            # files of the same name in other directories get their own index
+            digest = hashlib.blake2b(os.path.abspath(files[0]).encode('utf-8'), digest_size=4).hexdigest()
+            self.base_path = os.path.join(index_dir, "{}.{}".format(os.path.basename(files[0]), digest))
+        self.offsets_path = self.base_path + ".lineidx.npy"
+        self.lengths_path = self.base_path + ".linelen.npy"
+
+        if rebuild or not self._is_up_to_date():
+            self.build()
+        self.offsets = np.load(self.offsets_path, mmap_mode='r')
+        self.lengths = np.load(self.lengths_path, mmap_mode='r')
+
+    def _is_up_to_date(self):
+        if not (os.path.isfile(self.offsets_path) and os.path.isfile(self.lengths_path)):
+            return False
+        index_mtime = min(os.path.getmtime(self.offsets_path), os.path.getmtime(self.lengths_path))
+        return all(os.path.getmtime(file) <= index_mtime for file in self.files)
+
+    def build(self):
+        """Scan files and save line offsets and lengths. Lines are counted in a first pass, then written block
+           by block straight into the memory-mapped index, so memory does not grow with the files."""
+        n_lines = min(_count_lines(file) for file in self.files)
+        index = np.lib.format.open_memmap(self.offsets_path, mode='w+', dtype=np.int64,
+                                          shape=(n_lines, len(self.files)))
+        lengths = np.lib.format.open_memmap(self.lengths_path, mode='w+', dtype=np.uint16, shape=(n_lines,))
+        for k, file in enumerate(self.files):
+            row = 0
+            with open(file, 'rb') as f:
+                for offsets, lines in _iter_line_blocks(f):
+                    n = min(len(lines), n_lines - row)
+                    index[row:row + n, k] = offsets[:n]
+                    if k == 0:
+                        word_counts = np.fromiter(map(len, map(bytes.split, lines[:n])), dtype=np.int64, count=n)
+                        lengths[row:row + n] = np.minimum(word_counts, 2 ** 16 - 1)
+                    row += n
+                    if row == n_lines:
+                        break
+        index.flush()
+        lengths.flush()
+        del index, lengths
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def read_lines(self, line_numbers):
+        """Read the given lines of all files, return a list of tuples."""
+        line_numbers = np.sort(np.asarray(line_numbers, dtype=np.int64))
+        columns = []
+        for k, file in enumerate(self.files):
+            lines = []
+            with open(file, 'rb') as f:
+                for offset in self.offsets[line_numbers, k].tolist():
+                    f.seek(offset)
+                    lines.append(_LINE_END.split(f.readline(), 1)[0].decode('utf-8'))
+            columns.append(lines)
+        return list(zip(*columns))
+
+    def bucket_column(self, bucket_edges):
+        """Length bucket (uint8) of every line of the first file, saved next to the index for these bucket edges
+           and memory-mapped.
+            :arg bucket_edges: increasing word counts separating buckets, at most 255 of them."""
+        if len(bucket_edges) > 255:
+            raise Exception("At most 255 bucket edges are supported.")
+        path = "{}.linebkt.{}.npy".format(self.base_path, "-".join(str(int(edge)) for edge in bucket_edges))
+        if not (os.path.isfile(path) and os.path.getmtime(path) >= os.path.getmtime(self.lengths_path)):
+            edges = np.asarray(bucket_edges)
+            column = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=(len(self),))
+            for start in range(0, len(self), self.chunk_size):
+                column[start:start + self.chunk_size] = np.searchsorted(
+                    edges, self.lengths[start:start + self.chunk_size], side='right')
+            column.flush()
+            del column
+        return np.load(path, mmap_mode='r')
+
+    def stratified_line_numbers(self, sample_num, bucket_edges, rng, allocation="proportional"):
+        """Draw line numbers stratified by length bucket of the first file's lines.
+           Ranks of lines are drawn within each bucket, then found in a chunked scan of the bucket column,
+           so memory is proportional to sample_num rather than to the number of lines.
+            :arg bucket_edges: increasing word counts separating buckets, e.g. (5, 10) for [0, 5), [5, 10), [10, ...).
+            :arg allocation: 'proportional' to bucket sizes, or 'equal' number of lines per bucket.
+            :return dict of bucket number to sorted line numbers."""
+        buckets = self.bucket_column(bucket_edges)
+        sizes = np.zeros(len(bucket_edges) + 1, dtype=np.int64)
+        for start in range(0, len(buckets), self.chunk_size):
+            sizes += np.bincount(buckets[start:start + self.chunk_size], minlength=len(sizes))
+
+        if allocation == "proportional":
+            quotas = sample_num * sizes / max(sizes.sum(), 1)
+            counts = np.floor(quotas).astype(np.int64)
+            # largest remainders get the lines left by rounding down
+            counts[np.argsort(counts - quotas)[:sample_num - counts.sum()]] += 1
+        elif allocation == "equal":
+            counts = np.full(len(sizes), sample_num // len(sizes), dtype=np.int64)
+            counts[:sample_num % len(sizes)] += 1
+        else:
+            raise Exception("allocation should be either 'proportional' or 'equal'.")
+
+        counts = np.minimum(counts, sizes)
+        ranks = {b: np.sort(rng.choice(sizes[b], counts[b], replace=False))
+                 for b in range(len(sizes)) if counts[b] > 0}
+        line_numbers = {b: np.empty(len(r), dtype=np.int64) for b, r in ranks.items()}
+        seen = np.zeros(len(sizes), dtype=np.int64)  # lines of each bucket before the chunk
+        for start in range(0, len(buckets), self.chunk_size):
+            chunk = buckets[start:start + self.chunk_size]
+            for b, r in ranks.items():
+                positions = np.flatnonzero(chunk == b)
+                lo, hi = np.searchsorted(r, (seen[b], seen[b] + len(positions)))
+                line_numbers[b][lo:hi] = start + positions[r[lo:hi] - seen[b]]
+                seen[b] += len(positions)
+        return line_numbers
+
+
+def stratified_sample(input_file, output_file, sample_num=100, bucket_edges=(5, 10, 20, 40), srcLang='eng',
+                      tgtLang="fra", allocation="proportional", seed=None, index_dir=None):
+    """Sample pairs from 2txt files stratified by source length bucket, using a saved line offset index.
+    Note: output file has to be an Excel file.
+        :arg index_dir: directory of the line offset index, next to the input files if not given."""
+
+    import pandas as pd
+
+    input_file = [input_file + "." + srcLang, input_file + "." + tgtLang]
+    index = LineOffsetIndex(input_file, index_dir=index_dir)
+    rng = np.random.default_rng(seed)
+
+    edges = [0] + list(bucket_edges)
+    labels = ["{}-{}".format(edges[b], edges[b + 1] - 1) for b in range(len(bucket_edges))] + \
+             ["{}+".format(bucket_edges[-1])]
+
+    rows = []
+    for b, line_numbers in index.stratified_line_numbers(int(sample_num), bucket_edges, rng, allocation).items():
+        rows += [pair + (labels[b],) for pair in index.read_lines(line_numbers)]
+
+    df = pd.DataFrame(rows, columns=['src_sampled', 'tgt_sampled', 'src_length_bucket'])
+    df.to_excel(output_file, header=True, index=None)
+
+
 if __name__ == '__main__':
 
     args = sys.argv[1:]  # python sample.py txt_file_with_ext output_excel_files
@@ -0,0 +1,96 @@
+import mmap
+import struct
+from array import array
+from collections.abc import Sequence
+import numpy as np
+
+# Binary layout: header (magic, number of strings, flags, position of the offsets array),
+# the concatenated UTF-8 buffer, then n + 1 little-endian uint64 offsets into that buffer,
+# followed by n int64 weights (e.g. vocabulary counts) when the weights flag is set.
+STRING_STORE_MAGIC = b"TASTORE1"
+FLAG_WEIGHTS = 1
+_HEADER = struct.Struct("<8sQQQ")
+
+
+def is_string_store(path):
+    """Check whether a file is a binary string store."""
+    with open(path, 'rb') as f:
+        return f.read(len(STRING_STORE_MAGIC)) == STRING_STORE_MAGIC
+
+
+class StringStore(Sequence):
+    """Read-only list of strings memory-mapped from a binary string store file.
+
+       Only the strings that are accessed get decoded, and all processes opening the same file
+       share one physical copy of it through the page cache."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, n, flags, offsets_pos = _HEADER.unpack_from(self._mmap, 0)
+        if magic != STRING_STORE_MAGIC:
+            raise Exception("{} is not a string store file.".format(path))
+
+        self._n = n
+        self.flags = flags
+        self.offsets = np.frombuffer(self._mmap, dtype='<u8', count=n + 1, offset=offsets_pos)
+        self.weights = None
+        if flags & FLAG_WEIGHTS:
+            self.weights = np.frombuffer(self._mmap, dtype='<i8', count=n, offset=offsets_pos + 8 * (n + 1))
+
+    @staticmethod
+    def write(path, strings, weights=None):
+        """Write strings from any iterable to a binary string store file, return the number of strings.
+            :arg weights: optional integer weight of each string, e.g. its count."""
+        flags = 0 if weights is None else FLAG_WEIGHTS
+        offsets = array('Q', [0])
+        with open(path, 'wb') as f:
+            f.write(_HEADER.pack(STRING_STORE_MAGIC, 0, 0, 0))
+            for s in strings:
+                data = s.encode('utf-8')
+                f.write(data)
+                offsets.append(offsets[-1] + len(data))
+
+            offsets_pos = f.tell()
+            f.write(np.asarray(offsets, dtype='<u8').tobytes())
+            if weights is not None:
+                weights = np.asarray(weights, dtype='<i8')
+                if len(weights) != len(offsets) - 1:
+                    raise Exception("Number of weights and strings not equal.")
+                f.write(weights.tobytes())
+            f.seek(0)
+            f.write(_HEADER.pack(STRING_STORE_MAGIC, len(offsets) - 1, flags, offsets_pos))
+
+        return len(offsets) - 1
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._n))]
+        if index < 0:
+            index += self._n
+        if not 0 <= index < self._n:
+            raise IndexError("string store index out of range")
+
+        start = _HEADER.size + int(self.offsets[index])
+        end = _HEADER.size + int(self.offsets[index + 1])
+        return self._mmap[start:end].decode('utf-8')
+
+    def __iter__(self):
+        offsets = self.offsets.tolist()
+        for start, end in zip(offsets, offsets[1:]):
+            yield self._mmap[_HEADER.size + start:_HEADER.size + end].decode('utf-8')
+
+    def take(self, indices):
+        """Decode the strings at given indices."""
+        return [self[i] for i in np.asarray(indices).tolist()]
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
@@ -1,12 +1,18 @@
 import os, codecs
-import pandas as pd, regex as re
-import html_text
-import json
-import pprint
-from bs4 import BeautifulSoup
-from lxml import etree
-from datetime import date
-from text_augmentation.utils.file_io import loads_terms_from_pickle
+from xml.sax.saxutils import escape
+from text_augmentation.utils.file_io import loads_terms_from_pickle, excel_cell_str, iter_sheet_rows
+from text_augmentation.utils.parse_cache import make_parse_cache
+
+
+def _free_element(elem):
+    """Clear an element parsed by iterparse and drop the already parsed siblings of it and of its ancestors,
+       e.g. the group of every trans-unit in MXLIFF files, to keep memory bounded."""
+    elem.clear(keep_tail=True)
+    parent = elem.getparent()
+    while parent is not None:
+        while elem.getprevious() is not None:
+            del parent[0]
+        elem, parent = parent, parent.getparent()
 
 
 class TmFileParser(object):
@@ -20,7 +26,7 @@ class TmFileParser(object):
     #   * source and target TM are placed on first two columns
     #   * header are required, the header names of first and second columns are "Source" and "Target", case-insensitive,respectively.
 
-    def __init__(self, fileType="tmx"):
+    def __init__(self, fileType="tmx", verbose=True, checkExtension=True):
 
         if fileType not in ["tmx", "mxliff", "excel", "sdlxliff", "2txt", "pickle", "xml"]:
             raise Exception("Only support tmx, mxliff, excel, sdlxliff, 2txt, pickle and xml.")
@@ -28,6 +34,13 @@ class TmFileParser(object):
         # assert tgtLang in ["eng", "fra"], "target language code must be either eng or fra."
 
         self.fileType = fileType
+        self.verbose = verbose
+        # detected formats (e.g. a TMX saved as .xml) are parsed regardless of their extension
+        self.checkExtension = checkExtension
+        self.reset()
+
+    def reset(self):
+        """Empty parsed headers, source and target texts, so the parser can be reused for another file."""
         self.headers = []
         self.srcTexts = []
         self.tgtTexts = []
@@ -35,87 +48,123 @@ class TmFileParser(object):
     def parse_excel(self, file_dir):
         """Parse TM from excel file, only first columns are inspected and header included"""
 
+        for src, tgt in self.iter_excel(file_dir):
+            self.srcTexts.append(src)
+            self.tgtTexts.append(tgt)
+
+    def iter_excel(self, file_dir):
+        """Lazily parse TM pairs from excel file. Sheet count and headers are checked when the first pair is read,
+           XLSX rows are then streamed from a read-only workbook."""
+
         base, filename = os.path.split(file_dir)
         prefix, ext = os.path.splitext(filename)
 
         if ext not in (".xlsx", ".xls"):
             raise Exception("please select a XLSX or XLS (Excel) file.")
 
-        try:
+        return self._iter_excel_pairs(file_dir, ext)
 
-            excel_file = pd.ExcelFile(file_dir)
-            if len(excel_file.sheet_names) != 1:
-                raise AssertionError("Only one sheet is allowed in Excel file.")
-            del excel_file
+    def _check_excel_headers(self, columns):
 
-            df = pd.read_excel(file_dir, dtype=str, na_filter=False)
+        if len(columns) != 2:
+            raise AssertionError("Source and target should be on the first two columns.")
+        if columns[0].strip() in ('', 'Unnamed: 0'):
+            raise AssertionError("First column name is empty.")
+        if columns[1].strip() in ('', 'Unnamed: 1'):
+            raise AssertionError("Second column name is empty.")
+        self.headers = columns
 
-            columns = list(df.columns)
+    def _iter_excel_pairs(self, file_dir, ext):
 
-            if len(columns) != 2:
-                raise AssertionError("Source and target should be on the first two columns.")
-            if columns[0].strip() == 'Unnamed: 0':
-                raise AssertionError("First column name is empty.")
-            if columns[1].strip() == 'Unnamed: 1':
-                raise AssertionError("Second column name is empty.")
+        try:
 
-            try:
-                self.srcTexts = [str(s).strip() for s in df[columns[0]]]
-            except IndexError:
-                raise IndexError("Source text column is missing.")
-            try:
-                self.tgtTexts = [str(s).strip() for s in df[columns[1]]]
-            except IndexError:
-                raise IndexError("Target text column is missing.")
+            if ext == ".xls":
+                import pandas as pd
 
-            self.headers = columns
-            # if "" in self.srcTexts:
-            #     raise AssertionError("Empty cell(s) exist in source column.")
-            # if "" in self.tgtTexts:
-            #     raise AssertionError("Empty cell(s) exist in target column.")
+                excel_file = pd.ExcelFile(file_dir)
+                if len(excel_file.sheet_names) != 1:
+                    raise AssertionError("Only one sheet is allowed in Excel file.")
+                df = excel_file.parse(dtype=str, na_filter=False)
+                self._check_excel_headers(list(df.columns))
+                for src, tgt in df.itertuples(index=False, name=None):
+                    yield str(src).strip(), str(tgt).strip()
+                return
+
+            from openpyxl import load_workbook
+
+            workbook = load_workbook(file_dir, read_only=True, data_only=True)
+            try:
+                if len(workbook.sheetnames) != 1:
+                    raise AssertionError("Only one sheet is allowed in Excel file.")
+
+                rows = iter_sheet_rows(workbook.worksheets[0])
+                header = next(rows, ())
+                if len(header) == 1:  # a header cell is missing, but its column may still hold texts
+                    header += (None,)
+                self._check_excel_headers([excel_cell_str(value) for value in header])
+
+                for row in rows:
+                    if len(row) > 2:
+                        raise AssertionError("Source and target should be on the first two columns.")
+                    row = [excel_cell_str(value).strip() for value in row] + ["", ""]
+                    yield row[0], row[1]
+            finally:
+                workbook.close()
 
         except Exception as ex:
             if type(ex).__name__ in ("AssertionError", "IndexError", "ImportError"):
                 raise Exception(ex.__str__())
-            print(ex.__str__())
+            if self.verbose:
+                print(ex.__str__())
             raise Exception("Unidentified error occurred during parsing.")
 
     def parse_tmx(self, file_dir, textTag="seg", pairTag="tu", tmxHasAlignedFilenames=False):
         """parse TM from TMX file.
            Note: this function will only extract valid TM (source and target text both exist)."""
 
+        for src, tgt in self.iter_tmx(file_dir, textTag=textTag, pairTag=pairTag,
+                                      tmxHasAlignedFilenames=tmxHasAlignedFilenames):
+            self.srcTexts.append(src)
+            self.tgtTexts.append(tgt)
+
+    def iter_tmx(self, file_dir, textTag="seg", pairTag="tu", tmxHasAlignedFilenames=False):
+        """Lazily parse TM pairs from TMX file, every pair tag is freed once it is read.
+           Note: only valid TM (source and target text both exist) are yielded."""
+
         base, filename = os.path.split(file_dir)
         prefix, ext = os.path.splitext(filename)
 
-        if ext != ".tmx":
+        if self.checkExtension and ext != ".tmx":
             raise AssertionError("Please select a TMX file.")
 
-        try:
+        return self._iter_tmx_pairs(file_dir, textTag, pairTag, tmxHasAlignedFilenames)
 
-            try:
-                with open(file_dir, 'rb') as f:
-                    raw = f.read()
+    def _iter_tmx_pairs(self, file_dir, textTag, pairTag, tmxHasAlignedFilenames):
+        from lxml import etree
 
-                soup = BeautifulSoup(raw, 'lxml')
+        try:
 
+            try:
+                context = etree.iterparse(file_dir, events=("end",), tag="{*}" + pairTag,
+                                          recover=True, huge_tree=True)
             except:
                 raise ImportError("TMX cannot be opened.")
 
-            for i, tu in enumerate(soup.findAll(pairTag)):
+            skip_first = tmxHasAlignedFilenames
+            try:
+                for _, tu in context:
 
-                pair = tu.findAll(textTag)
-                if len(pair) == 2:
-                    #self.srcTexts.append(re.sub(r'\s+', ' ', pair[0].text))
-                    #self.tgtTexts.append(re.sub(r'\s+', ' ', pair[1].text))
-                    self.srcTexts.append(pair[0].text.strip())
-                    self.tgtTexts.append(pair[1].text.strip())
+                    pair = ["".join(seg.itertext()) for seg in tu.iter("{*}" + textTag)]
+                    _free_element(tu)
 
-                # else:
-                #     raise AssertionError("#%d tu tag doesn't contain both source and target text" % i)
+                    if len(pair) == 2:
+                        if skip_first:  # first pair holds the aligned filenames
+                            skip_first = False
+                            continue
+                        yield pair[0].strip(), pair[1].strip()
 
-            if tmxHasAlignedFilenames:
-                self.srcTexts = self.srcTexts[1:]
-                self.tgtTexts = self.tgtTexts[1:]
+            except (etree.XMLSyntaxError, OSError):
+                raise ImportError("TMX cannot be opened.")
 
         except Exception as ex:
             if type(ex).__name__ in ("AssertionError", "ImportError"):
@@ -125,90 +174,96 @@ class TmFileParser(object):
     def parse_mxliff(self, file_dir):
         """extract pairs from Memsource bilingual mxliff file based on trans-origin type."""
 
+        for src, tgt in self.iter_mxliff(file_dir):
+            self.srcTexts.append(src)
+            self.tgtTexts.append(tgt)
+
+    def iter_mxliff(self, file_dir):
+        """Lazily extract pairs from Memsource bilingual mxliff file, trans-units without source or target text
+           are skipped."""
+
         base, filename = os.path.split(file_dir)
         prefix, ext = os.path.splitext(filename)
 
-        if ext != ".mxliff":
+        if self.checkExtension and ext != ".mxliff":
             raise AssertionError("Please select a MXLIFF file.")
 
-        try:
-
-            try:
-                parser = etree.XMLParser(strip_cdata=False)
-                doc = etree.parse(file_dir, parser)
-            except:
-                raise ImportError("MXLIFF cannot be opened.")
-
-            xmlNamespace = '{' + doc.getroot().nsmap[None] + '}'
-            transNodes = doc.findall('.//' + xmlNamespace + "trans-unit")
-
-            for i, trans_unit in enumerate(transNodes):
-
-                if trans_unit is not None:
-
-                    src_node = trans_unit.find('.//' + xmlNamespace + "source")  # layer 3
-                    tgt_node = trans_unit.find('.//' + xmlNamespace + "target")
-
-                    if (src_node is not None) and (tgt_node is not None):
-                        if (src_node.text is not None) and (tgt_node.text is not None):
-                            self.srcTexts.append(re.sub(r'\s+', ' ', src_node.text).strip())
-                            self.tgtTexts.append(re.sub(r'\s+', ' ', tgt_node.text).strip())
-
-                    #     else:
-                    #         raise AssertionError("Source or target text is empty in #%d trans-unit tag." % i)
-                    #
-                    # else:
-                    #     raise AssertionError("#%d trans-unit doesn't contain both source and target text." % i)
-
-        except Exception as ex:
-            if type(ex).__name__ in ("AssertionError", "ImportError"):
-                raise Exception(ex.__str__())
-            raise Exception("Unidentified error occurred during parsing.")
+        return self._iter_xliff_pairs(file_dir, "MXLIFF", "trans-unit", "source", "target")
 
     def parse_sdlxliff(self, file_dir, sdlTgtTagName="mrk"):
         """Parse TM from SDLXliff file"""
 
+        for src, tgt in self.iter_sdlxliff(file_dir, sdlTgtTagName=sdlTgtTagName):
+            self.srcTexts.append(src)
+            self.tgtTexts.append(tgt)
+
+    def iter_sdlxliff(self, file_dir, sdlTgtTagName="mrk"):
+        """Lazily parse TM pairs from SDLXliff file, target text is read from sdlTgtTagName tag in target tag.
+           Exception is raised at the first trans-unit without source or target text."""
+
         base, filename = os.path.split(file_dir)
         prefix, ext = os.path.splitext(filename)
 
-        if ext != ".sdlxliff":
+        if self.checkExtension and ext != ".sdlxliff":
             raise AssertionError("Please select a SDLXliff file.")
 
+        return self._iter_xliff_pairs(file_dir, "SDLXLIFF", "trans-unit", "source", "target",
+                                      tgtInnerTag=sdlTgtTagName, strict=True)
+
+    def _iter_xliff_pairs(self, file_dir, formatName, unitTag, srcTag, tgtTag, tgtInnerTag=None, strict=False):
+        """Shared streaming engine of XLIFF-like files: every unitTag element in the default namespace of the
+           document is read at its end tag, its first srcTag and tgtTag (or tgtInnerTag inside tgtTag) texts are
+           normalized and the element is freed.
+            :arg strict: raise on trans-units with missing source, target or text instead of skipping them."""
+        from lxml import etree
+
         try:
 
             try:
-                parser = etree.XMLParser(strip_cdata=False)
-                doc = etree.parse(file_dir, parser)
-
+                # units of any namespace, the default namespace of the root is known from the first of them
+                context = etree.iterparse(file_dir, events=("end",), tag="{*}" + unitTag,
+                                          strip_cdata=False, huge_tree=True)
             except:
-                raise ImportError("SDLXLIFF cannot be opened.")
-
-            xmlNamespace = '{' + doc.getroot().nsmap[None] + '}'
-            transNodes = doc.findall('.//' + xmlNamespace + "trans-unit")
-
-            for i, trans_unit in enumerate(transNodes):
-
-                if trans_unit is not None:
-                    try:
-                        src_node = trans_unit.find('.//' + xmlNamespace + "source")  # layer 3
-                    except:
-                        raise IndexError("#%d trans-unit tag doesn't contain source tag." % i)
-                    try:
-                        tgt_node = trans_unit.find('.//' + xmlNamespace + "target").find('.//' + xmlNamespace + sdlTgtTagName)
-                    except:
-                        raise IndexError("#%d trans-unit tag doesn't contain target tag." % i)
+                raise ImportError("{} cannot be opened.".format(formatName))
 
+            unitName = None
+            try:
+                i = 0
+                for _, trans_unit in context:
+
+                    if unitName is None:
+                        nsmap = trans_unit.getroottree().getroot().nsmap
+                        xmlNamespace = '{' + nsmap[None] + '}' if None in nsmap else ''
+                        unitName = xmlNamespace + unitTag
+                        srcPath = './/' + xmlNamespace + srcTag
+                        tgtPath = './/' + xmlNamespace + tgtTag
+                        tgtInnerPath = None if tgtInnerTag is None else './/' + xmlNamespace + tgtInnerTag
+                    if trans_unit.tag != unitName:
+                        continue
+
+                    src_node = trans_unit.find(srcPath)
+                    tgt_node = trans_unit.find(tgtPath)
+                    if tgtInnerPath is not None:
+                        if tgt_node is None:
+                            raise IndexError("#%d trans-unit tag doesn't contain target tag." % i)
+                        tgt_node = tgt_node.find(tgtInnerPath)
+
+                    src = tgt = None
                     if (src_node is not None) and (tgt_node is not None):
-                        if (src_node.text is not None) and (tgt_node.text is not None):
-                            self.srcTexts.append(re.sub(r'\s+', ' ', src_node.text).strip())
-                            self.tgtTexts.append(re.sub(r'\s+', ' ', tgt_node.text).strip())
-
-                        else:
+                        src, tgt = src_node.text, tgt_node.text
+                        if strict and (src is None or tgt is None):
                             raise AssertionError("Source or target text is empty in #%d trans-unit tag." % i)
-
-                    else:
+                    elif strict:
                         raise AssertionError("#%d trans-unit doesn't contain both source and target text." % i)
 
+                    _free_element(trans_unit)
+                    i += 1
+                    if (src is not None) and (tgt is not None):
+                        yield " ".join(src.split()), " ".join(tgt.split())
+
+            except (etree.XMLSyntaxError, OSError):
+                raise ImportError("{} cannot be opened.".format(formatName))
+
         except Exception as ex:
             if type(ex).__name__ in ("AssertionError", "ImportError", "IndexError"):
                 raise Exception(ex.__str__())
@@ -243,7 +298,7 @@ class TmFileParser(object):
         if ext != ".pkl":
             raise AssertionError("Please select a pickle file.")
 
-        data = loads_terms_from_pickle(file_dir)
+        data = loads_terms_from_pickle(file_dir, verbose=self.verbose)
         try:
             self.srcTexts = data['source'].tolist()
             self.tgtTexts = data['target'].tolist()
@@ -251,47 +306,44 @@ class TmFileParser(object):
             raise Exception(ex.__str__())
 
     def parse_xml(self, file_dir):
-        
+        """Parse TM from XML file of seg tags holding src and tgt tags."""
+
+        for src, tgt in self.iter_xml(file_dir):
+            self.srcTexts.append(src)
+            self.tgtTexts.append(tgt)
+
+    def iter_xml(self, file_dir):
+        """Lazily parse TM pairs from XML file, segs without source or target text are skipped."""
+
         base, filename = os.path.split(file_dir)
         prefix, ext = os.path.splitext(filename)
 
         if ext != ".xml":
             raise AssertionError("Please select a XML file.")
 
-        try:
-
-            try:
-                parser = etree.XMLParser(strip_cdata=False)
-                doc = etree.parse(file_dir, parser)
-            except:
-                raise ImportError("MXLIFF cannot be opened.")
-
-            xmlNamespace = '{' + doc.getroot().nsmap[None] + '}'
-            # xmlNamespace = "{}"
-            bi_segs = doc.findall('.//' + xmlNamespace + "seg")
-
-            for i, seg in enumerate(bi_segs):
-
-                if seg is not None:
-
-                    src_node = seg.find('.//' + xmlNamespace + "src")  # layer 3
-                    tgt_node = seg.find('.//' + xmlNamespace + "tgt")
-
-                    if (src_node is not None) and (tgt_node is not None):
-                        if (src_node.text is not None) and (tgt_node.text is not None):
-                            self.srcTexts.append(re.sub(r'\s+', ' ', src_node.text).strip())
-                            self.tgtTexts.append(re.sub(r'\s+', ' ', tgt_node.text).strip())
-                    #
-                    # else:
-                    #     raise AssertionError("#%d trans-unit doesn't contain both source and target text." % i)
-
-        except Exception as ex:
-            if type(ex).__name__ in ("AssertionError", "ImportError"):
-                raise Exception(ex.__str__())
-            raise Exception("Unidentified error occurred during parsing.")
-
-    def parse(self, file_dir, textTag="seg", tmxHasAlignedFilenames=False, sdlTgtTagName="mrk"):
-        """parse TM files and source text and target text are in self.srcTexts and self.tgtTexts."""
+        return self._iter_xliff_pairs(file_dir, "XML", "seg", "src", "tgt")
+
+    def parse(self, file_dir, textTag="seg", tmxHasAlignedFilenames=False, sdlTgtTagName="mrk", cache=None):
+        """parse TM files and source text and target text are in self.srcTexts and self.tgtTexts.
+            :arg cache: ParseCache or cache directory. Pairs parsed before from the same files with the same
+                        options are read from it, self.srcTexts and self.tgtTexts are then read-only
+                        memory-mapped sequences."""
+
+        self.reset()
+
+        cache = make_parse_cache(cache)
+        if cache is not None:
+            key = cache.key(file_dir, fileType=self.fileType, textTag=textTag,
+                            tmxHasAlignedFilenames=tmxHasAlignedFilenames, sdlTgtTagName=sdlTgtTagName)
+            cached = cache.get(key)
+            if cached is None:
+                self.parse(file_dir, textTag=textTag, tmxHasAlignedFilenames=tmxHasAlignedFilenames,
+                           sdlTgtTagName=sdlTgtTagName)
+                cached = cache.put(key, self.srcTexts, self.tgtTexts)
+            elif self.verbose:
+                print("\n\tThe number of TM pairs read from cache: {}".format(len(cached)))
+            self.srcTexts, self.tgtTexts = cached.srcTexts, cached.tgtTexts
+            return
 
         if self.fileType == "excel":
             self.parse_excel(file_dir)
@@ -319,34 +371,91 @@ class TmFileParser(object):
 
         # verify if lengths are equal on both sides
         if len(self.srcTexts) != len(self.tgtTexts):
-            print("length of src text: {} \nlength of tgt text: {}".format(len(self.srcTexts), len(self.tgtTexts)))
+            if self.verbose:
+                print("length of src text: {} \nlength of tgt text: {}".format(len(self.srcTexts), len(self.tgtTexts)))
             raise Exception("Lengths of source and target TM not equal.")
 
         # verify if source or/and target texts are empty
         if set(self.srcTexts) == {''} or set(self.tgtTexts) == {''} or self.srcTexts == [] or self.tgtTexts == []:
-            print("source or/and target texts are empty")
+            if self.verbose:
+                print("source or/and target texts are empty")
             raise Exception("Source or/and target texts are empty.")
 
         # final_pairs = [p for p in zip(self.srcTexts, self.tgtTexts) if p[0] and p[1]]
         # self.srcTexts = [p[0] for p in final_pairs]
         # self.tgtTexts = [p[1] for p in final_pairs]
 
-        print("\n\tThe number of TM pairs parsed: {}".format(len(self.srcTexts)))
+        if self.verbose:
+            print("\n\tThe number of TM pairs parsed: {}".format(len(self.srcTexts)))
+
+
+# serialization of the former BeautifulSoup (HTML tree builder) extraction: lowercase qualified names,
+# attributes sorted by name, HTML void elements self-closed when empty and other empty elements expanded
+_VOID_ELEMENTS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "keygen", "link", "menuitem", "meta",
+                  "param", "source", "track", "wbr", "basefont", "bgsound", "command", "frame", "image", "isindex",
+                  "nextid", "spacer"}
+_XML_NAMESPACE = "http://www.w3.org/XML/1998/namespace"
+
+
+def _qualified_name(name, nsmap):
+    """prefix:localname of a Clark notation name ({namespace}localname), localname in the default namespace."""
+    if not name.startswith("{"):
+        return name.lower()
+    namespace, localname = name[1:].split("}", 1)
+    if namespace == _XML_NAMESPACE:
+        return "xml:" + localname.lower()
+    for prefix, uri in nsmap.items():
+        if uri == namespace and prefix is not None:
+            return (prefix + ":" + localname).lower()
+    return localname.lower()
+
+
+def _quote_attribute(value):
+    value = escape(value)
+    if '"' in value:
+        if "'" in value:
+            return '"{}"'.format(value.replace('"', "&quot;"))
+        return "'{}'".format(value)
+    return '"{}"'.format(value)
+
+
+def _inner_markup(elem):
+    """Markup inside an element, serialized as the former BeautifulSoup extraction did (namespace prefixes kept)."""
+    from lxml import etree
+
+    parts = [escape(elem.text or "")]
+    for child in elem:
+        if isinstance(child, etree._Comment):
+            parts.append("<!--{}-->".format(child.text or ""))
+        elif isinstance(child.tag, str):
+            nsmap = child.nsmap
+            name = _qualified_name(child.tag, nsmap)
+            attrs = "".join(" {}={}".format(k, _quote_attribute(v)) for k, v in
+                            sorted((_qualified_name(k, nsmap), v) for k, v in child.attrib.items()))
+            content = _inner_markup(child)
+            if not content and name in _VOID_ELEMENTS:
+                parts.append("<{}{}/>".format(name, attrs))
+            else:
+                parts.append("<{}{}>{}</{}>".format(name, attrs, content, name))
+        parts.append(escape(child.tail or ""))
+    return "".join(parts)
+
+
+def iter_mqxliff(file, tag_name='source'):
+    """Lazily read the inner markup of every tag_name tag of a memoQ mqxliff file, in bounded memory.
+       Unlike the former BeautifulSoup extraction, the tag_name tag itself is always removed, it was kept
+       at the start of the text when the tag had no attribute."""
+    from lxml import etree
+
+    for _, node in etree.iterparse(file, events=("end",), tag="{*}" + tag_name, recover=True, huge_tree=True):
+        text = _inner_markup(node)
+        _free_element(node)
+        yield text
 
 
 def parse_mqxliff(file, tag_name='source'):
 
-    with open(file, 'rb') as f:
-        content = f.read()
-
-    soup = BeautifulSoup(content)
-    text_nodes = soup.find_all(tag_name)
-    srcTexts = []
-    if text_nodes:
-        pattern = r"(<" + re.escape(tag_name) + r"\s*[^>]+>)|(</" + re.escape(tag_name) + r">)"
-        srcTexts = [re.sub(pattern, "", node.__str__()) for node in text_nodes]
-
-    return srcTexts
+    return list(iter_mqxliff(file, tag_name=tag_name))
 
 
 def test_TmParser():
@@ -0,0 +1,100 @@
+from array import array
+import numpy as np
+
+
+def sample_positions(rng, lengths, k):
+    """Draw k distinct positions in range(length) for every length of a batch at once.
+       The j-th position is drawn among the length - j positions still free and shifted past the ones taken,
+       so no per-sentence numpy call is needed. Rows whose length is smaller than k must be ignored by the caller."""
+    lengths = np.asarray(lengths, dtype=np.int64)
+    positions = np.zeros((len(lengths), k), dtype=np.int64)
+
+    for j in range(k):
+        pos = (rng.random(len(lengths)) * np.maximum(lengths - j, 0)).astype(np.int64)
+        taken = np.sort(positions[:, :j], axis=1)
+        for c in range(j):
+            pos += pos >= taken[:, c]
+        positions[:, j] = pos
+
+    return positions
+
+
+def distinct_positions(rng, n, k):
+    """Draw k distinct positions in range(n) for a single sentence, with the scheme of sample_positions,
+       from one call of rng. Positions are in drawing order."""
+    if k > n:
+        raise ValueError("Cannot draw {} distinct positions out of {}.".format(k, n))
+    return positions_from_uniforms(rng.random(k).tolist(), n)
+
+
+def positions_from_uniforms(uniforms, n):
+    """Map uniform numbers in [0, 1) to as many distinct positions in range(n), see distinct_positions."""
+    positions = []
+    for j, u in enumerate(uniforms):
+        pos = int(u * (n - j))
+        for taken in sorted(positions):
+            pos += pos >= taken
+        positions.append(pos)
+    return positions
+
+
+class TokenizedCorpus(object):
+    """Sentences tokenized once into a flat int32 array of token ids and an array of sentence offsets (CSR layout),
+       sentence i being ids[offsets[i]:offsets[i + 1]].
+       Ids below len(vocab) refer to vocabulary words, the others to corpus words missing from the vocabulary."""
+
+    def __init__(self, ids, offsets, vocab, extra_words):
+        self.ids = ids
+        self.offsets = offsets
+        self.vocab = vocab
+        self.extra_words = extra_words
+
+    @classmethod
+    def from_texts(cls, texts, vocab):
+        """Tokenize texts on whitespace and map the words to ids of vocab."""
+        word_to_id = {w: i for i, w in enumerate(vocab)}
+        n_vocab = len(vocab)  # not len(word_to_id), vocab may hold duplicates
+        extra = {}
+        ids = array('i')
+        offsets = array('q', [0])
+
+        for text in texts:
+            for word in text.split():
+                i = word_to_id.get(word)
+                if i is None:
+                    i = extra.setdefault(word, n_vocab + len(extra))
+                ids.append(i)
+            offsets.append(len(ids))
+
+        return cls(np.frombuffer(ids, dtype=np.int32).copy(), np.frombuffer(offsets, dtype=np.int64).copy(),
+                   vocab, list(extra))
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def with_ids(self, ids, offsets):
+        """New corpus with other ids sharing this corpus' word tables."""
+        return TokenizedCorpus(ids, offsets, self.vocab, self.extra_words)
+
+    def word(self, i):
+        n_vocab = len(self.vocab)
+        return self.vocab[i] if i < n_vocab else self.extra_words[i - n_vocab]
+
+    def detokenize(self, index):
+        """Text of sentence index."""
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return " ".join(map(self.word, self.ids[start:end].tolist()))
+
+    def __iter__(self):
+        ids = self.ids.tolist()
+        offsets = self.offsets.tolist()
+        word = self.word
+        for start, end in zip(offsets, offsets[1:]):
+            yield " ".join(map(word, ids[start:end]))
+
+    def to_texts(self):
+        return list(self)
@@ -0,0 +1,46 @@
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+
+def chunk_ranges(file, chunk_size=16 * 2 ** 20):
+    """Split a text file into (file, start, end) byte ranges of about chunk_size that end on line boundaries."""
+    size = os.path.getsize(file)
+    ranges = []
+    with open(file, 'rb') as f:
+        start = 0
+        while start < size:
+            f.seek(start + chunk_size)
+            f.readline()  # finish the line the chunk ends in
+            end = min(max(f.tell(), start + chunk_size), size)
+            ranges.append((file, start, end))
+            start = end
+    return ranges
+
+
+def count_chunk(chunk):
+    """Count whitespace separated tokens of one (file, start, end) byte range."""
+    file, start, end = chunk
+    with open(file, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start).decode('utf-8', errors='replace')
+    return Counter(text.split())
+
+
+def build_vocab_counts(files, n_jobs=1, chunk_size=16 * 2 ** 20, min_count=1, max_size=None):
+    """Count tokens of any number of text files, chunk by chunk, in n_jobs processes and merge the counts.
+        :arg min_count: drop tokens seen less often.
+        :arg max_size: keep only the max_size most frequent tokens.
+        :return list of (token, count), most frequent first."""
+    chunks = [chunk for file in files for chunk in chunk_ranges(file, chunk_size)]
+    total = Counter()
+
+    if n_jobs == 1:
+        for chunk in chunks:
+            total.update(count_chunk(chunk))
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            for counts in executor.map(count_chunk, chunks):
+                total.update(counts)
+
+    return [(w, c) for w, c in total.most_common(max_size) if c >= min_count]
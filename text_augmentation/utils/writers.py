@@ -0,0 +1,175 @@
+import os
+import csv
+import json
+from abc import ABC, abstractmethod
+
+EXCEL_MAX_ROWS = 1048576
+
+
+class PairWriter(ABC):
+    """Base of the streaming writers: pairs (or rows) are buffered and flushed every chunk_size rows,
+       so memory does not grow with the number of rows written. Writers implement _write_chunk and _close."""
+
+    def __init__(self, chunk_size=10000):
+        self.chunk_size = chunk_size
+        self.buffer = []
+        self.num_written = 0
+
+    def write(self, pair):
+        self.buffer.append(pair)
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def write_pairs(self, pairs):
+        """Write pairs from any iterable, return the total number of pairs written."""
+        for pair in pairs:
+            self.write(pair)
+        return self.num_written + len(self.buffer)
+
+    def flush(self):
+        if self.buffer:
+            self._write_chunk(self.buffer)
+            self.num_written += len(self.buffer)
+            self.buffer = []
+
+    def close(self):
+        self.flush()
+        self._close()
+
+    @abstractmethod
+    def _write_chunk(self, pairs):
+        """Write buffered pairs to the output."""
+
+    @abstractmethod
+    def _close(self):
+        """Close the output."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class TwoTxtPairWriter(PairWriter):
+    """Write source and target texts to two text files, one text per line."""
+
+    def __init__(self, files, chunk_size=10000):
+        super().__init__(chunk_size)
+        self.files = [open(file, 'w') for file in files]
+
+    def _write_chunk(self, pairs):
+        for k, f in enumerate(self.files):
+            f.write("".join(pair[k].strip() + '\n' for pair in pairs))
+
+    def _close(self):
+        for f in self.files:
+            f.close()
+
+
+class TsvPairWriter(PairWriter):
+    """Write rows to a tab separated file with a header, texts holding tabs or newlines are quoted."""
+
+    def __init__(self, file, columns=("source", "target"), chunk_size=10000):
+        super().__init__(chunk_size)
+        self.file = open(file, 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file, dialect='excel-tab')
+        self.writer.writerow(columns)
+
+    def _write_chunk(self, pairs):
+        self.writer.writerows(pairs)
+
+    def _close(self):
+        self.file.close()
+
+
+class JsonlPairWriter(PairWriter):
+    """Write one JSON object per row, keyed by column names."""
+
+    def __init__(self, file, columns=("source", "target"), chunk_size=10000):
+        super().__init__(chunk_size)
+        self.file = open(file, 'w', encoding='utf-8')
+        self.columns = columns
+
+    def _write_chunk(self, pairs):
+        self.file.write("".join(json.dumps(dict(zip(self.columns, pair)), ensure_ascii=False) + '\n'
+                                for pair in pairs))
+
+    def _close(self):
+        self.file.close()
+
+
+class XlsxPairWriter(PairWriter):
+    """Write rows to Excel with an openpyxl write-only workbook, which keeps rows on disk until it is saved.
+
+       When a sheet reaches max_rows (header included), writing goes on in a new sheet ('sheet' rollover)
+       or in a new file named <name>.<n>.xlsx ('file' rollover, default, as TmFileParser reads one sheet only)."""
+
+    def __init__(self, file, columns=("source", "target"), chunk_size=10000, max_rows=EXCEL_MAX_ROWS,
+                 rollover="file"):
+        super().__init__(chunk_size)
+        from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+        if rollover not in ("file", "sheet"):
+            raise Exception("rollover should be either 'file' or 'sheet'.")
+
+        self.file = file
+        self.files = []
+        self.columns = list(columns)
+        self.max_rows = max_rows
+        self.rollover = rollover
+        self.illegal_chars = ILLEGAL_CHARACTERS_RE
+        self.workbook = None
+        self._new_workbook()
+
+    def _new_workbook(self):
+        from openpyxl import Workbook
+
+        if self.files:
+            base, ext = os.path.splitext(self.file)
+            self.files.append("{}.{}{}".format(base, len(self.files) + 1, ext))
+        else:
+            self.files.append(self.file)
+        self.workbook = Workbook(write_only=True)
+        self._new_sheet()
+
+    def _new_sheet(self):
+        self.sheet = self.workbook.create_sheet()
+        self.sheet.append(self.columns)
+        self.sheet_rows = 1
+
+    def _save_workbook(self):
+        self.workbook.save(self.files[-1])
+        self.workbook = None
+
+    def _write_chunk(self, pairs):
+        for pair in pairs:
+            if self.sheet_rows >= self.max_rows:
+                if self.rollover == "sheet":
+                    self._new_sheet()
+                else:
+                    self._save_workbook()
+                    self._new_workbook()
+
+            self.sheet.append([self.illegal_chars.sub('', v) if isinstance(v, str) else v for v in pair])
+            self.sheet_rows += 1
+
+    def _close(self):
+        if self.workbook is not None:
+            self._save_workbook()
+
+
+def get_pair_writer(output_file, columns=("source", "target"), **kwargs):
+    """Writer for output file(s): a list of two text files, or a .xlsx, .jsonl or .tsv file."""
+    if (type(output_file) is list) and len(output_file) == 2:
+        return TwoTxtPairWriter(output_file, **kwargs)
+
+    ext = os.path.splitext(output_file)[1] if type(output_file) is str else None
+    if ext == ".xlsx":
+        return XlsxPairWriter(output_file, columns=columns, **kwargs)
+    if ext == ".jsonl":
+        return JsonlPairWriter(output_file, columns=columns, **kwargs)
+    if ext == ".tsv":
+        return TsvPairWriter(output_file, columns=columns, **kwargs)
+
+    raise Exception("output file not supported.")